@@ -4,42 +4,36 @@ import sys
 import time
 import logging
 import argparse as ap
-import gzip
-import shutil
+import pysam
 
 from sequenoscope.utils.__init__ import format_time
-from sequenoscope.constant import SequenceTypes
+from sequenoscope.constant import SequenceTypes, DefaultValues
 from sequenoscope.version import __version__
 from sequenoscope.utils.parser import GeneralSeqParser 
 from sequenoscope.utils.sequence_class import Sequence
 from sequenoscope.analyze.minimap2 import Minimap2Runner
 from sequenoscope.analyze.fastP import FastPRunner
 from sequenoscope.analyze.processing import SamBamProcessor
+from sequenoscope.analyze.fastq_scanner import FastqScanner
 from sequenoscope.analyze.fastq_extractor import FastqExtractor
 from sequenoscope.analyze.seq_manifest import SeqManifest
 from sequenoscope.utils.parser import FastqPairedEndRenamer
 from sequenoscope.analyze.seq_manifest import SeqManifestSummary
-from sequenoscope.analyze.mash import MashSketcher
+from sequenoscope.analyze.minhash import MinHashSketcher
+from sequenoscope.analyze.scheduler import StageScheduler
+from sequenoscope.analyze.checkpoint import StageCheckpoint
+from sequenoscope.analyze.profiler import StageProfiler
+from sequenoscope.analyze.bam import BamProcessor
+from sequenoscope.analyze.coverage_cache import CoverageCache
+from sequenoscope.analyze.live_bam import IncrementalBamProcessor
+from sequenoscope.analyze.mappy_aligner import MappyAligner, mappy
+from sequenoscope.analyze.read_sampler import ReadSampler
+from sequenoscope.analyze.manifest_writer import MANIFEST_FORMATS, pa
 import warnings
 warnings.simplefilter('always', UserWarning)
 
 
-def decompress_gz_file(gz_path, dest_dir):
-    """
-    Decompress a .gz file into dest_dir.
-    
-    Returns the path to the decompressed file.
-    """
-    base_name = os.path.basename(gz_path)
-    if base_name.endswith('.gz'):
-        out_file = os.path.join(dest_dir, base_name[:-3])
-        with gzip.open(gz_path, 'rb') as f_in, open(out_file, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-        return out_file
-    return gz_path
-
-
-def parse_args():
+def parse_args(argv=None):
     parser = ap.ArgumentParser(
         prog="sequenoscope",
         usage="sequenoscope analyze --input_fastq <file.fq> --input_reference <ref.fasta> -o <out> -seq_type <sr> [options]\nFor help use: sequenoscope analyze -h or --help",
@@ -66,12 +60,18 @@ def parse_args():
     filter_group = parser.add_argument_group("FILTER OPTIONS", "Parameters to filter/trim FASTQ reads.")
     filter_group.add_argument("-min_cov", "--minimum_coverage", default=1, metavar="", type=int,
                         help="Minimum coverage threshold; default is 1.")
+    filter_group.add_argument("-cov_thresholds", "--coverage_thresholds", metavar="", type=int, nargs="+",
+                        help="Additional coverage thresholds reported as taxon_covered_bases_<N>X columns, e.g. 5 10 20.")
     filter_group.add_argument("-t", "--threads", default=1, metavar="", type=int,
                         help="Number of threads to use.")
     filter_group.add_argument("-min_len", "--minimum_read_length", default=15, metavar="", type=int,
                         help="Minimum read length; default is 15.")
     filter_group.add_argument("-max_len", "--maximum_read_length", default=0, metavar="", type=int,
                         help="Maximum read length; default is 0 (no limit).")
+    filter_group.add_argument("--max_reads", default=0, metavar="", type=int,
+                        help="Analyze a reproducible uniform sample of at most this many reads (read pairs for PE); default is 0 (all reads).")
+    filter_group.add_argument("--max_bases", default=0, metavar="", type=int,
+                        help="Analyze a reproducible uniform sample of at most this many bases; default is 0 (all bases). Summary totals and coverage are scaled to the full input.")
     filter_group.add_argument("-trm_fr", "--trim_front_bp", default=0, metavar="", type=int,
                         help="Bases to trim from the front; default is 0.")
     filter_group.add_argument("-trm_tail", "--trim_tail_bp", default=0, metavar="", type=int,
@@ -81,13 +81,29 @@ def parse_args():
 
     # Note: Start and end times are fixed internally to 0 and 100 when no sequencing summary is provided.
     # Note: The minimap2 kmer option has been removed; kmer size defaults to 15.
+    parser.add_argument('--manifest_format', default='tsv', metavar="", choices=list(MANIFEST_FORMATS),
+                        help="Manifest file format: tsv, parquet or feather; default is tsv. The columnar formats require pyarrow.")
+    parser.add_argument('--sparse_coverage', action='store_true',
+                        help="Store per-contig coverage run-length encoded when smaller; lowers memory for large multi-genome references.")
+    parser.add_argument('--coverage_cache', metavar="",
+                        help="(Optional) Directory for caching per-contig coverage keyed by the input reads, reference and alignment options, reused when the same sample is re-analyzed.")
+    parser.add_argument('--index_cache', metavar="",
+                        help="(Optional) Directory for minimap2 reference indexes keyed by the reference hash, preset and kmer size; built once and shared across runs.")
+    parser.add_argument('--aligner', default='minimap2', metavar="", choices=['minimap2', 'mappy'],
+                        help="Alignment engine: minimap2 or mappy; default is minimap2. mappy aligns in-process with the minimap2 python bindings and feeds coverage directly, without SAM/BAM files or samtools.")
+    parser.add_argument('--write_bam', action='store_true',
+                        help="With --aligner mappy, also write a sorted and indexed BAM file and the mapped-read FASTQ.")
     parser.add_argument('--force', action='store_true', help="Force overwrite of existing results directory.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Resume an earlier run in the existing results directory, skipping stages whose inputs and options are unchanged and whose outputs are present.")
+    parser.add_argument('--resume_checksum', action='store_true',
+                        help="Fingerprint stage inputs and coverage cache keys by SHA256 rather than size and modification time.")
     parser.add_argument('-v', '--version', action='version', version="%(prog)s " + __version__)
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
-def run():
-    args = parse_args()
+def run(argv=None):
+    args = parse_args(argv)
     input_fastq = args.input_fastq
     input_reference = args.input_reference
     seq_summary = args.sequencing_summary
@@ -98,11 +114,23 @@ def run():
     minimap_kmer_size = 15  # default value; option removed
     min_len = args.minimum_read_length
     max_len = args.maximum_read_length
+    max_reads = args.max_reads
+    max_bases = args.max_bases
+    sampling = max_reads > 0 or max_bases > 0
     trim_front = args.trim_front_bp
     trim_tail = args.trim_tail_bp
     quality_threshold = args.quality_threshold
     min_cov = args.minimum_coverage
+    coverage_thresholds = args.coverage_thresholds
     force = args.force
+    resume = args.resume
+    resume_checksum = args.resume_checksum
+    sparse_coverage = args.sparse_coverage
+    manifest_format = args.manifest_format
+    coverage_cache = args.coverage_cache
+    index_cache = args.index_cache
+    aligner = args.aligner
+    write_bam = args.write_bam
 
     # Fixed default times when no sequencing summary is provided.
     start_time_default = 0
@@ -111,8 +139,8 @@ def run():
     # Setup output directory (final outputs: manifests and log remain in out_directory)
     if not os.path.isdir(out_directory):
         os.mkdir(out_directory, 0o755)
-    elif not force:
-        print(f"Error: Directory {out_directory} already exists. Use --force to overwrite.", file=sys.stderr)
+    elif not force and not resume:
+        print(f"Error: Directory {out_directory} already exists. Use --force to overwrite or --resume to continue an earlier run.", file=sys.stderr)
         sys.exit()
 
     # Create an intermediates subdirectory for all intermediary files.
@@ -120,22 +148,14 @@ def run():
     if not os.path.isdir(intermediate_dir):
         os.mkdir(intermediate_dir, 0o755)
 
-    # Check and decompress gz FASTQ files if necessary.
-    decompressed_fastq = []
-    for fq in input_fastq:
-        if fq.endswith(".gz"):
-            # Decompress into intermediate folder.
-            decompressed = decompress_gz_file(fq, intermediate_dir)
-            decompressed_fastq.append(decompressed)
-        else:
-            decompressed_fastq.append(fq)
-    input_fastq = decompressed_fastq
+    # Gzipped FASTQ files are used as-is: fastp and minimap2 read them natively and the
+    # Python-side readers stream-decompress them without writing a plain-text copy.
 
     # Setup logging (log file remains in out_directory)
     log_filepath = os.path.join(out_directory, "analyze.log")
     logger = logging.getLogger("sequenoscope_analyze")
     logger.setLevel(logging.INFO)
-    fh = logging.FileHandler(log_filepath, mode='w')
+    fh = logging.FileHandler(log_filepath, mode='a' if resume else 'w')
     fh.setLevel(logging.INFO)
     formatter = logging.Formatter('%(asctime)s [%(levelname)s]: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
     fh.setFormatter(formatter)
@@ -154,6 +174,8 @@ def run():
         logger.error("Single-end specified but received multiple FASTQ files.")
         print("Error: Single-end sequencing requires exactly 1 FASTQ file.", file=sys.stderr)
         sys.exit()
+    paired_input = seq_class.upper() == SequenceTypes.paired_end
+    use_seq_summary = seq_summary is not None and GeneralSeqParser.check_seq_summary(seq_summary)
 
     logger.info("Input Parameters:")
     logger.info("-" * 40)
@@ -168,10 +190,30 @@ def run():
     logger.info(f"Threads: {threads}")
     logger.info(f"Minimum read length: {min_len}")
     logger.info(f"Maximum read length: {max_len}")
+    if sampling:
+        logger.info(f"Read sample budget: {max_reads or 'unlimited'} reads, {max_bases or 'unlimited'} bases")
     logger.info(f"Trim front bases: {trim_front}")
     logger.info(f"Trim tail bases: {trim_tail}")
     logger.info(f"Quality threshold: {quality_threshold}")
     logger.info(f"Minimum coverage: {min_cov}")
+    if coverage_thresholds:
+        logger.info(f"Additional coverage thresholds: {', '.join(str(t) for t in coverage_thresholds)}")
+    if manifest_format != 'tsv' and pa is None:
+        logger.error(f"The {manifest_format} manifest format requires the pyarrow package.")
+        print(f"Error: The {manifest_format} manifest format requires the pyarrow package; install it or use --manifest_format tsv.", file=sys.stderr)
+        sys.exit(1)
+    logger.info(f"Manifest format: {manifest_format}")
+    if aligner == 'mappy' and mappy is None:
+        logger.error("The mappy aligner requires the mappy package.")
+        print("Error: The mappy aligner requires the mappy package; install it or use --aligner minimap2.", file=sys.stderr)
+        sys.exit(1)
+    logger.info(f"Aligner: {aligner}")
+    logger.info(f"Sparse coverage: {sparse_coverage}")
+    logger.info(f"Resume: {resume}")
+    if coverage_cache:
+        logger.info(f"Coverage cache: {coverage_cache}")
+    if index_cache:
+        logger.info(f"Minimap2 index cache: {index_cache}")
     logger.info(f"Minimap2 kmer size (default): {minimap_kmer_size}")
     logger.info("-" * 40)
     logger.info("All input parameters validated successfully.")
@@ -197,161 +239,310 @@ def run():
     print(f"sequenoscope analyze version {__version__}: Analyzing reads...")
     print("-" * 40)
 
-    logger.info("Creating Sequence object for input FASTQ files.")
-    sequencing_sample = Sequence("Test", input_fastq)
-
-    logger.info("Extracting reads with FastqExtractor.")
-    print("-" * 40)
-    print("Processing FASTQ file(s)...")
-    print("-" * 40)
-    extractor_run = FastqExtractor(sequencing_sample, out_prefix=f"{out_prefix}_read_list", out_dir=intermediate_dir)
-
-    if seq_class.upper() == SequenceTypes.paired_end:
-        logger.info("Extracting and renaming paired-end reads.")
-        extractor_run.extract_paired_reads()
-        rename_read_ids_run = FastqPairedEndRenamer(sequencing_sample, extractor_run.result_files["read_list_file"],
-                                                    out_prefix=f"{out_prefix}_renamed_reads", out_dir=intermediate_dir)
-        rename_read_ids_run.rename()
-        logger.info("Renaming complete. Updating sequence object.")
-        sequencing_sample = Sequence("Test", rename_read_ids_run.result_files["fastq_file_renamed"])
-        extractor_run = FastqExtractor(sequencing_sample, out_prefix=f"{out_prefix}_read_list", out_dir=intermediate_dir)
-        extractor_run.alt_extract_paired_reads()
-    else:
+    # Independent stages run concurrently: the read scan overlaps fastp, and the MinHash sketch and the
+    # mapped-read FASTQ extraction overlap minimap2 and the manifest. Heavy stages leave one
+    # thread of the budget free for the light single-threaded stages running next to them.
+    worker_threads = max(1, threads - 1)
+    profiler = StageProfiler()
+    scheduler = StageScheduler(threads=threads, logger=logger, profiler=profiler)
+
+    def sample_reads():
+        print("-" * 40)
+        print("Sampling reads within the read budget...")
+        print("-" * 40)
+        logger.info("Drawing a uniform sample of reads.")
+        sampler_run = ReadSampler(Sequence("Test", input_fastq), out_prefix=f"{out_prefix}_sampled_reads", out_dir=intermediate_dir,
+                                  max_reads=max_reads, max_bases=max_bases)
+        sampler_run.sample()
+        logger.info(f"Sampled {sampler_run.sampled_reads} of {sampler_run.total_reads} reads and "
+                    f"{sampler_run.sampled_bases} of {sampler_run.total_bases} bases (sampling fraction {sampler_run.sampling_fraction():.4f}).")
+        return {"fastq_files": list(sampler_run.result_files["fastq_files"]),
+                "sampling_fraction": sampler_run.sampling_fraction()}
+
+    def input_reads():
+        # With a read budget the sampled reads stand in for the input FASTQ files
+        if sampling:
+            return scheduler.results["sample_reads"]["fastq_files"]
+        return list(input_fastq)
+
+    def prepare_reads():
+        logger.info("Creating Sequence object for input FASTQ files.")
+        read_files = input_reads()
+        sequencing_sample = Sequence("Test", read_files)
+        print("-" * 40)
+        print("Processing FASTQ file(s)...")
+        print("-" * 40)
+        if paired_input:
+            # Renaming also writes the read list and read table, so paired-end reads skip scan_reads
+            logger.info("Renaming paired-end reads.")
+            rename_read_ids_run = FastqPairedEndRenamer(sequencing_sample, out_prefix=f"{out_prefix}_renamed_reads", out_dir=intermediate_dir,
+                                                        read_list_prefix=f"{out_prefix}_read_list")
+            rename_read_ids_run.rename()
+            logger.info("Renaming complete. Updating sequence object.")
+            return {"fastq_files": list(rename_read_ids_run.result_files["fastq_file_renamed"]),
+                    "read_list_file": rename_read_ids_run.result_files["read_list_file"],
+                    "read_table_file": rename_read_ids_run.result_files["read_table_file"]}
         logger.info("Extracting single-end reads.")
-        extractor_run.extract_single_reads()
-
-    logger.info("Filtering reads with FastP.")
-    fastp_run_process = FastPRunner(
-        sequencing_sample,
-        intermediate_dir,
-        f"{out_prefix}_fastp_output",
-        qualified_quality_phred=quality_threshold,
-        min_read_len=min_len,
-        max_read_len=max_len,
-        trim_front_bp=trim_front,
-        trim_tail_bp=trim_tail,
-        report_only=False,
-        dedup=False,
-        threads=threads
-    )
-    fastp_run_process.run_fastp()
-    logger.info("Read filtering complete.")
-
-    print("-" * 40)
-    print("Mapping FASTQ based on provided reference FASTA file...")
-    print("-" * 40)
-    logger.info("Running Minimap2 for read mapping.")
-    sequencing_sample_filtered = Sequence("Test", fastp_run_process.result_files["output_files_fastp"])
-    minimap_run_process = Minimap2Runner(
-        sequencing_sample_filtered,
-        intermediate_dir,
-        input_reference,
-        f"{out_prefix}_mapped_sam",
-        threads=threads,
-        kmer_size=minimap_kmer_size
-    )
-    minimap_run_process.run_minimap2()
-    logger.info("Minimap2 mapping complete.")
-
-    logger.info("Converting SAM to BAM and extracting FASTQ from mapped reads.")
-    sam_to_bam_process = SamBamProcessor(
-        minimap_run_process.result_files["sam_output_file"],
-        intermediate_dir,
-        input_reference,
-        f"{out_prefix}_mapped_bam",
-        thread=threads
-    )
-    sam_to_bam_process.run_samtools_bam()
-
-    bam_to_fastq_process = SamBamProcessor(
-        sam_to_bam_process.result_files["bam_output"],
-        intermediate_dir,
-        input_reference,
-        f"{out_prefix}_mapped_fastq",
-        thread=threads
-    )
-    bam_to_fastq_process.run_samtools_fastq()
-
-    print("-" * 40)
-    print("Calculating distances...")
-    print("-" * 40)
-    logger.info("Running Mash analysis.")
-    mash_run = MashSketcher(intermediate_dir, out_prefix)
-    mash_results = mash_run.run_mash_sketch(fastp_run_process.result_files["output_files_fastp"])
-    mash_genome_size = mash_results["Genome Size"]
-    mash_coverage = mash_results["Coverage"]
-    logger.info(f"Mash complete. Genome Size: {mash_genome_size}, Coverage: {mash_coverage}")
-
-    print("-" * 40)
-    print("Creating manifest files...")
-    print("-" * 40)
-    logger.info("Creating manifest files and summaries.")
-    # Create manifest files in the final output directory (outside intermediates)
-    if seq_summary is not None and GeneralSeqParser.check_seq_summary(seq_summary):
-        logger.info("Using sequencing summary to create manifest.")
-        manifest_with_sum_run = SeqManifest(
-            out_prefix,
-            sam_to_bam_process.result_files["bam_output"],
-            f"{out_prefix}_manifest",
-            out_dir=out_directory,
-            min_coverage=min_cov,
-            fastp_fastq=fastp_run_process.result_files["output_files_fastp"],
-            read_list=extractor_run.result_files["read_list_file"],
-            in_seq_summary=seq_summary
+        return {"fastq_files": read_files}
+
+    def read_list_files():
+        if paired_input:
+            return {"read_list_file": scheduler.results["prepare_reads"]["read_list_file"],
+                    "read_table_file": scheduler.results["prepare_reads"]["read_table_file"]}
+        return scheduler.results["scan_reads"]
+
+    def scan_reads():
+        read_set = Sequence("Test", scheduler.results["prepare_reads"]["fastq_files"])
+        if use_seq_summary:
+            # The sequencing summary supplies the read lengths and qscores, so only the read ids are needed.
+            logger.info("Extracting read ids with FastqExtractor.")
+            extractor_run = FastqExtractor(read_set, out_prefix=f"{out_prefix}_read_list", out_dir=intermediate_dir)
+            extractor_run.extract_single_reads()
+            return dict(extractor_run.result_files)
+        # One pass over the reads writes the read list and the per-read length/qscore table for the manifest.
+        logger.info("Extracting reads with FastqScanner.")
+        scanner_run = FastqScanner(read_set, out_prefix=f"{out_prefix}_read_list", out_dir=intermediate_dir)
+        scanner_run.scan()
+        return dict(scanner_run.result_files)
+
+    def filter_reads():
+        logger.info("Filtering reads with FastP.")
+        fastp_run_process = FastPRunner(
+            Sequence("Test", scheduler.results["prepare_reads"]["fastq_files"]),
+            intermediate_dir,
+            f"{out_prefix}_fastp_output",
+            qualified_quality_phred=quality_threshold,
+            min_read_len=min_len,
+            max_read_len=max_len,
+            trim_front_bp=trim_front,
+            trim_tail_bp=trim_tail,
+            report_only=False,
+            dedup=False,
+            threads=worker_threads
         )
-        fastp_file = GeneralSeqParser(fastp_run_process.result_files["json"], "json")
-        seq_summary_single_end_run = SeqManifestSummary(
-            out_prefix,
-            manifest_with_sum_run.bam_obj,
-            f"{out_prefix}_manifest_summary",
-            out_dir=out_directory,
-            genome_size=mash_genome_size,
-            coverage=mash_coverage,
-            fastp_json_file=fastp_file.parsed_file
+        fastp_run_process.run_fastp()
+        logger.info("Read filtering complete.")
+        return {"html": fastp_run_process.result_files["html"], "json": fastp_run_process.result_files["json"],
+                "output_files_fastp": list(fastp_run_process.result_files["output_files_fastp"])}
+
+    def map_reads():
+        print("-" * 40)
+        print("Mapping FASTQ based on provided reference FASTA file...")
+        print("-" * 40)
+        logger.info("Running Minimap2 for read mapping, streaming alignments into samtools sort.")
+        sequencing_sample_filtered = Sequence("Test", scheduler.results["fastp"]["output_files_fastp"])
+        minimap_run_process = Minimap2Runner(
+            sequencing_sample_filtered,
+            intermediate_dir,
+            input_reference,
+            f"{out_prefix}_mapped_bam",
+            threads=worker_threads,
+            kmer_size=minimap_kmer_size,
+            index_cache=index_cache
         )
-        seq_summary_single_end_run.generate_summary()
-        logger.info("Manifest and summary creation with sequencing summary complete.")
-    else:
-        logger.info("No valid sequencing summary provided. Creating manifest using default time bounds.")
-        manifest_no_sum_run = SeqManifest(
-            out_prefix,
-            sam_to_bam_process.result_files["bam_output"],
-            f"{out_prefix}_manifest",
-            out_dir=out_directory,
-            min_coverage=min_cov,
-            fastp_fastq=fastp_run_process.result_files["output_files_fastp"],
-            read_list=extractor_run.result_files["read_list_file"],
-            in_fastq=input_fastq,
-            start_time=start_time_default,
-            end_time=end_time_default
+        minimap_run_process.run_minimap2_sorted_bam()
+        logger.info("Minimap2 mapping complete. Sorted and indexed BAM written.")
+        return minimap_run_process.result_files["bam_output"]
+
+    def align_reads():
+        print("-" * 40)
+        print("Mapping FASTQ based on provided reference FASTA file...")
+        print("-" * 40)
+        logger.info("Aligning reads in-process with mappy, adding each hit to the coverage and read statistics.")
+        bam_obj = IncrementalBamProcessor(min_coverage=min_cov, sparse_coverage=sparse_coverage)
+        mappy_run = MappyAligner(
+            Sequence("Test", scheduler.results["fastp"]["output_files_fastp"]),
+            input_reference,
+            bam_obj,
+            out_dir=intermediate_dir,
+            out_prefix=f"{out_prefix}_mapped_bam",
+            threads=worker_threads,
+            kmer_size=minimap_kmer_size,
+            write_bam=write_bam
         )
-        fastp_file = GeneralSeqParser(fastp_run_process.result_files["json"], "json")
-        if seq_class.upper() == SequenceTypes.paired_end:
-            logger.info("Generating summary for paired-end reads without sequencing summary.")
-            seq_summary_no_sum_run = SeqManifestSummary(
+        mappy_run.align()
+        bam_obj.chunks += 1
+        bam_obj.finalize()
+        logger.info("mappy alignment complete.")
+        return bam_obj
+
+    def mapped_bam():
+        # The mappy engine writes a bam file only when asked for
+        if aligner == 'mappy':
+            return os.path.join(intermediate_dir, f"{out_prefix}_mapped_bam.bam") if write_bam else None
+        return scheduler.results["minimap2"]
+
+    def extract_mapped_fastq():
+        logger.info("Extracting FASTQ from mapped reads.")
+        bam_to_fastq_process = SamBamProcessor(
+            mapped_bam(),
+            intermediate_dir,
+            input_reference,
+            f"{out_prefix}_mapped_fastq",
+            thread=1
+        )
+        bam_to_fastq_process.run_samtools_fastq()
+        return bam_to_fastq_process.result_files["fastq_output"]
+
+    def sketch_reads():
+        print("-" * 40)
+        print("Calculating distances...")
+        print("-" * 40)
+        logger.info("Running MinHash sketch.")
+        sketch_run = MinHashSketcher(intermediate_dir, out_prefix)
+        mash_results = sketch_run.run_sketch(scheduler.results["fastp"]["output_files_fastp"])
+        logger.info(f"MinHash sketch complete. Genome Size: {mash_results['Genome Size']}, Coverage: {mash_results['Coverage']}")
+        return mash_results
+
+    def alignment_key():
+        # The bam file is rebuilt on every run and its @PG header lines change, so the coverage cache
+        # is keyed on the reads, the reference and everything that shapes the alignments instead.
+        params = {"filter": {k: v for k, v in filter_params.items() if k != "out_prefix"},
+                  "kmer_size": minimap_kmer_size, "preset": "sr" if paired_input else "map-ont",
+                  "tools": {tool: checkpoint.tool_version(tool) for tool in ("fastp", "minimap2", "samtools")}}
+        return CoverageCache.alignment_key([input_reference] + input_reads(), params, use_checksum=resume_checksum)
+
+    def process_bam():
+        logger.info("Collecting per-contig statistics and coverage from the BAM file.")
+        return BamProcessor(input_file=scheduler.results["minimap2"], min_coverage=min_cov, threads=worker_threads,
+                            sparse_coverage=sparse_coverage, cache_dir=coverage_cache,
+                            cache_key=alignment_key() if coverage_cache else None)
+
+    def build_manifest():
+        print("-" * 40)
+        print("Creating manifest files...")
+        print("-" * 40)
+        logger.info("Creating manifest files.")
+        bam_file = mapped_bam()
+        fastp_files = scheduler.results["fastp"]["output_files_fastp"]
+        scanner_files = read_list_files()
+        # Create manifest files in the final output directory (outside intermediates)
+        if use_seq_summary:
+            logger.info("Using sequencing summary to create manifest.")
+            manifest_run = SeqManifest(
                 out_prefix,
-                manifest_no_sum_run.bam_obj,
-                f"{out_prefix}_manifest_summary",
+                bam_file,
+                f"{out_prefix}_manifest",
                 out_dir=out_directory,
-                genome_size=mash_genome_size,
-                coverage=mash_coverage,
-                fastp_json_file=fastp_file.parsed_file,
-                paired=True
+                min_coverage=min_cov,
+                fastp_fastq=fastp_files,
+                read_list=scanner_files["read_list_file"],
+                in_seq_summary=seq_summary,
+                bam_obj=scheduler.results["bam"],
+                manifest_format=manifest_format
             )
         else:
-            logger.info("Generating summary for single-end reads without sequencing summary.")
-            seq_summary_no_sum_run = SeqManifestSummary(
+            logger.info("No valid sequencing summary provided. Creating manifest using default time bounds.")
+            manifest_run = SeqManifest(
                 out_prefix,
-                manifest_no_sum_run.bam_obj,
-                f"{out_prefix}_manifest_summary",
+                bam_file,
+                f"{out_prefix}_manifest",
                 out_dir=out_directory,
-                genome_size=mash_genome_size,
-                coverage=mash_coverage,
-                fastp_json_file=fastp_file.parsed_file,
-                paired=False
+                min_coverage=min_cov,
+                fastp_fastq=fastp_files,
+                read_list=scanner_files["read_list_file"],
+                read_table=scanner_files["read_table_file"],
+                start_time=start_time_default,
+                end_time=end_time_default,
+                bam_obj=scheduler.results["bam"],
+                manifest_format=manifest_format
             )
-        seq_summary_no_sum_run.generate_summary()
-        logger.info("Manifest and summary creation without sequencing summary complete.")
+        return manifest_run.bam_obj
+
+    def build_summary():
+        logger.info("Creating manifest summary.")
+        mash_results = scheduler.results["mash"]
+        fastp_file = GeneralSeqParser(scheduler.results["fastp"]["json"], "json")
+        paired = seq_class.upper() == SequenceTypes.paired_end
+        if use_seq_summary:
+            paired = False
+        logger.info(f"Generating summary for {'paired-end' if paired else 'single-end'} reads.")
+        seq_summary_run = SeqManifestSummary(
+            out_prefix,
+            scheduler.results["manifest"],
+            f"{out_prefix}_manifest_summary",
+            out_dir=out_directory,
+            genome_size=mash_results["Genome Size"],
+            coverage=mash_results["Coverage"],
+            fastp_json_file=fastp_file.parsed_file,
+            paired=paired,
+            coverage_thresholds=coverage_thresholds,
+            sampling_fraction=scheduler.results["sample_reads"]["sampling_fraction"] if sampling else None
+        )
+        seq_summary_run.generate_summary()
+        logger.info("Manifest and summary creation complete.")
+
+    # Completed stages are recorded with a fingerprint of their inputs and options so that
+    # --resume can skip them; the manifest and summary always run.
+    checkpoint = StageCheckpoint(out_directory, use_checksum=resume_checksum)
+
+    def checkpointed(name, func, input_files, params, output_files, tools=None):
+        def run_stage():
+            fingerprint = checkpoint.fingerprint(input_files(), params, tools)
+            if resume and checkpoint.is_complete(name, fingerprint):
+                logger.info(f"Stage '{name}' is up to date, reusing the outputs of an earlier run.")
+                return checkpoint.get_result(name)
+            result = func()
+            checkpoint.record(name, fingerprint, result, output_files(result))
+            return result
+        return run_stage
+
+    filter_params = {"quality_threshold": quality_threshold, "min_len": min_len, "max_len": max_len,
+                     "trim_front": trim_front, "trim_tail": trim_tail, "seq_class": seq_class.upper(),
+                     "report_only": False, "dedup": False, "out_prefix": out_prefix}
+    if sampling:
+        scheduler.add_stage("sample_reads",
+                            checkpointed("sample_reads", sample_reads, lambda: input_fastq,
+                                         {"max_reads": max_reads, "max_bases": max_bases, "out_prefix": out_prefix},
+                                         lambda result: result["fastq_files"]))
+    scheduler.add_stage("prepare_reads",
+                        checkpointed("prepare_reads", prepare_reads, input_reads,
+                                     {"seq_class": seq_class.upper(), "out_prefix": out_prefix},
+                                     lambda result: result["fastq_files"] + [result["read_list_file"], result["read_table_file"]]
+                                     if paired_input else []),
+                        depends_on=["sample_reads"] if sampling else [])
+    scheduler.add_stage("fastp",
+                        checkpointed("fastp", filter_reads, lambda: scheduler.results["prepare_reads"]["fastq_files"], filter_params,
+                                     lambda result: [result["json"], result["html"]] + result["output_files_fastp"],
+                                     tools=["fastp"]),
+                        depends_on=["prepare_reads"], threads=worker_threads)
+    if not paired_input:
+        scheduler.add_stage("scan_reads",
+                            checkpointed("scan_reads", scan_reads, lambda: scheduler.results["prepare_reads"]["fastq_files"],
+                                         {"out_prefix": out_prefix, "read_ids_only": use_seq_summary},
+                                         lambda result: list(result.values())),
+                            depends_on=["prepare_reads"])
+    if aligner == 'mappy':
+        scheduler.add_stage("bam", align_reads, depends_on=["fastp"], threads=worker_threads)
+    else:
+        scheduler.add_stage("minimap2",
+                            checkpointed("minimap2", map_reads,
+                                         lambda: [input_reference] + scheduler.results["fastp"]["output_files_fastp"],
+                                         {"kmer_size": minimap_kmer_size, "preset": "sr" if paired_input else "map-ont",
+                                          "sort_memory": DefaultValues.samtools_sort_memory, "out_prefix": out_prefix},
+                                         lambda result: [result, f"{result}.bai"], tools=["minimap2", "samtools"]),
+                            depends_on=["fastp"], threads=worker_threads)
+        scheduler.add_stage("bam", process_bam, depends_on=["minimap2"], threads=worker_threads)
+    scheduler.add_stage("mash",
+                        checkpointed("mash", sketch_reads, lambda: scheduler.results["fastp"]["output_files_fastp"],
+                                     {"kmer_size": DefaultValues.mash_kmer_size, "sketch_size": DefaultValues.mash_sketch_size,
+                                      "min_copies": DefaultValues.mash_min_copies, "out_prefix": out_prefix},
+                                     lambda result: []),
+                        depends_on=["fastp"])
+    scheduler.add_stage("manifest", build_manifest, depends_on=["bam", "prepare_reads" if paired_input else "scan_reads"])
+    if aligner != 'mappy' or write_bam:
+        scheduler.add_stage("samtools_fastq",
+                            checkpointed("samtools_fastq", extract_mapped_fastq, lambda: [mapped_bam()],
+                                         {"pysam": pysam.__version__, "out_prefix": out_prefix}, lambda result: [result]),
+                            depends_on=["minimap2" if aligner == 'minimap2' else "bam"])
+    scheduler.add_stage("summary", build_summary, depends_on=["manifest", "mash"])
+    # Wall time, CPU time and peak memory of every stage are written to profile.json, also for failed runs.
+    profile_file = os.path.join(out_directory, "profile.json")
+    try:
+        scheduler.run()
+    finally:
+        profiler.write(profile_file)
+        logger.info(f"Stage profile written to {profile_file}.")
 
     pipeline_end_time = time.time()
     total_runtime_seconds = pipeline_end_time - pipeline_start_time
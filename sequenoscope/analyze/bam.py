@@ -1,35 +1,141 @@
 #!/usr/bin/env python
 
 import statistics
+import multiprocessing
+import numpy as np
 import pysam
-from math import log
+from itertools import groupby
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from sequenoscope.constant import DefaultValues
-from sequenoscope.utils.__init__ import run_command, is_non_zero_file
+from sequenoscope.analyze.coverage import RunLengthCoverage
+from sequenoscope.analyze.coverage_cache import CoverageCache
+from sequenoscope.utils.qscore import mean_qscore
+from sequenoscope.utils.__init__ import is_non_zero_file
 
 
 
+def collect_region_stats(pysam_obj, contig_id, contig_len, region_start=None, region_end=None):
+    """
+    Collects per-read statistics and partial coverage for a contig or a region of a contig.
+    When a region is given, only reads starting inside it are counted so that shards of the
+    same contig never count a read twice.
+
+    Arguments:
+        pysam_obj: pysam.AlignmentFile
+            open and indexed alignment file
+        contig_id: str
+            name of the contig to fetch reads from
+        contig_len: int
+            length of the contig
+        region_start: int
+            0-based start of the region, None for the whole contig
+        region_end: int
+            exclusive end of the region, None for the whole contig
+
+    Returns:
+        dict:
+            partial statistics of the region; coverage is relative to 'offset'
+    """
+    reads = {}
+    lengths = []
+    qualities = []
+    starts = []
+    ends = []
+    total_bases = 0
+    for read in pysam_obj.fetch(contig_id, region_start, region_end):
+        if region_start is not None and read.reference_start < region_start:
+            continue
+        read_id = read.query_name
+        seq = read.query_sequence
+        if seq is not None:
+            length = len(seq)
+        else:
+            length = 0
+        total_bases += length
+        lengths.append(length)
+        qual = read.query_qualities
+        qscore = BamProcessor.calc_mean_qscores(qual)
+        qualities.append(qscore)
+        reads[read_id] = (length,qscore)
+        # Unmapped mates placed at the position of their mate cover no bases
+        if contig_id == '*' or read.is_unmapped:
+            continue
+        start_pos = read.reference_start
+        aln_len = read.query_alignment_length
+        starts.append(start_pos)
+        ends.append(start_pos + aln_len)
+
+    offset = region_start if region_start is not None else 0
+    coverage = None
+    if contig_len > 0 and len(starts) > 0:
+        starts = np.asarray(starts, dtype=np.int64) - offset
+        ends = np.minimum(np.asarray(ends, dtype=np.int64), contig_len) - offset
+        coverage = BamProcessor.calc_coverage(starts, ends, int(ends.max()))
+
+    return {'contig_id': contig_id, 'num_reads': len(lengths), 'total_bases': total_bases,
+            'reads': reads, 'lengths': lengths, 'qualities': qualities,
+            'offset': offset, 'coverage': coverage}
+
+
+def process_bam_region(alignment_file, contig_id, contig_len, region_start=None, region_end=None):
+    """
+    Worker entry point for parallel BAM processing; opens its own handle on the indexed BAM
+    and returns the partial statistics of one contig or contig region.
+
+    Arguments:
+        alignment_file: str
+            path to the sorted and indexed bam file
+
+    Returns:
+        dict:
+            partial statistics as returned by collect_region_stats
+    """
+    with pysam.AlignmentFile(alignment_file, "rb") as pysam_obj:
+        return collect_region_stats(pysam_obj, contig_id, contig_len, region_start, region_end)
+
+
 class BamProcessor:
 
     alignment_file = None
     index_file = None
     pysam_obj = None
     threads = 1
+    shard_size = DefaultValues.bam_region_shard_size
     read_locations = {}
     ref_stats = {}
     ref_coverage = {}
     status = True
     error_msg = ''
 
-    def __init__(self,input_file, min_coverage):
+    def __init__(self,input_file, min_coverage, threads=1, shard_size=DefaultValues.bam_region_shard_size,
+                 sparse_coverage=False, cache_dir=None, cache_key=None):
         """
         Initalize the class with an input bam file
 
         Arguments:
             input_file: str
                 a string that designates the path of the bam file to be analyzed
+            min_coverage: int
+                minimum coverage threshold used for the covered bases statistic
+            threads: int
+                number of worker processes used to process contigs in parallel, default is 1
+            shard_size: int
+                contigs longer than this are split into regions of this size when running in parallel
+            sparse_coverage: bool
+                store the coverage of a contig run-length encoded when that is at most half the size of the dense array
+            cache_dir: str
+                directory of the coverage cache; when set, results are reused for a bam file with the same SHA256
+            cache_key: str
+                (optional) key of the coverage cache entry used instead of the SHA256 of the bam file
         """
         self.alignment_file = input_file
         self.min_coverage = min_coverage
+        self.threads = threads
+        self.shard_size = shard_size
+        self.sparse_coverage = sparse_coverage
+        self.cache_dir = cache_dir
+        self.read_locations = {}
         if not is_non_zero_file(input_file):
             self.status = False
             self.error_msg = "Error bam file {} does not exist".format(input_file)
@@ -42,59 +148,118 @@ class BamProcessor:
             self.status = False
             self.error_msg = "STDOUT:{}\nSTDERR:{}".format(stdout,stderr)
             return
+        cache = None
+        if self.cache_dir is not None:
+            cache = CoverageCache(self.cache_dir, input_file, key=cache_key)
+        if cache is not None and cache.exists():
+            self.load_cache(cache)
+            return
         self.ref_stats = self.get_bam_stats()
         self.init_base_cov()
         self.pysam_obj = pysam.AlignmentFile(input_file, "rb")
         self.process_bam()
+        if cache is not None:
+            cache.save(self.ref_stats, self.ref_coverage)
+
+    def load_cache(self, cache):
+        """
+        Restores statistics, coverage and the read index from a coverage cache entry and
+        recomputes the statistics that depend on the minimum coverage threshold.
+
+        Arguments:
+            cache: CoverageCache
+                cache entry of the bam file
+        """
+        self.ref_stats, self.ref_coverage = cache.load()
+        for contig_id, stats in self.ref_stats.items():
+            self.index_reads(contig_id, stats['reads'])
+            if stats['depth_hist'] is None and contig_id in self.ref_coverage:
+                stats['depth_hist'] = self.calc_depth_hist(self.ref_coverage[contig_id])
+            stats['covered_bases'] = self.get_covered_bases(contig_id)
 
 
     def init_base_cov(self):
         """
-        Uses the contig lengths from self.ref_stats to create a list of positions with counts initialized to 0
+        Prepares the coverage store. Arrays are allocated lazily by get_base_cov, so contigs
+        without mapped reads never get one.
         """
-        for contig_id in self.ref_stats:
-            self.ref_coverage[contig_id] = [0] * self.ref_stats[contig_id]['length']
+        self.ref_coverage = {}
 
+    def get_base_cov(self, contig_id):
+        """
+        Returns the coverage array of a contig, allocating an int32 array of zeros on first use
 
-    def process_bam(self):
+        Arguments:
+            contig_id: str
+                name of the contig
+
+        Returns:
+            numpy.ndarray:
+                per-base coverage array of the contig
         """
-        Reads a bam file line by line and produces summary statistics based on each contig
+        if contig_id not in self.ref_coverage:
+            self.ref_coverage[contig_id] = np.zeros(self.ref_stats[contig_id]['length'], dtype=np.int32)
+        return self.ref_coverage[contig_id]
+
+    def plan_regions(self):
+        """
+        Splits the contigs into work units for processing. Each contig is a single unit unless
+        running in parallel, where contigs longer than self.shard_size are cut into fixed-size regions.
+
+        Returns:
+            list:
+                list of (contig_id, contig_len, region_start, region_end) tuples
         """
+        regions = []
         for contig_id in self.ref_stats:
             contig_len = self.ref_stats[contig_id]['length']
-            #covered_positions = set()
+            if self.ref_stats[contig_id]['indexed_reads'] == 0:
+                continue
+            if self.threads > 1 and contig_id != '*' and contig_len > self.shard_size:
+                for region_start in range(0, contig_len, self.shard_size):
+                    regions.append((contig_id, contig_len, region_start,
+                                    min(region_start + self.shard_size, contig_len)))
+            else:
+                regions.append((contig_id, contig_len, None, None))
+        return regions
+
+    def process_bam(self):
+        """
+        Reads a bam file and produces summary statistics based on each contig. With more than one
+        thread, contigs and contig regions are spread across a process pool and the partial results merged.
+        Contigs without reads in the index are skipped and keep their default statistics.
+        """
+        regions = self.plan_regions()
+        if self.threads > 1 and len(regions) > 1:
+            partials = self.parallel_region_stats(regions)
+        else:
+            partials = (collect_region_stats(self.pysam_obj, *region) for region in regions)
+
+        for contig_id, contig_partials in groupby(partials, key=lambda partial: partial['contig_id']):
             num_reads = 0
             total_bases = 0
             lengths = []
             qualities = []
-            for read in self.pysam_obj.fetch(contig_id):
-                num_reads+=1
-                read_id = read.query_name
-                seq = read.query_sequence
-                if seq is not None:
-                    length = len(seq)
-                else:
-                    length = 0
-                total_bases += length
-                lengths.append(length)
-                qual = read.query_qualities
-                qscore = self.calc_mean_qscores(qual)
-                qualities.append(qscore)
-                self.ref_stats[contig_id]['reads'][read_id] = (length,qscore)
-                if contig_id == '*':
-                    continue
-                start_pos = read.reference_start
-                aln_len = read.query_alignment_length
-                for i in range(start_pos,start_pos+aln_len):
-                    if i < contig_len: #and i not in covered_positions:
-                        self.ref_coverage[contig_id][i]+=1
-                        #covered_positions.add(i)
+            for partial in contig_partials:
+                num_reads += partial['num_reads']
+                total_bases += partial['total_bases']
+                lengths.extend(partial['lengths'])
+                qualities.extend(partial['qualities'])
+                self.ref_stats[contig_id]['reads'].update(partial['reads'])
+                self.index_reads(contig_id, partial['reads'])
+                if partial['coverage'] is not None:
+                    offset = partial['offset']
+                    self.get_base_cov(contig_id)[offset:offset + len(partial['coverage'])] += partial['coverage']
 
             lengths = sorted(lengths,reverse=True)
-            if len(self.ref_coverage[contig_id]) > 0:
-                self.ref_stats[contig_id]['mean_cov'] = statistics.mean(self.ref_coverage[contig_id])
-                self.ref_stats[contig_id]['covered_bases'] = self.count_cov_bases(self.ref_coverage[contig_id])
-                self.ref_stats[contig_id]['total_mapped_bases'] = sum(self.ref_coverage[contig_id])
+            if contig_id in self.ref_coverage:
+                coverage = self.ref_coverage[contig_id]
+                self.ref_stats[contig_id]['mean_cov'] = float(coverage.mean())
+                self.ref_stats[contig_id]['depth_hist'] = self.calc_depth_hist(coverage)
+                self.ref_stats[contig_id]['covered_bases'] = self.get_covered_bases(contig_id)
+                self.ref_stats[contig_id]['total_mapped_bases'] = int(coverage.sum(dtype=np.int64))
+                if self.sparse_coverage:
+                    self.ref_coverage[contig_id] = self.compress_coverage(coverage)
             self.ref_stats[contig_id]['n50'] = self.calc_n50(lengths,total_bases)
             self.ref_stats[contig_id]['num_reads'] = num_reads
             if len(lengths) > 0:
@@ -105,6 +270,94 @@ class BamProcessor:
                 self.ref_stats[contig_id]['mean_qual'] = statistics.mean(qualities)
         return
 
+    def parallel_region_stats(self, regions):
+        """
+        Yields the partial statistics of the regions in order, computed on a process pool. At most two
+        regions per worker are in flight, and each partial is merged before the next one is taken, so
+        only those partials are held in memory at once.
+
+        Arguments:
+            regions: list
+                (contig_id, contig_len, region_start, region_end) tuples from plan_regions
+        """
+        # analyze runs this next to other stage threads; forking a multithreaded process can
+        # deadlock the workers on locks held at fork time, so they come from a forkserver
+        mp_context = multiprocessing.get_context("forkserver")
+        with ProcessPoolExecutor(max_workers=self.threads, mp_context=mp_context) as executor:
+            pending = deque()
+            for region in regions:
+                pending.append(executor.submit(process_bam_region, self.alignment_file, *region))
+                if len(pending) >= 2 * self.threads:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def index_reads(self, contig_id, reads):
+        """
+        Adds the reads of a contig to the read_id -> [contig list, length, qscore] index in self.read_locations.
+        The unmapped '*' contig updates length and qscore but is not added to the contig list.
+
+        Arguments:
+            contig_id: str
+                name of the contig the reads were fetched from
+            reads: dict
+                read_id -> (length, qscore) for the reads of the contig
+        """
+        for read_id, (length, qscore) in reads.items():
+            location = self.read_locations.get(read_id)
+            if location is None:
+                location = [[], length, qscore]
+                self.read_locations[read_id] = location
+            else:
+                location[1] = length
+                location[2] = qscore
+            if contig_id != '*' and (not location[0] or location[0][-1] != contig_id):
+                location[0].append(contig_id)
+
+    def compress_coverage(self, coverage):
+        """
+        Run-length encodes a coverage array when that takes at most half of its memory
+
+        Arguments:
+            coverage: numpy.ndarray
+                per-base coverage array of a contig
+
+        Returns:
+            numpy.ndarray or RunLengthCoverage:
+                the smaller of the two representations
+        """
+        encoded = RunLengthCoverage.from_dense(coverage)
+        if encoded.nbytes * 2 <= coverage.nbytes:
+            return encoded
+        return coverage
+
+    @staticmethod
+    def calc_coverage(starts, ends, contig_len):
+        """
+        Builds the per-base coverage of a contig from alignment intervals using a difference array.
+        Each alignment adds +1 at its start and -1 at its end, and the cumulative sum gives the depth.
+
+        Arguments:
+            starts: list
+                0-based reference start position of each alignment
+            ends: list
+                exclusive reference end position of each alignment, clipped to the contig length
+            contig_len: int
+                length of the contig
+
+        Returns:
+            numpy.ndarray:
+                int32 array of per-base coverage with one entry per contig position
+        """
+        if len(starts) == 0:
+            return np.zeros(contig_len, dtype=np.int32)
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.minimum(np.asarray(ends, dtype=np.int64), contig_len)
+        keep = starts < ends
+        diff = np.bincount(starts[keep], minlength=contig_len + 1).astype(np.int32)
+        diff -= np.bincount(ends[keep], minlength=contig_len + 1).astype(np.int32)
+        return np.cumsum(diff[:contig_len], dtype=np.int32)
+
     def calc_n50(self,lengths,total_length):
         """
         Calculates the N50 of a set of read lengths
@@ -132,13 +385,53 @@ class BamProcessor:
             l = 0
             return l
 
+    def calc_depth_hist(self, coverage):
+        """
+        Counts how many positions of a contig have each depth
+
+        Arguments:
+            coverage: numpy.ndarray or RunLengthCoverage
+                coverage values of the contig
+
+        Returns:
+            numpy.ndarray:
+                int64 array where entry d is the number of positions with depth d
+        """
+        if isinstance(coverage, RunLengthCoverage):
+            return np.bincount(coverage.values, weights=coverage.run_lengths).astype(np.int64)
+        return np.bincount(coverage).astype(np.int64)
+
+    def get_covered_bases(self, contig_id, min_value=None):
+        """
+        Counts the positions of a contig with depth >= min_value from its depth histogram,
+        so any threshold is answered without rescanning the coverage
+
+        Arguments:
+            contig_id: str
+                name of the contig
+            min_value: int
+                minimum coverage value, default is self.min_coverage
+
+        Returns:
+            int:
+                number of positions meeting this threshold
+        """
+        if min_value is None:
+            min_value = self.min_coverage
+        if min_value <= 0:
+            return self.ref_stats[contig_id]['length']
+        depth_hist = self.ref_stats[contig_id]['depth_hist']
+        if depth_hist is None:
+            return 0
+        return int(depth_hist[min_value:].sum())
+
     def count_cov_bases(self,list_of_values, min_value=None, max_value=9999999999999):
         """
         Counts positions where the count is >=min and <= max
 
         Arguments:
-            list_of_values: list
-                list of coverage value for calcualtion
+            list_of_values: numpy.ndarray or RunLengthCoverage
+                coverage values for calcualtion
             min_value: int
                 minimum coverage value
             max_value: int
@@ -150,95 +443,64 @@ class BamProcessor:
         """
         if min_value is None:
             min_value = self.min_coverage
-        
-        total = 0
-        for v in list_of_values:
-            if v >= min_value and v<=max_value:
-                total+=1
-        return total
-    
-    def error_prob_list_tab(n):
-        """
-        generate a list of error rates for qualities less than or equal to n.
-        source: github.com/wdecoster/nanoget/blob/master/nanoget/utils.py
 
-        Arguments: 
-            n: error probability threshold
-
-        Returns:
-            list:
-                list of error rates
-        """
-        return [10**(q / -10) for q in range(n+1)]
-
-    def calc_mean_qscores(self,qual,tab=error_prob_list_tab(DefaultValues.nanoget_threshold)):
+        if isinstance(list_of_values, RunLengthCoverage):
+            return list_of_values.count_between(min_value, max_value)
+        values = np.asarray(list_of_values)
+        return int(np.count_nonzero((values >= min_value) & (values <= max_value)))
+    
+    @staticmethod
+    def calc_mean_qscores(qual):
         """
         Calculates the mean quality score for a read where they have been converted to Phred.
         Phred scores are first converted to probabilites, then the average error probability is calculated.
         The average is then converted back to the Phred scale.
 
         Arguments:
-            qual: string
-                string of Phred 33 ints for quality calcualtions
-            
-            tab: list
-                list of error rates for qaulties specified
-                default designation of 128 based on nanoget 
+            qual: array
+                array of Phred ints for quality calcualtions, as returned by pysam query_qualities
 
         Returns:
             float:
                 mean qscore
         """
-        if qual:
-            phred_score = -10 * log(sum([tab[q] for q in qual]) / len(qual) , 10)
-            return phred_score
-        else:
-            return 0
+        return mean_qscore(qual)
 
 
     def get_bam_stats(self):
         """
-        Wrapper class around SAMTOOLS IDXSTATS for getting information about bam file
+        Reads the per-contig read counts from the bam index with pysam, as SAMTOOLS IDXSTATS reports
+        them, and the contig lengths from the bam header
 
         Returns:
             dictionary:
-                dictionary with some results from the samtools IDXSTATS tool
+                dictionary with the length and indexed read count of every contig, '*' for the reads without coordinates
 
         """
-        cmd = [
-            'samtools',
-            'idxstats',
-            "{}".format(self.alignment_file)
-        ]
-        cmd = " ".join(cmd)
-        (stdout,stderr) = run_command(cmd)
         result = {}
-        stdout = stdout.split("\n")
-        for row in stdout:
-            row = row.split("\t")
-            if len(row) < DefaultValues.samtools_idxstats_field_number:
-                continue
-            result[row[0]] = {'length':int(row[1]),
+        with pysam.AlignmentFile(self.alignment_file, "rb") as pysam_obj:
+            indexed_reads = {stat.contig: stat.mapped + stat.unmapped for stat in pysam_obj.get_index_statistics()}
+            contigs = list(zip(pysam_obj.references, pysam_obj.lengths))
+            contigs.append(('*', 0))
+            indexed_reads['*'] = pysam_obj.nocoordinate
+        for contig_id, length in contigs:
+            result[contig_id] = {'length':length,'indexed_reads':indexed_reads.get(contig_id, 0),
                               'reads': {},'num_reads':0,'mean_cov':0,
-                              'covered_bases':0,'mean_len':0,'median_len':0,
+                              'covered_bases':0,'total_mapped_bases':0,'depth_hist':None,'mean_len':0,'median_len':0,
                               'mean_qual':0,'median_qual':0,'n50':0}
         return result
 
 
     def index_bam(self):
         """
-        Wrapper class around SAMTOOLS INDEX for creating a bam index file
+        Creates the bam index file in-process with pysam
 
         Returns:
-            file object:
-                indexed bam file
-        """
-        cmd = [
-            'samtools',
-            'index',
-            '-@',"{}".format(self.threads),
-            "{}".format(self.alignment_file),
-            "{}".format(self.index_file)
-        ]
-        cmd = " ".join(cmd)
-        return run_command(cmd)
\ No newline at end of file
+            tuple:
+                empty stdout and the error message of the indexing, empty on success
+        """
+        try:
+            pysam.index("-@", f"{self.threads}", self.alignment_file, self.index_file)
+        except pysam.SamtoolsError as error:
+            return ("", str(error))
+        return ("", "")
\ No newline at end of file
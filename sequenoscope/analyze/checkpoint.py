@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+import os
+import json
+import hashlib
+import threading
+from sequenoscope.version import __version__
+from sequenoscope.utils.__init__ import compute_sha256, run_command
+
+
+class StageCheckpoint:
+    out_dir = None
+    checkpoint_file = None
+    use_checksum = False
+    stages = {}
+    tool_versions = {}
+    file_name = "checkpoints.json"
+
+    def __init__(self, out_dir, use_checksum=False):
+        """
+        Initalize the class with the directory holding the checkpoint file. Checkpoints of an
+        earlier run in the same directory are loaded.
+
+        Arguments:
+            out_dir: str
+                a string to the path of the analyze output directory
+            use_checksum: bool
+                fingerprint input files by their SHA256 instead of their size and modification time
+        """
+        self.out_dir = out_dir
+        self.checkpoint_file = os.path.join(out_dir, self.file_name)
+        self.use_checksum = use_checksum
+        self.stages = {}
+        self.tool_versions = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(self.checkpoint_file):
+            try:
+                with open(self.checkpoint_file, 'r') as f:
+                    self.stages = json.load(f)
+            except (OSError, ValueError):
+                self.stages = {}
+
+    def file_fingerprint(self, file_path):
+        """
+        Fingerprints a single input file
+
+        Arguments:
+            file_path: str
+                path to the file
+
+        Returns:
+            list:
+                the path with either its SHA256 or its size and modification time
+        """
+        if not os.path.isfile(file_path):
+            return [file_path, None]
+        if self.use_checksum:
+            return [file_path, compute_sha256(file_path)]
+        stat = os.stat(file_path)
+        return [file_path, stat.st_size, stat.st_mtime_ns]
+
+    def tool_version(self, tool):
+        """
+        Returns the version output of an external tool, asked once per run
+
+        Arguments:
+            tool: str
+                name of the tool on the PATH, e.g. fastp
+
+        Returns:
+            str:
+                what the tool prints for --version, which changes when another build is installed
+        """
+        with self._lock:
+            if tool not in self.tool_versions:
+                (stdout, stderr) = run_command(f"{tool} --version")
+                self.tool_versions[tool] = f"{stdout}{stderr}".strip()
+            return self.tool_versions[tool]
+
+    def fingerprint(self, input_files, params, tools=None):
+        """
+        Fingerprints a stage from its input files, its tool options, the versions of the external
+        tools it runs and the sequenoscope version
+
+        Arguments:
+            input_files: list
+                paths of the files the stage reads
+            params: dict
+                options the stage runs its tool with
+            tools: list
+                (optional) names of the external tools the stage runs
+
+        Returns:
+            str:
+                SHA256 hex digest of the fingerprint
+        """
+        fingerprint = {'version': __version__,
+                       'tools': {tool: self.tool_version(tool) for tool in (tools or [])},
+                       'inputs': [self.file_fingerprint(f) for f in input_files],
+                       'params': params}
+        return hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()
+
+    def is_complete(self, stage, fingerprint):
+        """
+        Checks if a stage finished in an earlier run with the same fingerprint and its outputs are still present
+
+        Arguments:
+            stage: str
+                name of the stage
+            fingerprint: str
+                fingerprint of the stage in the current run
+
+        Returns:
+            bool:
+                returns True if the stage can be skipped, False otherwise
+        """
+        entry = self.stages.get(stage)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        return self.check_files(entry['outputs'])
+
+    def get_result(self, stage):
+        """
+        Returns:
+            the result recorded for a completed stage
+        """
+        return self.stages[stage]['result']
+
+    def record(self, stage, fingerprint, result, outputs):
+        """
+        Records a completed stage. The checkpoint file is replaced atomically, so an interrupted run
+        leaves the previous checkpoints intact.
+
+        Arguments:
+            stage: str
+                name of the stage
+            fingerprint: str
+                fingerprint of the stage
+            result: json serializable object
+                value the stage returned
+            outputs: list
+                paths of the files the stage wrote
+        """
+        with self._lock:
+            self.stages[stage] = {'fingerprint': fingerprint, 'result': result, 'outputs': list(outputs)}
+            tmp_file = f"{self.checkpoint_file}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(self.stages, f, indent=2)
+            os.replace(tmp_file, self.checkpoint_file)
+
+    def check_files(self, files_to_check):
+        """
+        check if the output file exists and is not empty
+
+        Arguments:
+            files_to_check: list
+                list of file paths
+
+        Returns:
+            bool:
+                returns True if the generated output file is found and not empty, False otherwise
+        """
+        if isinstance (files_to_check, str):
+            files_to_check = [files_to_check]
+        for f in files_to_check:
+            if not os.path.isfile(f):
+                return False
+            elif os.path.getsize(f) == 0:
+                return False
+        return True
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+import numpy as np
+
+
+class RunLengthCoverage:
+    starts = None
+    values = None
+    length = 0
+
+    def __init__(self, starts, values, length):
+        """
+        Initalize the class with the runs of a per-base coverage track
+
+        Arguments:
+            starts: numpy.ndarray
+                0-based position where each run of identical depth begins
+            values: numpy.ndarray
+                depth of each run
+            length: int
+                total number of positions covered by the runs
+        """
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.values = np.asarray(values, dtype=np.int32)
+        self.length = int(length)
+
+    @classmethod
+    def from_dense(cls, coverage):
+        """
+        Run-length encodes a dense per-base coverage array
+
+        Arguments:
+            coverage: numpy.ndarray
+                per-base coverage array
+
+        Returns:
+            RunLengthCoverage:
+                run-length encoded coverage
+        """
+        coverage = np.asarray(coverage)
+        if len(coverage) == 0:
+            return cls([], [], 0)
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(coverage)) + 1))
+        return cls(starts, coverage[starts], len(coverage))
+
+    @property
+    def run_lengths(self):
+        """Number of positions in each run."""
+        return np.diff(np.append(self.starts, self.length))
+
+    @property
+    def nbytes(self):
+        """Memory used by the run arrays."""
+        return self.starts.nbytes + self.values.nbytes
+
+    def __len__(self):
+        return self.length
+
+    def sum(self, dtype=np.int64):
+        """Total depth over all positions."""
+        return (self.values.astype(dtype) * self.run_lengths).sum(dtype=dtype)
+
+    def mean(self):
+        """Mean depth over all positions."""
+        if self.length == 0:
+            return 0.0
+        return self.sum() / self.length
+
+    def count_between(self, min_value, max_value):
+        """
+        Counts positions where the depth is >= min_value and <= max_value
+
+        Returns:
+            int:
+                number of positions meeting this threshold
+        """
+        keep = (self.values >= min_value) & (self.values <= max_value)
+        return int(self.run_lengths[keep].sum())
+
+    def to_dense(self):
+        """
+        Expands the runs back into a per-base coverage array
+
+        Returns:
+            numpy.ndarray:
+                int32 array with one entry per position
+        """
+        return np.repeat(self.values, self.run_lengths)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+import os
+import json
+import hashlib
+import shutil
+import tempfile
+import numpy as np
+from sequenoscope.version import __version__
+from sequenoscope.analyze.coverage import RunLengthCoverage
+from sequenoscope.utils.__init__ import compute_sha256
+
+
+class CoverageCache:
+    cache_dir = None
+    alignment_file = None
+    key = None
+    path = None
+    stats_file_name = "ref_stats.json"
+
+    def __init__(self, cache_dir, alignment_file, key=None):
+        """
+        Initalize the class with a cache directory and the bam file whose results are cached.
+        Entries are stored in a sub-directory named after the key, by default the SHA256 of the bam file.
+
+        Arguments:
+            cache_dir: str
+                a string to the path of the directory holding the cache entries
+            alignment_file: str
+                a string to the path of the bam file
+            key: str
+                (optional) key of the alignments, e.g. from alignment_key; a bam file rebuilt by
+                analyze differs in its @PG header lines on every run, so its SHA256 never matches
+        """
+        self.cache_dir = cache_dir
+        self.alignment_file = alignment_file
+        self.key = key if key is not None else compute_sha256(alignment_file)
+        self.path = os.path.join(cache_dir, self.key)
+
+    @staticmethod
+    def alignment_key(input_files, params, use_checksum=False):
+        """
+        Keys alignments by what they are made from rather than by the bam bytes. Input files are
+        identified by their path, size and modification time unless use_checksum is set.
+
+        Arguments:
+            input_files: list
+                paths of the reads and reference the alignments are made from
+            params: dict
+                options and tool versions of every step producing the alignments
+            use_checksum: bool
+                identify the input files by the SHA256 of their contents instead
+
+        Returns:
+            str:
+                SHA256 hex digest of the input file identities and the params
+        """
+        inputs = []
+        for file_path in input_files:
+            if use_checksum:
+                inputs.append(compute_sha256(file_path))
+            else:
+                stat = os.stat(file_path)
+                inputs.append([os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns])
+        key = {'version': __version__,
+               'inputs': inputs,
+               'params': params}
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+    def exists(self):
+        """
+        Returns:
+            bool:
+                returns True if a complete cache entry exists for the bam file
+        """
+        return os.path.isfile(os.path.join(self.path, self.stats_file_name))
+
+    def save(self, ref_stats, ref_coverage):
+        """
+        Writes the per-contig statistics, coverage arrays and read tables of a processed bam file.
+        The entry is written to a temporary directory first and renamed into place, so readers
+        never see a partial entry and concurrent writers do not clash.
+
+        Arguments:
+            ref_stats: dict
+                per-contig statistics from BamProcessor
+            ref_coverage: dict
+                per-contig coverage from BamProcessor as numpy arrays or RunLengthCoverage
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{self.key}.", dir=self.cache_dir)
+        contigs = []
+        for index, (contig_id, stats) in enumerate(ref_stats.items()):
+            entry = {'contig_id': contig_id, 'coverage': None,
+                     'stats': {k: v for k, v in stats.items() if k not in ('reads', 'depth_hist')}}
+            coverage = ref_coverage.get(contig_id)
+            if isinstance(coverage, RunLengthCoverage):
+                entry['coverage'] = 'rle'
+                np.save(os.path.join(tmp_dir, f"{index}.cov_starts.npy"), coverage.starts)
+                np.save(os.path.join(tmp_dir, f"{index}.cov_values.npy"), coverage.values)
+            elif coverage is not None:
+                entry['coverage'] = 'dense'
+                np.save(os.path.join(tmp_dir, f"{index}.cov.npy"), coverage)
+            if stats.get('depth_hist') is not None:
+                np.save(os.path.join(tmp_dir, f"{index}.depth_hist.npy"), stats['depth_hist'])
+            if len(stats['reads']) > 0:
+                read_ids = np.array([read_id.encode() for read_id in stats['reads']])
+                lengths, qscores = zip(*stats['reads'].values())
+                np.save(os.path.join(tmp_dir, f"{index}.read_ids.npy"), read_ids)
+                np.save(os.path.join(tmp_dir, f"{index}.read_lengths.npy"), np.array(lengths, dtype=np.int64))
+                np.save(os.path.join(tmp_dir, f"{index}.read_qscores.npy"), np.array(qscores, dtype=np.float64))
+            contigs.append(entry)
+
+        with open(os.path.join(tmp_dir, self.stats_file_name), 'w') as f:
+            json.dump({'version': __version__, 'key': self.key, 'contigs': contigs}, f)
+
+        try:
+            os.rename(tmp_dir, self.path)
+        except OSError:
+            # another run stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def load(self):
+        """
+        Reads a cache entry back. Coverage arrays are memory-mapped rather than read into memory.
+        Entries without a depth histogram load with 'depth_hist' set to None.
+
+        Returns:
+            tuple:
+                (ref_stats, ref_coverage) in the same layout BamProcessor produces
+        """
+        with open(os.path.join(self.path, self.stats_file_name), 'r') as f:
+            cached = json.load(f)
+        ref_stats = {}
+        ref_coverage = {}
+        for index, entry in enumerate(cached['contigs']):
+            contig_id = entry['contig_id']
+            stats = entry['stats']
+            stats['reads'] = {}
+            stats['depth_hist'] = None
+            depth_hist_file = os.path.join(self.path, f"{index}.depth_hist.npy")
+            if os.path.isfile(depth_hist_file):
+                stats['depth_hist'] = np.load(depth_hist_file)
+            read_ids_file = os.path.join(self.path, f"{index}.read_ids.npy")
+            if os.path.isfile(read_ids_file):
+                read_ids = np.load(read_ids_file, mmap_mode='r')
+                lengths = np.load(os.path.join(self.path, f"{index}.read_lengths.npy")).tolist()
+                qscores = np.load(os.path.join(self.path, f"{index}.read_qscores.npy")).tolist()
+                stats['reads'] = {read_id.decode(): (length, qscore)
+                                  for read_id, length, qscore in zip(read_ids.tolist(), lengths, qscores)}
+            if entry['coverage'] == 'dense':
+                ref_coverage[contig_id] = np.load(os.path.join(self.path, f"{index}.cov.npy"), mmap_mode='r')
+            elif entry['coverage'] == 'rle':
+                starts = np.load(os.path.join(self.path, f"{index}.cov_starts.npy"), mmap_mode='r')
+                values = np.load(os.path.join(self.path, f"{index}.cov_values.npy"), mmap_mode='r')
+                ref_coverage[contig_id] = RunLengthCoverage(starts, values, stats['length'])
+            ref_stats[contig_id] = stats
+        return ref_stats, ref_coverage
@@ -63,6 +63,7 @@ class FastPRunner:
         self.dedup = dedup
         self.threads = threads
         self.paired = self.read_set.is_paired
+        self.result_files = {"html":"", "json":"", "output_files_fastp":[]}
         
 
     def run_fastp(self):
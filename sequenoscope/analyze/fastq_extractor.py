@@ -1,15 +1,19 @@
 #!/usr/bin/env python
+import io
 import os
+import gzip
 from sequenoscope.constant import DefaultValues
+from sequenoscope.utils.__init__ import open_file
 
 class FastqExtractor:
     out_prefix = None
     out_dir = None
     read_set = None
     status = False
+    compress = False
     result_files = {"read_list_file":""}
     
-    def __init__(self, read_set, out_prefix, out_dir):
+    def __init__(self, read_set, out_prefix, out_dir, compress=False, buffer_size=DefaultValues.fastq_write_buffer_size):
         """
         Initalize the class with read_set, out_prefix, and out_dir
 
@@ -20,119 +24,120 @@ class FastqExtractor:
                 a designation of what the output files will be named
             out_dir: str
                 a string to the path where the output files will be stored
+            compress: bool
+                write the read list gzip-compressed, default is False
+            buffer_size: int
+                size in bytes of the read list write buffer
         """
-        self.reads = []
         self.out_prefix = out_prefix
         self.out_dir = out_dir
         self.read_set = read_set
+        self.compress = compress
+        self.buffer_size = buffer_size
+        self.result_files = {"read_list_file":""}
    
     def extract_single_reads(self):
         """
         Extracts the read ids from a single-end fastq file based on the paramters intialized in the previous method.
 
-        Returns:
-            bool:
-                returns True if the generated output file is found and not empty, False otherwise
+        Raises:
+            ValueError: if the read list was not created or is empty
         """
-        self.extract_reads(self.read_set.files[0], self.reads, read_delimiter=" ", split_delimiter=None)
-
-        self.write_reads(read_lists=[self.reads])
+        self.write_reads([self.read_set.files[0]], read_delimiter=" ", split_delimiter=None)
                
     def extract_paired_reads(self):
         """
         Extracts the read ids from a paired-end fastq file based on the paramters intialized in the previous method.
 
-        Returns:
-            bool:
-                returns True if the generated output file is found and not empty, False otherwise
+        Raises:
+            ValueError: if the read list was not created or is empty
         """
-        forward_reads = []
-        self.extract_reads(self.read_set.files[0], forward_reads, split_delimiter=":")
-        reverse_reads = []
-        self.extract_reads(self.read_set.files[1], reverse_reads, split_delimiter=":")
+        self.write_reads(self.read_set.files[:2], split_delimiter=":")
 
-        self.write_reads(read_lists=[forward_reads, reverse_reads])
-        
     def alt_extract_paired_reads(self):
         """
-        Extracts the read ids from a paired-end fastq file based on the paramters intialized in the previous method.
+        Extracts the read ids of a paired-end fastq file pair, keeping only the headers that end with
+        the mate number: 1 in the forward file and 2 in the reverse file.
 
-        Returns:
-            bool:
-                returns True if the generated output file is found and not empty, False otherwise
+        Raises:
+            ValueError: if the read list was not created or is empty
         """
-        forward_reads = []
-        with open(self.read_set.files[0], 'r') as f:
-            for line in f:
-                if line.startswith('@'):
-                    if line.endswith('1\n'):
-                        read_id = line.strip().split()[0][1:] #+ '_R1'
-                        forward_reads.append(read_id)
-        reverse_reads = []
-        with open(self.read_set.files[1], 'r') as f:
-            for line in f:
-                if line.startswith('@'):
-                    if line.endswith('2\n'):
-                        read_id = line.strip().split()[0][1:] #+ '_R2'
-                        reverse_reads.append(read_id)
-        self.write_reads(read_lists=[forward_reads, reverse_reads])
-    
-    def extract_reads(self, file, read_list, read_delimiter=None, split_delimiter=None):
+        self.write_reads(self.read_set.files[:2], mate_suffixes=["1", "2"])
+
+    def extract_reads(self, file, fout, read_delimiter=None, split_delimiter=None, mate_suffix=None):
         """
-        Strip the lines of fastq file based on various delimitors that result
-        from different sequencing instrumnetaion output
+        Strip the header lines of fastq file based on various delimitors that result
+        from different sequencing instrumnetaion output, and write the read ids as they are found
 
         Arguments:
             file: list object
                 file in read set for extracting reads
-            read_list: list
-                list of where to store reads
+            fout: file object
+                binary file the read ids are written to, one per line
             read_delimitor: str
                 delimitor that is located by the read id after stripping the lines
             split_delimitor: str
                 delimitor that is located by the read id before stripping the lines
+            mate_suffix: str
+                (optional) only keep the headers ending with this mate number
         """
-        line_count = 0
-        with open(file, 'r') as f:
+        read_delimiter = read_delimiter.encode() if read_delimiter is not None else None
+        mate_suffix = mate_suffix.encode() if mate_suffix is not None else None
+        split_delimiter = split_delimiter.encode() if split_delimiter is not None else None
+        line_starter = DefaultValues.fastq_line_starter.encode()
+        with open_file(file, 'rb') as f:
             for line in f:
-                line_count += 1
-                if line.startswith(DefaultValues.fastq_line_starter) and (line_count % 4 == 1):
-                    if len(line.strip().split(split_delimiter)) >= DefaultValues.fastq_sample_row_number:
-                        read_id = line.strip().split(read_delimiter)[0][1:]
-                        read_list.append(read_id)
+                f.readline()
+                f.readline()
+                f.readline()
+                if line.startswith(line_starter):
+                    line = line.strip()
+                    if mate_suffix is not None:
+                        if line.endswith(mate_suffix):
+                            fout.write(line.split()[0][1:] + b"\n")
+                        continue
+                    if len(line.split(split_delimiter)) >= DefaultValues.fastq_sample_row_number:
+                        read_id = line.split(read_delimiter)[0][1:]
                     else:
-                        read_id = line.strip().split()[0][1:]
-                        read_list.append(read_id)
+                        read_id = line.split()[0][1:]
+                    fout.write(read_id + b"\n")
     
-    def write_reads(self, read_lists=[]):
+    def write_reads(self, files, read_delimiter=None, split_delimiter=None, mate_suffixes=None):
         """
-        Append the lines extracted from a list into a file output and check if the file was created
+        Stream the read ids of the fastq files into the read list through a buffered writer and
+        check if the file was created. Memory use does not depend on the number of reads.
 
         Arguments:
-            read_lists: list
-                lists of where reads are stored
+            files: list
+                fastq files to extract the read ids from, in order
+            read_delimitor: str
+                delimitor that is located by the read id after stripping the lines
+            split_delimitor: str
+                delimitor that is located by the read id before stripping the lines
+            mate_suffixes: list
+                (optional) mate number the headers of each file must end with
 
-        Returns:
-            bool:
-                returns True if the generated output file is found and not empty, False otherwise
+        Raises:
+            ValueError: if the read list was not created or is empty
         """
         output_file = os.path.join(self.out_dir,f"{self.out_prefix}.txt")
+        if self.compress:
+            output_file += ".gz"
+            raw_out = gzip.open(output_file, 'wb')
+        else:
+            raw_out = open(output_file, 'wb', buffering=0)
         self.result_files["read_list_file"] = output_file
 
-        if len(read_lists) == 1:
-            with open(output_file, 'w') as f:
-                f.write("read_id\n")  # Write the header row
-                for read in read_lists[0]:
-                    f.write(f"{read}\n")
-        else:
-            with open(output_file, 'w') as f:
-                f.write("read_id\n")  # Write the header row
-                for read in read_lists[0] + read_lists[1]:
-                    f.write(f"{read}\n")
+        with io.BufferedWriter(raw_out, buffer_size=self.buffer_size) as f:
+            f.write(b"read_id\n")  # Write the header row
+            for file_num, file in enumerate(files):
+                mate_suffix = mate_suffixes[file_num] if mate_suffixes is not None else None
+                self.extract_reads(file, f, read_delimiter=read_delimiter, split_delimiter=split_delimiter,
+                                   mate_suffix=mate_suffix)
             
         self.status = self.check_files(output_file)
         if self.status == False:
-            self.error_messages = "one or more files was not created or was empty, check error message\n{}".format(self.stderr)
+            self.error_messages = "one or more files was not created or was empty"
             raise ValueError(str(self.error_messages))
 
     def check_files(self, files_to_check):
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+import os
+import numpy as np
+from sequenoscope.constant import DefaultValues
+from sequenoscope.utils.__init__ import open_file
+from sequenoscope.utils.qscore import batch_mean_qscores
+
+# One fixed-size record per read, in the same order as the read list file.
+READ_TABLE_DTYPE = np.dtype([('read_len', '<i8'), ('read_qscore', '<f8')])
+
+
+class FastqScanner:
+    out_prefix = None
+    out_dir = None
+    read_set = None
+    status = False
+    error_messages = None
+    result_files = {"read_list_file":"", "read_table_file":""}
+
+    def __init__(self, read_set, out_prefix, out_dir, batch_size=DefaultValues.qscore_batch_size):
+        """
+        Initalize the class with read_set, out_prefix, and out_dir
+
+        Arguments:
+            read_set: sequence object
+                an object that contains the list of sequence files for analysis
+            out_prefix: str
+                a designation of what the output files will be named
+            out_dir: str
+                a string to the path where the output files will be stored
+            batch_size: int
+                number of reads whose quality scores are computed together, default is 10000
+        """
+        self.out_prefix = out_prefix
+        self.out_dir = out_dir
+        self.read_set = read_set
+        self.batch_size = batch_size
+
+    def scan(self):
+        """
+        Reads every fastq file of the read set once and writes the read id list together with a
+        binary per-read table of read length and mean qscore, row-aligned with the read id list.
+
+        Returns:
+            bool:
+                returns True if the generated output files are found and not empty, False otherwise
+        """
+        read_list_file = os.path.join(self.out_dir, f"{self.out_prefix}.txt")
+        read_table_file = os.path.join(self.out_dir, f"{self.out_prefix}_table.bin")
+        self.result_files["read_list_file"] = read_list_file
+        self.result_files["read_table_file"] = read_table_file
+
+        with open(read_list_file, 'wb') as ids_out, open(read_table_file, 'wb') as table_out:
+            ids_out.write(b"read_id\n")  # Write the header row
+            for fastq_file in self.read_set.files:
+                self.scan_file(fastq_file, ids_out, table_out)
+
+        self.status = self.check_files([read_list_file])
+        if self.status == False:
+            self.error_messages = "one or more files was not created or was empty: {}".format(read_list_file)
+            raise ValueError(str(self.error_messages))
+
+    def scan_file(self, fastq_file, ids_out, table_out):
+        """
+        Streams one fastq file record by record and writes its reads in batches
+
+        Arguments:
+            fastq_file: str
+                path to a plain or gzipped fastq file
+            ids_out: file object
+                binary handle of the read id list
+            table_out: file object
+                binary handle of the read table
+        """
+        read_ids = []
+        lengths = []
+        quals = []
+        with open_file(fastq_file, 'rb') as f:
+            for header in f:
+                seq = f.readline()
+                f.readline()
+                qual = f.readline()
+                if not header.startswith(DefaultValues.fastq_line_starter.encode()):
+                    continue
+                read_ids.append(header[1:].split(None, 1)[0])
+                lengths.append(len(seq.rstrip(b"\r\n")))
+                quals.append(qual.rstrip(b"\r\n"))
+                if len(quals) >= self.batch_size:
+                    self.write_batch(read_ids, lengths, quals, ids_out, table_out)
+                    read_ids, lengths, quals = [], [], []
+        self.write_batch(read_ids, lengths, quals, ids_out, table_out)
+
+    @staticmethod
+    def write_batch(read_ids, lengths, quals, ids_out, table_out):
+        """
+        Computes the mean qscores of a batch of reads and appends the batch to both outputs
+        """
+        if len(read_ids) == 0:
+            return
+        ids_out.write(b"\n".join(read_ids) + b"\n")
+        table = np.empty(len(read_ids), dtype=READ_TABLE_DTYPE)
+        table['read_len'] = lengths
+        table['read_qscore'] = batch_mean_qscores(quals)
+        table.tofile(table_out)
+
+    @staticmethod
+    def load_read_table(read_table_file):
+        """
+        Memory-maps a read table written by scan
+
+        Arguments:
+            read_table_file: str
+                path to the read table
+
+        Returns:
+            numpy.ndarray:
+                structured array with read_len and read_qscore fields, one row per read in the read list
+        """
+        if os.path.getsize(read_table_file) == 0:
+            return np.zeros(0, dtype=READ_TABLE_DTYPE)
+        return np.memmap(read_table_file, dtype=READ_TABLE_DTYPE, mode='r')
+
+    def check_files(self, files_to_check):
+        """
+        check if the output file exists and is not empty
+
+        Arguments:
+            files_to_check: list
+                list of file paths
+
+        Returns:
+            bool:
+                returns True if the generated output file is found and not empty, False otherwise
+        """
+        if isinstance (files_to_check, str):
+            files_to_check = [files_to_check]
+        for f in files_to_check:
+            if not os.path.isfile(f):
+                return False
+            elif os.path.getsize(f) == 0:
+                return False
+        return True
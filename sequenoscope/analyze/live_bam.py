@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+import array
+import statistics
+import numpy as np
+import pysam
+from sequenoscope.analyze.bam import BamProcessor
+
+
+class IncrementalBamProcessor(BamProcessor):
+    chunks = 0
+    read_lengths = {}
+    read_qualities = {}
+    total_bases = {}
+    total_qualities = {}
+
+    def __init__(self, min_coverage, sparse_coverage=False):
+        """
+        Initalize the class without alignments. The statistics of BamProcessor are built up by
+        adding the bam files of consecutive read chunks with add_bam, each costing time
+        proportional to the alignments of the new chunk only.
+
+        The length and qscore of every alignment are kept for the medians and the N50 in finalize,
+        as 8 byte machine values: about 16 bytes per alignment for the whole run, next to the read
+        index every manifest needs.
+
+        Arguments:
+            min_coverage: int
+                minimum coverage threshold used for the covered bases statistic
+            sparse_coverage: bool
+                run-length encode the coverage arrays in finalize when smaller
+        """
+        self.min_coverage = min_coverage
+        self.threads = 1
+        self.sparse_coverage = sparse_coverage
+        self.cache_dir = None
+        self.read_locations = {}
+        self.ref_stats = {}
+        self.ref_coverage = {}
+        self.chunks = 0
+        self.read_lengths = {}
+        self.read_qualities = {}
+        self.total_bases = {}
+        self.total_qualities = {}
+
+    def add_contig(self, contig_id, length):
+        """
+        Adds a contig with empty statistics, unless it is already known
+
+        Arguments:
+            contig_id: str
+                name of the contig, '*' for the unmapped reads
+            length: int
+                length of the contig
+        """
+        if contig_id in self.ref_stats:
+            return
+        self.ref_stats[contig_id] = {'length':length,'indexed_reads':0,
+                                     'reads': {},'num_reads':0,'mean_cov':0,
+                                     'covered_bases':0,'total_mapped_bases':0,'depth_hist':None,'mean_len':0,'median_len':0,
+                                     'mean_qual':0,'median_qual':0,'n50':0}
+        self.read_lengths[contig_id] = array.array('q')
+        self.read_qualities[contig_id] = array.array('d')
+        self.total_bases[contig_id] = 0
+        self.total_qualities[contig_id] = 0.0
+
+    def add_bam(self, alignment_file):
+        """
+        Folds the alignments of a chunk into the statistics, coverage and read index. Reads are
+        assigned to contigs as in BamProcessor, with unplaced reads counted under '*'.
+
+        Arguments:
+            alignment_file: str
+                path to the bam file of the new chunk; it does not need to be sorted or indexed
+        """
+        with pysam.AlignmentFile(alignment_file, "rb") as pysam_obj:
+            for contig_id, length in zip(pysam_obj.references, pysam_obj.lengths):
+                self.add_contig(contig_id, length)
+            self.add_contig('*', 0)
+            self.add_alignments(self.bam_alignments(pysam_obj))
+        self.chunks += 1
+
+    def bam_alignments(self, pysam_obj):
+        """
+        Yields the alignment records of a bam file in the form taken by add_alignments
+        """
+        for read in pysam_obj.fetch(until_eof=True):
+            contig_id = read.reference_name if read.reference_name is not None else '*'
+            seq = read.query_sequence
+            length = len(seq) if seq is not None else 0
+            qscore = self.calc_mean_qscores(read.query_qualities)
+            start = read.reference_start
+            aln_len = 0 if read.is_unmapped else read.query_alignment_length
+            yield contig_id, read.query_name, length, qscore, start, start + aln_len
+
+    def add_alignments(self, alignments):
+        """
+        Folds alignment records into the statistics, coverage and read index. The contigs must
+        have been added with add_contig first.
+
+        Arguments:
+            alignments: iterable
+                (contig_id, read_id, read length, qscore, reference start, reference end) of each
+                alignment; contig_id is '*' for unmapped reads, whose positions are ignored
+        """
+        chunk_reads = {}
+        intervals = {}
+        for contig_id, read_id, length, qscore, start, end in alignments:
+            chunk_reads.setdefault(contig_id, {})[read_id] = (length, qscore)
+            self.read_lengths[contig_id].append(length)
+            self.read_qualities[contig_id].append(qscore)
+            self.total_bases[contig_id] += length
+            self.total_qualities[contig_id] += qscore
+            if contig_id == '*':
+                continue
+            starts, ends = intervals.setdefault(contig_id, ([], []))
+            starts.append(start)
+            ends.append(end)
+
+        # Contigs are indexed in reference order, as BamProcessor does, so reads on several contigs list them alike
+        for contig_id, stats in self.ref_stats.items():
+            reads = chunk_reads.get(contig_id)
+            if reads is None:
+                continue
+            stats['reads'].update(reads)
+            self.index_reads(contig_id, reads)
+            stats['indexed_reads'] += len(self.read_lengths[contig_id]) - stats['num_reads']
+            stats['num_reads'] = len(self.read_lengths[contig_id])
+            stats['mean_len'] = self.total_bases[contig_id] / stats['num_reads']
+            stats['mean_qual'] = self.total_qualities[contig_id] / stats['num_reads']
+            if contig_id in intervals:
+                self.add_coverage(contig_id, *intervals[contig_id])
+
+    def add_coverage(self, contig_id, starts, ends):
+        """
+        Adds alignment intervals to the coverage of a contig and updates its depth histogram.
+        Only the positions covered by the new intervals are visited: the intervals are cut at
+        their start and end points and each covered segment is raised by its depth at once.
+
+        Arguments:
+            contig_id: str
+                name of the contig
+            starts: list
+                0-based reference start position of each alignment
+            ends: list
+                exclusive reference end position of each alignment
+        """
+        stats = self.ref_stats[contig_id]
+        coverage = self.get_base_cov(contig_id)
+        if stats['depth_hist'] is None:
+            stats['depth_hist'] = np.array([len(coverage)], dtype=np.int64)
+        depth_hist = stats['depth_hist']
+
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.minimum(np.asarray(ends, dtype=np.int64), len(coverage))
+        keep = starts < ends
+        starts = starts[keep]
+        ends = ends[keep]
+        breakpoints, positions = np.unique(np.concatenate((starts, ends)), return_inverse=True)
+        delta = np.zeros(len(breakpoints), dtype=np.int64)
+        np.add.at(delta, positions[:len(starts)], 1)
+        np.add.at(delta, positions[len(starts):], -1)
+        depth = np.cumsum(delta)
+
+        for i in np.flatnonzero(depth[:-1] > 0):
+            segment = coverage[breakpoints[i]:breakpoints[i + 1]]
+            added = int(depth[i])
+            counts = np.bincount(segment)
+            if len(depth_hist) < len(counts) + added:
+                depth_hist = np.pad(depth_hist, (0, len(counts) + added - len(depth_hist)))
+            depth_hist[:len(counts)] -= counts
+            depth_hist[added:added + len(counts)] += counts
+            segment += added
+
+        stats['depth_hist'] = depth_hist
+        stats['total_mapped_bases'] += int((np.diff(breakpoints) * depth[:-1]).sum())
+        stats['mean_cov'] = stats['total_mapped_bases'] / stats['length']
+        stats['covered_bases'] = self.get_covered_bases(contig_id)
+
+    def finalize(self):
+        """
+        Computes the order statistics that need every read of a contig: the median read length,
+        the median qscore and the N50. They are left out of the per-chunk updates. With
+        sparse_coverage the coverage is then run-length encoded and no more alignments can be added.
+        """
+        for contig_id, lengths in self.read_lengths.items():
+            if len(lengths) == 0:
+                continue
+            stats = self.ref_stats[contig_id]
+            stats['n50'] = self.calc_n50(sorted(lengths, reverse=True), self.total_bases[contig_id])
+            stats['median_len'] = statistics.median(lengths)
+            stats['median_qual'] = statistics.median(self.read_qualities[contig_id])
+        if self.sparse_coverage:
+            for contig_id, coverage in self.ref_coverage.items():
+                self.ref_coverage[contig_id] = self.compress_coverage(coverage)
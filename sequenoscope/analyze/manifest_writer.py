@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+import os
+import numpy as np
+import pandas as pd
+from sequenoscope.constant import DefaultValues
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+# File extension of each manifest format
+MANIFEST_FORMATS = {'tsv': '.txt', 'parquet': '.parquet', 'feather': '.feather'}
+
+# Columns stored dictionary-encoded in the columnar formats; they repeat a small set of values.
+DICTIONARY_FIELDS = ('sample_id', 'contig_id', 'decision', 'channel')
+INT_FIELDS = ('read_len',)
+FLOAT_FIELDS = ('read_qscore', 'start_time', 'end_time')
+BOOL_FIELDS = ('fastp_status', 'is_mapped', 'is_uniq')
+
+
+def manifest_file_name(out_dir, out_prefix, manifest_format='tsv'):
+    """
+    Returns:
+        str:
+            path of the manifest file for the given format
+    """
+    if manifest_format not in MANIFEST_FORMATS:
+        raise ValueError(f"Unknown manifest format {manifest_format}; choose from {', '.join(MANIFEST_FORMATS)}")
+    return os.path.join(out_dir, f"{out_prefix}{MANIFEST_FORMATS[manifest_format]}")
+
+
+def open_manifest_writer(out_dir, out_prefix, fields, manifest_format='tsv', batch_size=DefaultValues.manifest_batch_size):
+    """
+    Opens a writer for a manifest in the given format
+
+    Arguments:
+        out_dir: str
+            a string to the path where the manifest will be stored
+        out_prefix: str
+            a designation of what the manifest will be named
+        fields: list
+            manifest column names, in order
+        manifest_format: str
+            tsv, parquet or feather
+        batch_size: int
+            rows buffered per record batch by the columnar writers
+
+    Returns:
+        TsvManifestWriter or ColumnarManifestWriter
+    """
+    out_file = manifest_file_name(out_dir, out_prefix, manifest_format)
+    if manifest_format == 'tsv':
+        return TsvManifestWriter(out_file, fields)
+    return ColumnarManifestWriter(out_file, fields, manifest_format, batch_size)
+
+
+class TsvManifestWriter:
+    out_file = None
+    fields = []
+
+    def __init__(self, out_file, fields):
+        """
+        Initalize the class with the manifest path and columns and write the header row
+
+        Arguments:
+            out_file: str
+                path of the manifest
+            fields: list
+                manifest column names, in order
+        """
+        self.out_file = out_file
+        self.fields = list(fields)
+        self.fout = open(out_file, 'w')
+        self.fout.write("\t".join(self.fields) + "\n")
+
+    def write_row(self, row):
+        """Writes one row; the values of row are in the order of the fields."""
+        self.fout.write("\t".join(str(x) for x in row.values()) + "\n")
+
+    def write_columns(self, columns):
+        """
+        Writes a batch of rows given column by column
+
+        Arguments:
+            columns: dict
+                sequence of values for every field, all of the same length
+        """
+        values = [map(str, columns[field]) for field in self.fields]
+        lines = "\n".join(map("\t".join, zip(*values)))
+        if lines:
+            self.fout.write(lines + "\n")
+
+    def close(self):
+        self.fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ColumnarManifestWriter:
+    out_file = None
+    fields = []
+    manifest_format = None
+    batch_size = DefaultValues.manifest_batch_size
+
+    def __init__(self, out_file, fields, manifest_format, batch_size=DefaultValues.manifest_batch_size):
+        """
+        Initalize the class with the manifest path and columns. Rows are buffered column by column
+        and written as record batches of batch_size rows: row groups in parquet, record batches in
+        the Arrow IPC (feather) file.
+
+        Arguments:
+            out_file: str
+                path of the manifest
+            fields: list
+                manifest column names, in order
+            manifest_format: str
+                parquet or feather
+            batch_size: int
+                number of rows per record batch
+        """
+        if pa is None:
+            raise ValueError(f"The {manifest_format} manifest format requires the pyarrow package; install it or use the tsv format.")
+        self.out_file = out_file
+        self.fields = list(fields)
+        self.manifest_format = manifest_format
+        self.batch_size = batch_size
+        self.schema = pa.schema([(field, self.field_type(field)) for field in self.fields])
+        self.columns = {field: [] for field in self.fields}
+        # Dictionaries only ever grow, so every batch extends the dictionaries of the earlier ones.
+        self.dictionaries = {field: {} for field in self.fields if field in DICTIONARY_FIELDS}
+        self.num_rows = 0
+        if manifest_format == 'parquet':
+            self.writer = pq.ParquetWriter(out_file, self.schema, compression='zstd')
+        else:
+            options = pa.ipc.IpcWriteOptions(compression='zstd', emit_dictionary_deltas=True)
+            self.writer = pa.ipc.new_file(out_file, self.schema, options=options)
+
+    @staticmethod
+    def field_type(field):
+        """
+        Returns:
+            pyarrow.DataType:
+                storage type of a manifest column
+        """
+        if field in DICTIONARY_FIELDS:
+            return pa.dictionary(pa.int32(), pa.string())
+        if field in INT_FIELDS:
+            return pa.int64()
+        if field in FLOAT_FIELDS:
+            return pa.float64()
+        if field in BOOL_FIELDS:
+            return pa.bool_()
+        return pa.string()
+
+    @staticmethod
+    def convert_value(field, value):
+        """
+        Converts a manifest value to the type of its column; empty values become nulls
+        """
+        if value is None or value == '':
+            return None
+        if field in BOOL_FIELDS:
+            return value if isinstance(value, bool) else str(value).lower() == 'true'
+        if field in INT_FIELDS:
+            try:
+                return int(value)
+            except ValueError:
+                return int(float(value))
+        if field in FLOAT_FIELDS:
+            return float(value)
+        return str(value)
+
+    def write_row(self, row):
+        """Buffers one row and writes a record batch once batch_size rows are buffered."""
+        for field in self.fields:
+            value = self.convert_value(field, row.get(field))
+            if field in self.dictionaries:
+                dictionary = self.dictionaries[field]
+                if value is not None:
+                    value = dictionary.setdefault(value, len(dictionary))
+            self.columns[field].append(value)
+        self.num_rows += 1
+        if self.num_rows >= self.batch_size:
+            self.flush()
+
+    def write_columns(self, columns):
+        """
+        Writes a batch of rows given column by column as one record batch, converting each
+        column at once rather than value by value
+
+        Arguments:
+            columns: dict
+                sequence of values for every field, all of the same length
+        """
+        self.flush()
+        arrays = []
+        for field in self.fields:
+            values = pd.Series(np.asarray(columns[field], dtype=object))
+            empty = values.isna() | (values.astype(str) == '')
+            if field in self.dictionaries:
+                dictionary = self.dictionaries[field]
+                values = values.astype(str)
+                for value in values[~empty].unique():
+                    dictionary.setdefault(value, len(dictionary))
+                indices = pd.Index(list(dictionary)).get_indexer(values)
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    pa.array(indices, type=pa.int32(), mask=empty.to_numpy()),
+                    pa.array(list(dictionary), type=pa.string())))
+            elif field in INT_FIELDS or field in FLOAT_FIELDS:
+                numbers = pd.to_numeric(values.where(~empty, None), errors='coerce')
+                if field in INT_FIELDS:
+                    numbers = numbers.astype('Int64')
+                arrays.append(pa.array(numbers, type=self.schema.field(field).type, from_pandas=True))
+            elif field in BOOL_FIELDS:
+                arrays.append(pa.array(values.where(~empty, False).astype(bool).to_numpy(), mask=empty.to_numpy(), type=pa.bool_()))
+            else:
+                arrays.append(pa.array(values.astype(str).to_numpy(dtype=object), mask=empty.to_numpy(), type=pa.string()))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if batch.num_rows == 0:
+            return
+        if self.manifest_format == 'parquet':
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+
+    def flush(self):
+        """Writes the buffered rows as one record batch"""
+        if self.num_rows == 0:
+            return
+        arrays = []
+        for field in self.fields:
+            if field in self.dictionaries:
+                indices = pa.array(self.columns[field], type=pa.int32())
+                dictionary = pa.array(list(self.dictionaries[field]), type=pa.string())
+                arrays.append(pa.DictionaryArray.from_arrays(indices, dictionary))
+            else:
+                arrays.append(pa.array(self.columns[field], type=self.schema.field(field).type))
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.manifest_format == 'parquet':
+            self.writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self.writer.write_batch(batch)
+        self.columns = {field: [] for field in self.fields}
+        self.num_rows = 0
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import pysam
+from sequenoscope.constant import DefaultValues
+from sequenoscope.utils.qscore import mean_qscore_phred33
+
+try:
+    import mappy
+except ImportError:
+    mappy = None
+
+# Complement of each base, used to write reverse strand alignments to the bam file
+COMPLEMENT = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+
+
+class MappyAligner:
+    read_set = None
+    ref_database = None
+    bam_obj = None
+    out_dir = None
+    out_prefix = None
+    threads = 1
+    kmer_size = 15
+    batch_size = DefaultValues.mappy_batch_size
+    write_bam = False
+    paired = False
+    aligner = None
+    status = False
+    error_messages = None
+    result_files = {"bam_output":"", "bam_index":""}
+
+    def __init__(self, read_set, ref_database, bam_obj, out_dir=None, out_prefix=None, threads=1,
+                 kmer_size=DefaultValues.minimap2_kmer_size, write_bam=False, batch_size=DefaultValues.mappy_batch_size):
+        """
+        Initalize the class with read_set, ref_database and the statistics object the alignments are added to.
+        Reads are aligned in-process with the minimap2 python bindings (mappy) and each hit goes straight
+        into the coverage and per-read statistics; a bam file is only written when write_bam is set.
+
+        Arguments:
+            read_set: sequence object
+                an object that contains the list of sequence files for analysis
+            ref_database: str
+                a string to the path of reference sequence file or minimap2 index
+            bam_obj: IncrementalBamProcessor
+                statistics object receiving the alignments
+            out_dir: str
+                a string to the path where the bam file will be stored, required with write_bam
+            out_prefix: str
+                a designation of what the bam file will be named, required with write_bam
+            threads: int
+                an integer representing the number of alignment threads, default is 1
+            kmer_size: int
+                an integer representing the minimizer kmer size, default is 15
+            write_bam: bool
+                also write the alignments to a sorted and indexed bam file
+            batch_size: int
+                number of reads (or read pairs) handed to a thread at once
+        """
+        if mappy is None:
+            raise ValueError("The mappy alignment engine requires the mappy package; install it or use minimap2.")
+        self.read_set = read_set
+        self.ref_database = ref_database
+        self.bam_obj = bam_obj
+        self.out_dir = out_dir
+        self.out_prefix = out_prefix
+        self.threads = threads
+        self.kmer_size = kmer_size
+        self.write_bam = write_bam
+        self.batch_size = batch_size
+        self.paired = self.read_set.is_paired
+        self.result_files = {"bam_output":"", "bam_index":""}
+        self.local = threading.local()
+
+    def align(self):
+        """
+        Loads the reference and aligns all reads across a thread pool. Batches are folded into bam_obj
+        in input order; at most two batches per thread are in flight so memory stays bounded. The
+        caller counts the aligned reads as a chunk of bam_obj.
+        """
+        preset = "sr" if self.paired else "map-ont"
+        self.aligner = mappy.Aligner(self.ref_database, preset=preset, k=self.kmer_size, n_threads=self.threads)
+        if not self.aligner:
+            self.error_messages = f"failed to load or build the minimap2 index of {self.ref_database}"
+            raise ValueError(str(self.error_messages))
+
+        for contig_id in self.aligner.seq_names:
+            self.bam_obj.add_contig(contig_id, len(self.aligner.seq(contig_id)))
+        self.bam_obj.add_contig('*', 0)
+
+        bam_out = None
+        if self.write_bam:
+            bam_file = os.path.join(self.out_dir, f"{self.out_prefix}.bam")
+            unsorted_file = os.path.join(self.out_dir, f"{self.out_prefix}.unsorted.bam")
+            header = {'HD': {'VN': '1.6', 'SO': 'unsorted'},
+                      'SQ': [{'SN': contig_id, 'LN': len(self.aligner.seq(contig_id))} for contig_id in self.aligner.seq_names]}
+            bam_out = pysam.AlignmentFile(unsorted_file, "wb", header=header)
+
+        batches = self.read_batches()
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for batch in batches:
+                pending.append(executor.submit(self.map_batch, batch))
+                if len(pending) >= 2 * self.threads:
+                    self.add_batch(pending.popleft().result(), bam_out)
+            while pending:
+                self.add_batch(pending.popleft().result(), bam_out)
+
+        if bam_out is not None:
+            bam_out.close()
+            bam_index = f"{bam_file}.bai"
+            self.result_files["bam_output"] = bam_file
+            self.result_files["bam_index"] = bam_index
+            pysam.sort("-@", f"{self.threads}", "-o", bam_file, unsorted_file)
+            pysam.index(bam_file, bam_index)
+            os.remove(unsorted_file)
+            self.status = self.check_files([bam_file, bam_index])
+            if self.status == False:
+                self.error_messages = "one or more files was not created or was empty"
+                raise ValueError(str(self.error_messages))
+        self.status = True
+
+    def read_batches(self):
+        """
+        Yields batches of reads from the read set; with paired files each item holds both mates.
+        """
+        readers = [mappy.fastx_read(read_file) for read_file in self.read_set.files]
+        reads = zip(*readers) if self.paired else ((read,) for read in readers[0])
+        while True:
+            batch = list(islice(reads, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def map_batch(self, batch):
+        """
+        Aligns a batch of reads; runs in a pool thread with its own mappy thread buffer.
+
+        Arguments:
+            batch: list
+                tuples of the (name, seq, qual) of a read, or of both mates
+
+        Returns:
+            list:
+                (name, seq, qual, qscore, mate, hits, mate_hit) of each read, where mate_hit is the
+                primary hit of the other mate of a pair
+        """
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is None:
+            buffer = self.local.buffer = mappy.ThreadBuffer()
+        mapped = []
+        for mates in batch:
+            if len(mates) == 2:
+                hits = list(self.aligner.map(mates[0][1], mates[1][1], buf=buffer))
+                mate_hits = [[hit for hit in hits if hit.read_num == mate] for mate in (1, 2)]
+            else:
+                mate_hits = [list(self.aligner.map(mates[0][1], buf=buffer))]
+            for mate, (name, seq, qual) in enumerate(mates):
+                mate_hit = self.primary_hit(mate_hits[1 - mate]) if len(mates) == 2 else None
+                mapped.append((name, seq, qual, mean_qscore_phred33(qual) if qual else 0, mate, mate_hits[mate], mate_hit))
+        return mapped
+
+    @staticmethod
+    def primary_hit(hits):
+        """
+        Returns:
+            mappy.Alignment:
+                the primary hit of a read, None if it is unmapped
+        """
+        return next((hit for hit in hits if hit.is_primary), None)
+
+    def add_batch(self, mapped, bam_out=None):
+        """
+        Folds an aligned batch into bam_obj, and writes it to the bam file when one is open
+
+        Arguments:
+            mapped: list
+                aligned reads as returned by map_batch
+            bam_out: pysam.AlignmentFile
+                (optional) unsorted bam file being written
+        """
+        alignments = []
+        for name, seq, qual, qscore, mate, hits, mate_hit in mapped:
+            alignments.extend(self.read_alignments(name, seq, qual, qscore, hits, mate_hit))
+            if bam_out is not None:
+                for segment in self.bam_segments(bam_out.header, name, seq, qual, mate, hits, mate_hit):
+                    bam_out.write(segment)
+        # In reference start order, as the records come out of a sorted bam file
+        alignments.sort(key=lambda alignment: alignment[4])
+        self.bam_obj.add_alignments(alignments)
+
+    def read_alignments(self, name, seq, qual, qscore, hits, mate_hit=None):
+        """
+        Turns the hits of a read into alignment records, counted the way BamProcessor counts the bam
+        records minimap2 writes: secondary hits carry no sequence, supplementary hits only their aligned
+        part, and the aligned reference span is the aligned query length from the reference start.
+        An unmapped read whose mate is mapped is placed at the position of its mate without coverage.
+
+        Returns:
+            list:
+                (contig_id, read_id, read length, qscore, reference start, reference end) of each hit
+        """
+        if not hits:
+            if mate_hit is not None:
+                return [(mate_hit.ctg, name, len(seq), qscore, mate_hit.r_st, mate_hit.r_st)]
+            return [('*', name, len(seq), qscore, 0, 0)]
+        alignments = []
+        primary_seen = False
+        for hit in hits:
+            aln_len = hit.q_en - hit.q_st
+            if not hit.is_primary:
+                length, hit_qscore = 0, 0
+            elif primary_seen:
+                length = aln_len
+                hit_qscore = mean_qscore_phred33(qual[hit.q_st:hit.q_en]) if qual else 0
+            else:
+                length, hit_qscore = len(seq), qscore
+                primary_seen = True
+            alignments.append((hit.ctg, name, length, hit_qscore, hit.r_st, hit.r_st + aln_len))
+        return alignments
+
+    def bam_segments(self, header, name, seq, qual, mate, hits, mate_hit=None):
+        """
+        Builds the bam records of a read in the layout of minimap2 -a output, with soft clipped primary
+        hits, hard clipped supplementary hits and secondary hits without sequence. Paired records point
+        at the primary hit of the other mate; an unmapped read is placed at the position of its mapped
+        mate, and a record whose mate is unmapped points at itself.
+
+        Returns:
+            list:
+                pysam.AlignedSegment of each hit, or one unmapped record
+        """
+        pair_flag = 0
+        if self.paired:
+            pair_flag = 0x1 | (0x40 if mate == 0 else 0x80)
+            if mate_hit is None:
+                pair_flag |= 0x8
+            elif mate_hit.strand < 0:
+                pair_flag |= 0x20
+        if not hits:
+            segment = pysam.AlignedSegment(header)
+            segment.query_name = name
+            segment.flag = pair_flag | 0x4
+            segment.query_sequence = seq
+            if qual:
+                segment.query_qualities = pysam.qualitystring_to_array(qual)
+            if mate_hit is not None:
+                segment.reference_name = mate_hit.ctg
+                segment.reference_start = mate_hit.r_st
+                segment.next_reference_name = mate_hit.ctg
+                segment.next_reference_start = mate_hit.r_st
+            return [segment]
+
+        segments = []
+        primary_seen = False
+        for hit in hits:
+            segment = pysam.AlignedSegment(header)
+            segment.query_name = name
+            segment.reference_name = hit.ctg
+            segment.reference_start = hit.r_st
+            segment.mapping_quality = hit.mapq
+            reverse = hit.strand < 0
+            left, right = (len(seq) - hit.q_en, hit.q_st) if reverse else (hit.q_st, len(seq) - hit.q_en)
+            cigar = [(op, length) for length, op in hit.cigar]
+            flag = pair_flag | (0x10 if reverse else 0)
+            if not hit.is_primary:
+                flag |= 0x100
+                clip = 5
+                read_seq, read_qual = None, None
+            elif primary_seen:
+                flag |= 0x800
+                clip = 5
+                read_seq, read_qual = seq[hit.q_st:hit.q_en], qual[hit.q_st:hit.q_en] if qual else None
+            else:
+                clip = 4
+                read_seq, read_qual = seq, qual
+                primary_seen = True
+            segment.flag = flag
+            segment.cigartuples = ([(clip, left)] if left else []) + cigar + ([(clip, right)] if right else [])
+            if read_seq is not None:
+                if reverse:
+                    read_seq = read_seq.translate(COMPLEMENT)[::-1]
+                    read_qual = read_qual[::-1] if read_qual else None
+                segment.query_sequence = read_seq
+                if read_qual:
+                    segment.query_qualities = pysam.qualitystring_to_array(read_qual)
+            if mate_hit is not None:
+                segment.next_reference_name = mate_hit.ctg
+                segment.next_reference_start = mate_hit.r_st
+            elif self.paired:
+                segment.next_reference_name = hit.ctg
+                segment.next_reference_start = hit.r_st
+            segment.set_tag("NM", hit.NM)
+            segments.append(segment)
+        return segments
+
+    def check_files(self, files_to_check):
+        """
+        check if the output file exists and is not empty
+
+        Arguments:
+            files_to_check: list
+                list of file paths
+
+        Returns:
+            bool:
+                returns True if the generated output file is found and not empty, False otherwise
+        """
+        if isinstance (files_to_check, str):
+            files_to_check = [files_to_check]
+        for f in files_to_check:
+            if not os.path.isfile(f):
+                return False
+            elif os.path.getsize(f) == 0:
+                return False
+        return True
@@ -0,0 +1,294 @@
+#!/usr/bin/env python
+from itertools import chain
+from contextlib import ExitStack
+import numpy as np
+from sequenoscope.constant import DefaultValues
+from sequenoscope.utils.__init__ import open_file
+from sequenoscope.utils.parser import FastqPairedEndRenamer
+
+# Uppercase base of every byte; the complement table maps an uppercase base to its complement.
+UPPER_TABLE = np.frombuffer(bytes(range(256)).upper(), dtype=np.uint8)
+COMPLEMENT_TABLE = np.frombuffer(bytes(range(256)).translate(bytes.maketrans(b"ACGT", b"TGCA")), dtype=np.uint8)
+VALID_BASES = np.isin(np.arange(256), np.frombuffer(b"ACGT", dtype=np.uint8))
+
+MURMUR_C1 = np.uint64(0x87c37b91114253d5)
+MURMUR_C2 = np.uint64(0x4cf5ad432745937f)
+
+
+def rotl64(x, r):
+    """Rotates each 64 bit value of x left by r bits."""
+    return (x << np.uint64(r)) | (x >> np.uint64(64 - r))
+
+
+def fmix64(k):
+    """Final avalanche step of MurmurHash3."""
+    k = k ^ (k >> np.uint64(33))
+    k = k * np.uint64(0xff51afd7ed558ccd)
+    k = k ^ (k >> np.uint64(33))
+    k = k * np.uint64(0xc4ceb9fe1a85ec53)
+    return k ^ (k >> np.uint64(33))
+
+
+def murmur3_x64_64(words, length, seed):
+    """
+    Hashes fixed-length keys with MurmurHash3_x64_128 and returns the first 64 bits of each hash,
+    the hash Mash uses for k-mers longer than 16 bases.
+
+    Arguments:
+        words: list
+            uint64 arrays holding the little-endian words of the keys, zero padded to a multiple of 16 bytes
+        length: int
+            length of the keys in bytes
+        seed: int
+            hash seed
+
+    Returns:
+        numpy.ndarray:
+            uint64 hash of each key
+    """
+    h1 = np.full(len(words[0]), seed, dtype=np.uint64)
+    h2 = h1.copy()
+    nblocks = length // 16
+    for block in range(nblocks):
+        k1 = words[2 * block] * MURMUR_C1
+        k1 = rotl64(k1, 31) * MURMUR_C2
+        h1 ^= k1
+        h1 = rotl64(h1, 27) + h2
+        h1 = h1 * np.uint64(5) + np.uint64(0x52dce729)
+        k2 = words[2 * block + 1] * MURMUR_C2
+        k2 = rotl64(k2, 33) * MURMUR_C1
+        h2 ^= k2
+        h2 = rotl64(h2, 31) + h1
+        h2 = h2 * np.uint64(5) + np.uint64(0x38495ab5)
+    tail = length % 16
+    if tail > 8:
+        k2 = words[2 * nblocks + 1] * MURMUR_C2
+        h2 ^= rotl64(k2, 33) * MURMUR_C1
+    if tail > 0:
+        k1 = words[2 * nblocks] * MURMUR_C1
+        h1 ^= rotl64(k1, 31) * MURMUR_C2
+    h1 ^= np.uint64(length)
+    h2 ^= np.uint64(length)
+    h1 = h1 + h2
+    h2 = h2 + h1
+    h1 = fmix64(h1)
+    h2 = fmix64(h2)
+    return h1 + h2
+
+
+class MinHashSketcher:
+    out_directory = None
+    out_prefix = None
+    kmer_size = 27
+    sketch_size = 1000
+    min_copies = 3
+    seed = 42
+    results = {}
+
+    def __init__(self, out_directory, out_prefix, kmer_size=DefaultValues.mash_kmer_size,
+                 sketch_size=DefaultValues.mash_sketch_size, min_copies=DefaultValues.mash_min_copies,
+                 batch_bases=DefaultValues.minhash_batch_bases):
+        """
+        Initalize the class with out_directory and out_prefix. The genome size and coverage are
+        estimated in-process the way `mash sketch -r -k 27 -m 3` does, without running Mash.
+
+        Arguments:
+            out_directory: str
+                a string to the path where the output files would be stored; nothing is written
+            out_prefix: str
+                a designation of what the output files would be named
+            kmer_size: int
+                length of the hashed k-mers, default is 27
+            sketch_size: int
+                number of smallest hashes kept in the sketch, default is 1000
+            min_copies: int
+                minimum number of times a k-mer must be seen to enter the sketch, default is 3
+            batch_bases: int
+                number of bases whose k-mers are hashed together
+        """
+        self.results = {}
+        self.out_directory = out_directory
+        self.out_prefix = out_prefix
+        self.kmer_size = kmer_size
+        self.sketch_size = sketch_size
+        self.min_copies = min_copies
+        self.batch_bases = batch_bases
+        # Sorted hashes below the sketch threshold with their exact counts
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.threshold = None
+
+    def run_sketch(self, input_files):
+        """
+        Sketches the reads of a single-end file, or each file of a pair on its own. As with Mash, the
+        estimates of the two mates are averaged, so the coverage is the coverage of one mate.
+
+        Arguments:
+            input_files: list
+                list containing paths to the input file(s)
+
+        Returns:
+            dict:
+                estimated genome size and coverage, formatted like the Mash based results
+
+        Raises:
+            ValueError: if there are not one or two input files
+        """
+        if len(input_files) == 1:
+            self.reset()
+            self.add_files(input_files)
+            return self.get_results()
+        if len(input_files) != 2:
+            raise ValueError("Input files list must contain either one or two files.")
+        mate_results = []
+        for input_file in input_files:
+            self.reset()
+            self.add_files([input_file])
+            mate_results.append(self.get_results())
+        self.results = {key: format(sum(float(results[key]) for results in mate_results) / 2, '.2f')
+                        for key in ("Genome Size", "Coverage")}
+        return self.results
+
+    def reset(self):
+        """Empties the sketch."""
+        self.hashes = np.zeros(0, dtype=np.uint64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.threshold = None
+
+    def add_files(self, input_files):
+        """
+        Streams the reads of more fastq files of the same read set into the sketch. Adding files one
+        at a time gives the same sketch as sketching them together, so a growing read set is never
+        read twice. Zero-length reads are skipped, as Mash does.
+
+        Arguments:
+            input_files: list
+                list containing paths to the input file(s)
+        """
+        with ExitStack() as stack:
+            handles = [stack.enter_context(open_file(input_file, "rb")) for input_file in input_files]
+            batch = []
+            batch_bases = 0
+            for _, seq, _ in chain.from_iterable(FastqPairedEndRenamer.parse_records(f, allow_empty=True) for f in handles):
+                if not seq:
+                    continue
+                batch.append(seq)
+                batch_bases += len(seq)
+                if batch_bases >= self.batch_bases:
+                    self.add_sequences(batch)
+                    batch = []
+                    batch_bases = 0
+            if batch:
+                self.add_sequences(batch)
+
+    def get_results(self):
+        """
+        Returns:
+            dict:
+                estimated genome size and coverage of the reads added so far, formatted like the Mash
+                based results
+        """
+        genome_size, coverage = self.estimate()
+        # Mash prints its estimates with six significant digits
+        self.results = {"Genome Size": format(float(f"{genome_size:.6g}"), '.2f'),
+                        "Coverage": format(float(f"{coverage:.6g}"), '.2f')}
+        return self.results
+
+    def kmer_hashes(self, sequences):
+        """
+        Hashes the canonical k-mers of a batch of sequences. Sequences are joined with an N so that
+        k-mers spanning two reads are skipped along with every k-mer containing a base other than ACGT.
+        The k-mers are read as 64 bit words straight from the uppercase sequence and its reverse
+        complement; comparing the byte-swapped words orders them like memcmp does.
+
+        Arguments:
+            sequences: list
+                sequences as bytes
+
+        Returns:
+            numpy.ndarray:
+                uint64 hash of each valid k-mer, in sequence order
+        """
+        k = self.kmer_size
+        seq = UPPER_TABLE[np.frombuffer(b"N".join(sequences), dtype=np.uint8)]
+        if len(seq) < k:
+            return np.zeros(0, dtype=np.uint64)
+        invalid = np.concatenate(([0], np.cumsum(~VALID_BASES[seq])))
+        valid = invalid[k:] == invalid[:-k]
+        windows = len(seq) - k + 1
+        forward = self.kmer_words(seq, windows)
+        reverse = [word[::-1] for word in self.kmer_words(COMPLEMENT_TABLE[seq][::-1], windows)]
+
+        # Canonical k-mer: the k-mer or its reverse complement, whichever comes first. All windows are
+        # hashed and the ones with invalid bases dropped afterwards, which is cheaper than selecting them.
+        use_reverse = np.zeros(windows, dtype=bool)
+        undecided = np.ones(windows, dtype=bool)
+        for forward_word, reverse_word in zip(forward, reverse):
+            forward_word = forward_word.byteswap()
+            reverse_word = reverse_word.byteswap()
+            use_reverse |= undecided & (reverse_word < forward_word)
+            undecided &= reverse_word == forward_word
+        words = [np.where(use_reverse, reverse_word, forward_word) for forward_word, reverse_word in zip(forward, reverse)]
+        words += [np.zeros(windows, dtype=np.uint64)] * ((k + 15) // 16 * 2 - len(words))
+        return murmur3_x64_64(words, k, self.seed)[valid]
+
+    def kmer_words(self, seq, windows):
+        """
+        Returns:
+            list:
+                uint64 arrays with the little-endian words of the k-mer starting at each of the first
+                windows positions of seq; bytes past the end of the k-mer are zero
+        """
+        k = self.kmer_size
+        padded = np.zeros((len(seq) + 15) // 8 * 8, dtype=np.uint8)
+        padded[:len(seq)] = seq
+        # A uint64 view starting at every byte of the sequence
+        word_at = np.lib.stride_tricks.as_strided(padded.view("<u8"), shape=(len(seq),), strides=(1,))
+        words = [word_at[offset:offset + windows] for offset in range(0, k, 8)]
+        if k % 8:
+            words[-1] = words[-1] & np.uint64((1 << (8 * (k % 8))) - 1)
+        return words
+
+    def add_sequences(self, sequences):
+        """
+        Adds the k-mers of a batch of sequences to the sketch. Like Mash with -m, only hashes up to the
+        largest hash of a full sketch are counted, and a hash enters the sketch once it has been seen
+        min_copies times; hashes above the threshold are dropped along with their counts. The largest
+        hash itself keeps being counted, so every hash of the final sketch has its exact count.
+
+        Arguments:
+            sequences: list
+                sequences as bytes
+        """
+        hashes = self.kmer_hashes(sequences)
+        if self.threshold is not None:
+            hashes = hashes[hashes <= self.threshold]
+        if len(hashes) == 0:
+            return
+        hashes, counts = np.unique(hashes, return_counts=True)
+        merged, inverse = np.unique(np.concatenate((self.hashes, hashes)), return_inverse=True)
+        merged_counts = np.zeros(len(merged), dtype=np.int64)
+        np.add.at(merged_counts, inverse, np.concatenate((self.counts, counts)))
+        qualified = np.flatnonzero(merged_counts >= self.min_copies)
+        if len(qualified) >= self.sketch_size:
+            self.threshold = merged[qualified[self.sketch_size - 1]]
+            keep = merged <= self.threshold
+            merged = merged[keep]
+            merged_counts = merged_counts[keep]
+        self.hashes = merged
+        self.counts = merged_counts
+
+    def estimate(self):
+        """
+        Returns:
+            tuple:
+                estimated genome size from the density of the sketch hashes, and estimated coverage as
+                the mean count of the sketch hashes
+        """
+        in_sketch = self.counts >= self.min_copies
+        if not in_sketch.any():
+            return 0.0, 0.0
+        sketch_hashes = self.hashes[in_sketch]
+        genome_size = 2.0 ** 64 * len(sketch_hashes) / float(sketch_hashes[-1])
+        coverage = self.counts[in_sketch].sum() / len(sketch_hashes)
+        return genome_size, coverage
@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 
 import os
+import subprocess
+import tempfile
+import pysam
 from sequenoscope.constant import DefaultValues
 from sequenoscope.utils.__init__ import run_command
+from sequenoscope.analyze.minimap2_index import Minimap2IndexCache
 
 
 class Minimap2Runner:
@@ -14,10 +18,12 @@ class Minimap2Runner:
     kmer_size = 15
     status = False
     error_messages = None
-    result_files =  {"sam_output_file":""}
+    result_files =  {"sam_output_file":"", "bam_output":"", "bam_index":""}
     paired = False
+    index_cache = None
 
-    def __init__(self, read_set, out_dir, ref_database, out_prefix, threads=1, kmer_size=DefaultValues.minimap2_kmer_size):
+    def __init__(self, read_set, out_dir, ref_database, out_prefix, threads=1, kmer_size=DefaultValues.minimap2_kmer_size,
+                 index_cache=None):
         """
         Initalize the class with read_set, out_dir, ref_database, and out_prefix
 
@@ -34,6 +40,8 @@ class Minimap2Runner:
                 an integer representing the number of threads utilized for the operation, default is 1
             kmersize: int
                 an integer representing the kmer size utilized for the kat filter method, default is 15
+            index_cache: str
+                (optional) a string to the path of a directory where the reference index is built once and reused
         """
         self.read_set = read_set
         self.out_dir = out_dir
@@ -42,6 +50,25 @@ class Minimap2Runner:
         self.threads = threads
         self.kmer_size = kmer_size
         self.paired = self.read_set.is_paired
+        self.index_cache = index_cache
+
+    def get_reference(self, preset):
+        """
+        Returns the reference passed to minimap2: the cached .mmi index of the reference when an
+        index cache is set, the reference sequence file otherwise.
+
+        Arguments:
+            preset: str
+                minimap2 preset of the run, e.g. map-ont or sr
+
+        Returns:
+            str:
+                path to the reference or its index
+        """
+        if self.index_cache is None:
+            return self.ref_database
+        index_run = Minimap2IndexCache(self.index_cache, self.ref_database, preset, self.kmer_size)
+        return index_run.get_index(self.threads)
 
     def run_minimap2(self):
         """
@@ -55,13 +82,9 @@ class Minimap2Runner:
         
         self.result_files["sam_output_file"] = sam_file
 
-        cmd = ["minimap2", "-ax", "-t", f"{self.threads}", "-k", f"{self.kmer_size}", self.ref_database, 
+        preset = "sr" if self.paired else "map-ont"
+        cmd = ["minimap2", "-ax", preset, "-t", f"{self.threads}", "-k", f"{self.kmer_size}", self.get_reference(preset),
         self.read_set.out_files, ">", sam_file]
-        
-        if self.paired:
-            cmd.insert(2, "sr")
-        else:
-            cmd.insert(2, "map-ont")
 
         cmd_string = " ".join(cmd)
 
@@ -71,6 +94,66 @@ class Minimap2Runner:
             self.error_messages = "one or more files was not created or was empty, check error message\n{}".format(self.stderr)
             raise ValueError(str(self.error_messages))
     
+    def run_minimap2_sorted_bam(self, sort_memory=DefaultValues.samtools_sort_memory):
+        """
+        Run minimap2 and stream its alignments straight into samtools sort, so no SAM file is written.
+        The threads are split between the two tools and the sorted bam file is indexed in-process with pysam.
+
+        Arguments:
+            sort_memory: str
+                maximum memory per samtools sort thread, e.g. 768M
+
+        Returns:
+            bool:
+                returns True if the generated output file is found and not empty, False otherwise
+        """
+        bam_file = os.path.join(self.out_dir,f"{self.out_prefix}.bam")
+        bam_index = f"{bam_file}.bai"
+        sort_tmp_prefix = os.path.join(self.out_dir,f"{self.out_prefix}.sort_tmp")
+
+        self.result_files["bam_output"] = bam_file
+        self.result_files["bam_index"] = bam_index
+
+        sort_threads = max(1, self.threads // DefaultValues.samtools_sort_thread_fraction)
+        minimap2_threads = max(1, self.threads - sort_threads)
+        preset = "sr" if self.paired else "map-ont"
+
+        minimap2_cmd = ["minimap2", "-ax", preset, "-t", f"{minimap2_threads}", "-k", f"{self.kmer_size}",
+                        self.get_reference(preset)] + list(self.read_set.files)
+        sort_cmd = ["samtools", "sort", "-@", f"{sort_threads}", "-m", sort_memory, "-T", sort_tmp_prefix, "-o", bam_file, "-"]
+
+        # The two tools are piped without a shell so both exit codes are checked: a minimap2 run dying
+        # mid-stream would otherwise leave a truncated but valid bam file behind.
+        with tempfile.TemporaryFile() as minimap2_log:
+            minimap2_process = subprocess.Popen(minimap2_cmd, stdout=subprocess.PIPE, stderr=minimap2_log)
+            sort_process = subprocess.Popen(sort_cmd, stdin=minimap2_process.stdout, stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE)
+            minimap2_process.stdout.close()
+            (sort_stdout, sort_stderr) = sort_process.communicate()
+            minimap2_process.wait()
+            minimap2_log.seek(0)
+            minimap2_stderr = minimap2_log.read()
+        self.stdout = sort_stdout.decode('utf-8')
+        self.stderr = minimap2_stderr.decode('utf-8') + sort_stderr.decode('utf-8')
+
+        for tool, process in (("minimap2", minimap2_process), ("samtools sort", sort_process)):
+            if process.returncode != 0:
+                if os.path.isfile(bam_file):
+                    os.remove(bam_file)
+                self.status = False
+                self.error_messages = "{} exited with status {}, check error message\n{}".format(tool, process.returncode, self.stderr)
+                raise ValueError(str(self.error_messages))
+
+        if self.check_files([bam_file]):
+            try:
+                pysam.index("-@", f"{self.threads}", bam_file, bam_index)
+            except pysam.SamtoolsError as error:
+                self.stderr = f"{self.stderr}\n{error}"
+        self.status = self.check_files([bam_file, bam_index])
+        if self.status == False:
+            self.error_messages = "one or more files was not created or was empty, check error message\n{}".format(self.stderr)
+            raise ValueError(str(self.error_messages))
+
     def check_files(self, files_to_check):
         """
         check if the output file exists and is not empty
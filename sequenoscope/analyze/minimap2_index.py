@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+import os
+import fcntl
+from sequenoscope.utils.__init__ import run_command, compute_sha256
+
+
+class Minimap2IndexCache:
+    cache_dir = None
+    ref_database = None
+    preset = None
+    kmer_size = 15
+    index_file = None
+    status = False
+    error_messages = None
+
+    def __init__(self, cache_dir, ref_database, preset, kmer_size):
+        """
+        Initalize the class with a cache directory and the reference the index is built from.
+        Indexes are named after the SHA256 of the reference, the preset and the kmer size.
+
+        Arguments:
+            cache_dir: str
+                a string to the path of the directory holding the minimap2 indexes
+            ref_database: str
+                a string to the path of reference sequence file
+            preset: str
+                minimap2 preset the index is built for, e.g. map-ont or sr
+            kmer_size: int
+                kmer size the index is built with
+        """
+        self.cache_dir = cache_dir
+        self.ref_database = ref_database
+        self.preset = preset
+        self.kmer_size = kmer_size
+        key = compute_sha256(ref_database)
+        self.index_file = os.path.join(cache_dir, f"{key}.{preset}.k{kmer_size}.mmi")
+
+    def get_index(self, threads=1):
+        """
+        Returns the cached index of the reference, building it first if it does not exist yet.
+        The build holds an exclusive lock on the index, so concurrent runs sharing the cache wait
+        for a single build instead of each building their own, and the index is written to a
+        temporary file and renamed into place so it is never read half-written.
+
+        Arguments:
+            threads: int
+                number of threads used to build the index
+
+        Returns:
+            str:
+                path to the .mmi index
+        """
+        if self.check_files([self.index_file]):
+            return self.index_file
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(f"{self.index_file}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if not self.check_files([self.index_file]):
+                    self.build_index(threads)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return self.index_file
+
+    def build_index(self, threads=1):
+        """
+        Builds the index with minimap2 -d
+        """
+        tmp_index = f"{self.index_file}.{os.getpid()}.tmp"
+        cmd = ["minimap2", "-x", self.preset, "-k", f"{self.kmer_size}", "-t", f"{threads}",
+               "-d", tmp_index, self.ref_database]
+        cmd_string = " ".join(cmd)
+
+        (self.stdout, self.stderr) = run_command(cmd_string)
+        self.status = self.check_files([tmp_index])
+        if self.status == False:
+            if os.path.isfile(tmp_index):
+                os.remove(tmp_index)
+            self.error_messages = "minimap2 index was not created or was empty, check error message\n{}".format(self.stderr)
+            raise ValueError(str(self.error_messages))
+        os.replace(tmp_index, self.index_file)
+
+    def check_files(self, files_to_check):
+        """
+        check if the output file exists and is not empty
+
+        Arguments:
+            files_to_check: list
+                list of file paths
+
+        Returns:
+            bool:
+                returns True if the generated output file is found and not empty, False otherwise
+        """
+        if isinstance (files_to_check, str):
+            files_to_check = [files_to_check]
+        for f in files_to_check:
+            if not os.path.isfile(f):
+                return False
+            elif os.path.getsize(f) == 0:
+                return False
+        return True
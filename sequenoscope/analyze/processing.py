@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 import os
+import pysam
 from sequenoscope.utils.__init__ import run_command
 
 
@@ -38,7 +39,8 @@ class SamBamProcessor:
 
     def run_samtools_bam(self):
         """
-        Run the samtools view command on the designated sam file and pipe the output to the samtools sort command for further processing.
+        Sort the designated sam file into a bam file in-process with pysam. samtools sort reads sam input directly,
+        so no separate samtools view step is needed.
 
         Arguments:
             exclude: bool
@@ -52,13 +54,10 @@ class SamBamProcessor:
         
         self.result_files["bam_output"] = bam_output
         
-        cmd = ["samtools", "view", "-S", "-b", self.file, "|",
-               "samtools", "sort", "-@", f"{self.threads}", "-T", self.out_prefix, "--reference", self.ref_database,
-               "-o", bam_output]
+        sort_tmp_prefix = os.path.join(self.out_dir, self.out_prefix)
 
-        cmd_string = " ".join(cmd)
-
-        (self.stdout, self.stderr) = run_command(cmd_string)
+        (self.stdout, self.stderr) = self.run_pysam(pysam.sort, "-@", f"{self.threads}", "-T", sort_tmp_prefix,
+                                                    "--reference", self.ref_database, "-o", bam_output, self.file)
         self.status = self.check_files([bam_output])
         if self.status == False:
             self.error_messages = "one or more files was not created or was empty, check error message\n{}".format(self.stderr)
@@ -66,7 +65,8 @@ class SamBamProcessor:
 
     def run_samtools_fastq(self):
         """
-        Run the samtools fastq command to convert the designated bam file to a fastq file
+        Convert the designated bam file to a fastq file in-process with pysam. All reads are written
+        to the one output file with the /1 and /2 suffixes of mates, as samtools fastq prints them.
 
         Returns:
             bool:
@@ -76,9 +76,7 @@ class SamBamProcessor:
 
         self.result_files["fastq_output"] = fastq_output
 
-        cmd = f"samtools fastq {self.file} > {fastq_output}"
-
-        (self.stdout, self.stderr) = run_command(cmd)
+        (self.stdout, self.stderr) = self.run_pysam(pysam.fastq, "-N", "-0", fastq_output, "-o", fastq_output, self.file)
         self.status = self.check_files([fastq_output])
         if self.status == False:
             self.error_messages = "one or more files was not created or was empty, check error message\n{}".format(self.stderr)
@@ -104,6 +102,26 @@ class SamBamProcessor:
             self.error_messages = "one or more files was not created or was empty, check error message\n{}".format(self.stderr)
             raise ValueError(str(self.error_messages))
 
+    def run_pysam(self, command, *args):
+        """
+        Run a samtools command through pysam without launching a process
+
+        Arguments:
+            command: pysam.utils.PysamDispatcher
+                the pysam samtools command, e.g. pysam.sort
+            args: str
+                the command line arguments of the command
+
+        Returns:
+            tuple:
+                stdout and stderr of the command; a failing command leaves its error message in stderr
+        """
+        try:
+            stdout = command(*args)
+        except pysam.SamtoolsError as error:
+            return ("", str(error))
+        return (stdout, command.stderr)
+
     def run_bedtools(self, nonzero=False):
         """
         Run the bedtools genomcov command on the designated bam file and return a tsv of the depth per base
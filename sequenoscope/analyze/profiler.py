@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+import sys
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+from sequenoscope.version import __version__
+
+# Thread-level usage separates the Python work of stages running side by side; fall back to the
+# whole process where the platform does not report it.
+RUSAGE_STAGE = getattr(resource, "RUSAGE_THREAD", resource.RUSAGE_SELF)
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+MAXRSS_TO_MB = 1 / (1024 * 1024) if sys.platform == "darwin" else 1 / 1024
+
+
+class StageProfiler:
+    stages = {}
+    start_time = None
+
+    def __init__(self):
+        """
+        Initalize the class and start the clock of the whole run
+        """
+        self.stages = {}
+        self.start_time = time.time()
+        self._start_perf = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def profile(self, name):
+        """
+        Measures the wall time, CPU time and peak memory of a block of work.
+
+        CPU time is split into the calling thread (the Python side of the stage) and the child
+        processes reaped while the block ran (the external tools and worker processes). Child
+        usage is process-wide, so when stages overlap it is counted for each stage whose window
+        the child finished in. Peak RSS values are high-water marks at the end of the block.
+
+        Arguments:
+            name: str
+                name of the stage
+        """
+        start = time.time()
+        start_perf = time.perf_counter()
+        stage_start = resource.getrusage(RUSAGE_STAGE)
+        children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_perf
+            stage_end = resource.getrusage(RUSAGE_STAGE)
+            children_end = resource.getrusage(resource.RUSAGE_CHILDREN)
+            process_end = resource.getrusage(resource.RUSAGE_SELF)
+            entry = {
+                'start': start,
+                'end': start + wall,
+                'wall_seconds': round(wall, 3),
+                'user_cpu_seconds': round(stage_end.ru_utime - stage_start.ru_utime, 3),
+                'system_cpu_seconds': round(stage_end.ru_stime - stage_start.ru_stime, 3),
+                'children_user_cpu_seconds': round(children_end.ru_utime - children_start.ru_utime, 3),
+                'children_system_cpu_seconds': round(children_end.ru_stime - children_start.ru_stime, 3),
+                'peak_rss_mb': round(process_end.ru_maxrss * MAXRSS_TO_MB, 1),
+                'children_peak_rss_mb': round(children_end.ru_maxrss * MAXRSS_TO_MB, 1),
+            }
+            with self._lock:
+                self.stages[name] = entry
+
+    def report(self):
+        """
+        Returns:
+            dict:
+                profile of every measured stage and of the whole run
+        """
+        process = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return {
+            'version': __version__,
+            'start': self.start_time,
+            'wall_seconds': round(time.perf_counter() - self._start_perf, 3),
+            'user_cpu_seconds': round(process.ru_utime, 3),
+            'system_cpu_seconds': round(process.ru_stime, 3),
+            'children_user_cpu_seconds': round(children.ru_utime, 3),
+            'children_system_cpu_seconds': round(children.ru_stime, 3),
+            'peak_rss_mb': round(process.ru_maxrss * MAXRSS_TO_MB, 1),
+            'children_peak_rss_mb': round(children.ru_maxrss * MAXRSS_TO_MB, 1),
+            'stages': dict(sorted(self.stages.items(), key=lambda item: item[1]['start'])),
+        }
+
+    def write(self, out_file):
+        """
+        Writes the profile as json
+
+        Arguments:
+            out_file: str
+                path to the profile file
+        """
+        with open(out_file, 'w') as f:
+            json.dump(self.report(), f, indent=2)
@@ -1,4 +1,17 @@
 #!/usr/bin/env python
+import os
+import sys
+import gzip
+import json
+import time
+import random
+import shutil
+import subprocess
+import threading
+from collections import Counter
+import pytest
+import numpy as np
+import pysam
 from sequenoscope.utils.sequence_class import Sequence
 from sequenoscope.utils.parser import GeneralSeqParser
 from sequenoscope.analyze.kat import KatRunner
@@ -10,7 +23,22 @@ from sequenoscope.analyze.seq_manifest import SeqManifest
 from sequenoscope.analyze.fastq_extractor import FastqExtractor
 from sequenoscope.utils.parser import FastqPairedEndRenamer
 from sequenoscope.analyze.seq_manifest import SeqManifestSummary
-from sequenoscope.analyze.mash import MashSketcher
+from sequenoscope.analyze.live_bam import IncrementalBamProcessor
+from sequenoscope.analyze.profiler import StageProfiler
+from sequenoscope.version import __version__
+from sequenoscope.analyze.minimap2_index import Minimap2IndexCache
+from sequenoscope.analyze.fastq_scanner import FastqScanner
+from sequenoscope.utils.parser import fastq_parser
+from sequenoscope.utils.qscore import mean_qscore_phred33
+from sequenoscope.analyze.manifest_writer import open_manifest_writer, manifest_file_name
+from sequenoscope.plot.manifest_reader import read_manifest
+from sequenoscope.analyze.coverage import RunLengthCoverage
+from sequenoscope.analyze.coverage_cache import CoverageCache
+from sequenoscope.analyze.checkpoint import StageCheckpoint
+from sequenoscope.analyze.scheduler import StageScheduler
+from sequenoscope.analyze.minhash import MinHashSketcher, murmur3_x64_64
+from sequenoscope.analyze.read_sampler import ReadSampler
+from sequenoscope.analyze.mappy_aligner import MappyAligner
 
 path_ref_file = "/home/ameknas/sequenoscope-1/sequenoscope/analyze/test_sequences/lambda_genome_reference.fasta"
 path_enriched_test_file = "/home/ameknas/sequenoscope-1/sequenoscope/analyze/test_sequences/Test_br1_sal_lam_enriched.fastq"
@@ -187,11 +215,756 @@ def test_make_test():
 #     pass
     
 
-def test_mash_sketcher(): 
-    mash_sketcher = MashSketcher("/home/ameknas/sequenoscope/sequenoscope", "test")
-    results_single = mash_sketcher.run_mash_sketch(["/home/ameknas/sequenoscope-1/Sequenoscope/test_sequences/barcode01_fastq_pass_enriched.fastq"])
-    print(f"Results for paired-end: {results_single}")
+test_header = {'HD': {'VN': '1.6', 'SO': 'unsorted'}, 'SQ': [{'SN': 'contig1', 'LN': 300}, {'SN': 'contig2', 'LN': 150}]}
 
-#     # Example usage for paired-end sequencing
-#     results_paired = mash_sketcher.run_mash_sketch(["/home/ameknas/sequenoscope-1/Sequenoscope/test_sequences/ERR2984773_1.fastq", "/home/ameknas/sequenoscope-1/Sequenoscope/test_sequences/ERR2984773_2.fastq"])
-#     print(f"Results for paired-end: {results_paired}")
\ No newline at end of file
+def write_test_bam(path, alignments):
+    """Writes (read_id, contig or None for unmapped, start, length) alignments to an unsorted bam file."""
+    with pysam.AlignmentFile(path, "wb", header=test_header) as fout:
+        for read_id, contig_id, start, length in alignments:
+            read = pysam.AlignedSegment(fout.header)
+            read.query_name = read_id
+            read.query_sequence = "A" * length
+            read.query_qualities = pysam.qualitystring_to_array(chr(43 + len(read_id) % 20) * length)
+            if contig_id is None:
+                read.flag = 4
+            else:
+                read.reference_name = contig_id
+                read.reference_start = start
+                read.cigartuples = [(0, length)]
+                read.mapping_quality = 60
+            fout.write(read)
+
+def random_alignments(n_reads, seed=7):
+    rng = random.Random(seed)
+    alignments = [(f"read{i}", rng.choice(["contig1", "contig2", None]), rng.randrange(0, 120), rng.randrange(20, 60))
+                  for i in range(n_reads)]
+    # a read mapped to both contigs
+    alignments.insert(1, ("read0", "contig2" if alignments[0][1] != "contig2" else "contig1", 10, alignments[0][3]))
+    return alignments
+
+def test_incremental_bam_matches_bam_processor(tmp_path):
+    alignments = random_alignments(60)
+    write_test_bam(str(tmp_path / "chunk1.bam"), alignments[:31])
+    write_test_bam(str(tmp_path / "chunk2.bam"), alignments[31:])
+    write_test_bam(str(tmp_path / "all.bam"), alignments)
+    pysam.sort("-o", str(tmp_path / "sorted.bam"), str(tmp_path / "all.bam"))
+    pysam.index(str(tmp_path / "sorted.bam"))
+
+    full = BamProcessor(str(tmp_path / "sorted.bam"), 1)
+    live = IncrementalBamProcessor(1)
+    live.add_bam(str(tmp_path / "chunk1.bam"))
+    live.add_bam(str(tmp_path / "chunk2.bam"))
+    live.finalize()
+
+    assert live.chunks == 2
+    assert list(live.ref_stats) == list(full.ref_stats)
+    for contig_id, stats in full.ref_stats.items():
+        for key, value in stats.items():
+            if key == 'depth_hist':
+                continue
+            assert live.ref_stats[contig_id][key] == pytest.approx(value), (contig_id, key)
+        if contig_id != '*':
+            assert np.array_equal(np.asarray(live.ref_coverage[contig_id]), np.asarray(full.ref_coverage[contig_id]))
+            for min_value in (0, 1, 2, 5):
+                assert live.get_covered_bases(contig_id, min_value) == full.get_covered_bases(contig_id, min_value)
+    assert live.read_locations == full.read_locations
+
+def random_sequence(rng, length):
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+def reverse_complement(seq):
+    return seq.translate(str.maketrans("ACGT", "TGCA"))[::-1]
+
+def write_test_fastq(path, reads):
+    """Writes (read_id, sequence) reads with a constant quality of 20."""
+    with open(path, 'w') as fout:
+        for read_id, seq in reads:
+            fout.write(f"@{read_id}\n{seq}\n+\n{'5' * len(seq)}\n")
+
+def test_mappy_aligner_matches_written_bam(tmp_path):
+    pytest.importorskip("mappy")
+    rng = random.Random(11)
+    contigs = {"contig1": random_sequence(rng, 3000), "contig2": random_sequence(rng, 2000)}
+    with open(tmp_path / "ref.fasta", 'w') as fout:
+        for contig_id, seq in contigs.items():
+            fout.write(f">{contig_id}\n{seq}\n")
+    reads = []
+    for i in range(40):
+        contig_id = "contig1" if i % 2 == 0 else "contig2"
+        start = rng.randrange(0, len(contigs[contig_id]) - 500)
+        seq = contigs[contig_id][start:start + 500]
+        reads.append((f"{contig_id}_read{i}", seq if i % 4 < 2 else reverse_complement(seq)))
+    reads.append(("unmapped_read", random_sequence(rng, 500)))
+    write_test_fastq(str(tmp_path / "reads.fastq"), reads)
+
+    bam_obj = IncrementalBamProcessor(1)
+    mappy_run = MappyAligner(Sequence("ONT", [str(tmp_path / "reads.fastq")]), str(tmp_path / "ref.fasta"), bam_obj,
+                             out_dir=str(tmp_path), out_prefix="mapped", threads=2, write_bam=True, batch_size=8)
+    mappy_run.align()
+    bam_obj.finalize()
+    assert mappy_run.status == True
+
+    for read_id, _ in reads[:-1]:
+        assert bam_obj.read_locations[read_id][0] == [read_id.split("_")[0]]
+    assert list(bam_obj.ref_stats['*']['reads']) == ["unmapped_read"]
+
+    from_bam = IncrementalBamProcessor(1)
+    from_bam.add_bam(mappy_run.result_files["bam_output"])
+    from_bam.finalize()
+    for contig_id in contigs:
+        assert bam_obj.ref_stats[contig_id]['num_reads'] == from_bam.ref_stats[contig_id]['num_reads'] == 20
+        assert bam_obj.ref_stats[contig_id]['mean_qual'] == pytest.approx(20)
+        assert np.array_equal(np.asarray(bam_obj.ref_coverage[contig_id]), np.asarray(from_bam.ref_coverage[contig_id]))
+
+def read_fastq_ids(path):
+    with open(path) as f:
+        return [line[1:].split()[0] for i, line in enumerate(f) if i % 4 == 0]
+
+def test_read_sampler_is_reproducible(tmp_path):
+    rng = random.Random(3)
+    reads = [(f"read{i}", random_sequence(rng, rng.randrange(50, 150))) for i in range(200)]
+    write_test_fastq(str(tmp_path / "reads.fastq"), reads)
+    samples = []
+    for run in range(2):
+        sampler = ReadSampler(Sequence("ONT", [str(tmp_path / "reads.fastq")]), f"sample{run}", str(tmp_path), max_reads=50)
+        sampler.sample()
+        samples.append(read_fastq_ids(sampler.result_files["fastq_files"][0]))
+    assert samples[0] == samples[1]
+    assert len(samples[0]) == 50
+    # reads are written in their input order
+    assert samples[0] == [read_id for read_id, _ in reads if read_id in set(samples[0])]
+    assert sampler.total_reads == 200
+
+def test_read_sampler_keeps_mates_together(tmp_path):
+    rng = random.Random(5)
+    reads = [(f"read{i}", random_sequence(rng, 100)) for i in range(100)]
+    write_test_fastq(str(tmp_path / "reads_1.fastq"), reads)
+    write_test_fastq(str(tmp_path / "reads_2.fastq"), [(read_id, reverse_complement(seq)) for read_id, seq in reads])
+    sampler = ReadSampler(Sequence("Illumina", [str(tmp_path / "reads_1.fastq"), str(tmp_path / "reads_2.fastq")]),
+                          "sample", str(tmp_path), max_bases=5000)
+    sampler.sample()
+    mate1, mate2 = [read_fastq_ids(fastq_file) for fastq_file in sampler.result_files["fastq_files"]]
+    assert mate1 == mate2
+    assert len(mate1) == 25
+    assert sampler.sampled_bases == 5000
+    assert sampler.sampling_fraction() == pytest.approx(0.25)
+
+def test_read_sampler_budget_below_one_read(tmp_path):
+    write_test_fastq(str(tmp_path / "reads.fastq"), [("read1", "ACGT" * 50)])
+    sampler = ReadSampler(Sequence("ONT", [str(tmp_path / "reads.fastq")]), "sample", str(tmp_path), max_bases=100)
+    with pytest.raises(ValueError):
+        sampler.sample()
+
+def test_read_sampler_keeps_headers_and_empty_reads(tmp_path):
+    fastq_file = tmp_path / "reads.fastq"
+    fastq_file.write_text("@read1 runid=abc ch=7\nACGT\n+\nIIII\n"
+                          "@read2 runid=abc ch=9\n\n+\n\n"
+                          "@read3\nGGCC\n+\n!!!!\n")
+    sampler = ReadSampler(Sequence("ONT", [str(fastq_file)]), "sample", str(tmp_path))
+    sampler.sample()
+    with open(sampler.result_files["fastq_files"][0]) as f:
+        assert f.read() == fastq_file.read_text()
+    assert sampler.total_reads == 3
+    assert sampler.sampling_fraction() == 1.0
+
+    # the sample depends on the read ids only
+    plain_file = tmp_path / "plain.fastq"
+    plain_file.write_text("@read1\nACGT\n+\nIIII\n@read2\n\n+\n\n@read3\nGGCC\n+\n!!!!\n")
+    samples = []
+    for fastq_path in [fastq_file, plain_file]:
+        sampler = ReadSampler(Sequence("ONT", [str(fastq_path)]), f"{fastq_path.stem}_sample", str(tmp_path), max_reads=2)
+        sampler.sample()
+        samples.append(read_fastq_ids(sampler.result_files["fastq_files"][0]))
+    assert samples[0] == samples[1]
+
+# MurmurHash3_x64_128 (first 64 bits) of each key with seed 42, as computed by the reference implementation
+murmur3_vectors = [(b"ACGTACGTACGTACGTACGTA", 0xb4e9c495b633d387),
+                   (b"GATTACAGATTACAGATTACA", 0xc7a819a7ba2c5e27),
+                   (b"ACGT" * 8, 0x23f216a63a429be7),
+                   (b"A" * 21, 0xfbf127446a821b6f),
+                   (b"T" * 9, 0xfaeb32138625bdab)]
+
+def test_murmur3_matches_reference():
+    for key, expected in murmur3_vectors:
+        padded = key + b"\0" * (-len(key) % 16)
+        words = [np.array([word], dtype=np.uint64) for word in np.frombuffer(padded, dtype="<u8")]
+        assert int(murmur3_x64_64(words, len(key), 42)[0]) == expected, key
+
+def test_kmer_hashes_are_canonical(tmp_path):
+    sketcher = MinHashSketcher(str(tmp_path), "test", kmer_size=21)
+    assert sketcher.kmer_hashes([b"ACGTACGTACGTACGTACGTA"]).tolist() == [0xb4e9c495b633d387]
+    # lowercase bases and the reverse complement give the same k-mer
+    assert sketcher.kmer_hashes([b"acgtacgtacgtacgtacgta", b"T" * 21]).tolist() == [0xb4e9c495b633d387, 0xfbf127446a821b6f]
+    # k-mers with other bases or spanning two sequences are skipped
+    assert len(sketcher.kmer_hashes([b"A" * 10 + b"N" + b"A" * 10])) == 0
+    assert len(sketcher.kmer_hashes([b"A" * 20, b"A" * 20])) == 0
+    assert len(sketcher.kmer_hashes([b"A" * 22])) == 2
+
+def test_minhash_batches_match_exact_counts(tmp_path):
+    rng = random.Random(13)
+    genome = random_sequence(rng, 5000)
+    reads = []
+    for i in range(400):
+        start = rng.randrange(0, len(genome) - 250)
+        reads.append((f"read{i}", genome[start:start + 250]))
+    write_test_fastq(str(tmp_path / "reads.fastq"), reads)
+
+    sketcher = MinHashSketcher(str(tmp_path), "test", kmer_size=21, sketch_size=50, min_copies=3, batch_bases=1000)
+    results = sketcher.run_sketch([str(tmp_path / "reads.fastq")])
+
+    counts = Counter(sketcher.kmer_hashes([seq.encode() for _, seq in reads]).tolist())
+    sketch = sorted(h for h, n in counts.items() if n >= 3)[:50]
+    in_sketch = sketcher.counts >= 3
+    assert sketcher.hashes[in_sketch].tolist() == sketch
+    assert sketcher.counts[in_sketch].tolist() == [counts[h] for h in sketch]
+    assert len(genome) / 2 < float(results["Genome Size"]) < len(genome) * 2
+
+    # adding the reads file by file gives the same sketch
+    write_test_fastq(str(tmp_path / "reads_a.fastq"), reads[:150])
+    write_test_fastq(str(tmp_path / "reads_b.fastq"), reads[150:])
+    live = MinHashSketcher(str(tmp_path), "test", kmer_size=21, sketch_size=50, min_copies=3, batch_bases=1000)
+    live.add_files([str(tmp_path / "reads_a.fastq")])
+    live.add_files([str(tmp_path / "reads_b.fastq")])
+    assert live.get_results() == results
+
+def test_minhash_averages_mates(tmp_path):
+    rng = random.Random(17)
+    genome = random_sequence(rng, 5000)
+    reads = []
+    for i in range(200):
+        start = rng.randrange(0, len(genome) - 250)
+        reads.append((f"read{i}", genome[start:start + 250]))
+    write_test_fastq(str(tmp_path / "reads_1.fastq"), reads)
+    write_test_fastq(str(tmp_path / "reads_2.fastq"), [(read_id, reverse_complement(seq)) for read_id, seq in reads])
+    with open(tmp_path / "reads_2.fastq", 'a') as fout:
+        fout.write("@empty_read\n\n+\n\n")
+
+    mate1 = MinHashSketcher(str(tmp_path), "test", kmer_size=21).run_sketch([str(tmp_path / "reads_1.fastq")])
+    paired = MinHashSketcher(str(tmp_path), "test", kmer_size=21).run_sketch([str(tmp_path / "reads_1.fastq"), str(tmp_path / "reads_2.fastq")])
+    # the mates hold the same canonical k-mers, so their average is the estimate of one mate
+    assert paired == mate1
+    with pytest.raises(ValueError):
+        MinHashSketcher(str(tmp_path), "test").run_sketch([])
+
+def test_scheduler_runs_stages_after_dependencies():
+    scheduler = StageScheduler(threads=4)
+    order = []
+    lock = threading.Lock()
+
+    def stage(name, value):
+        def run():
+            time.sleep(0.01)
+            with lock:
+                order.append(name)
+            return value
+        return run
+
+    scheduler.add_stage("reads", stage("reads", 1))
+    scheduler.add_stage("filter", stage("filter", 2), depends_on=["reads"], threads=2)
+    scheduler.add_stage("scan", stage("scan", 3), depends_on=["reads"])
+    scheduler.add_stage("report", lambda: scheduler.results["filter"] + scheduler.results["scan"], depends_on=["filter", "scan"])
+    results = scheduler.run()
+    assert results == {"reads": 1, "filter": 2, "scan": 3, "report": 5}
+    assert order[0] == "reads"
+    assert set(scheduler.timings) == set(results)
+
+def test_scheduler_keeps_thread_budget():
+    scheduler = StageScheduler(threads=3)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def stage(threads):
+        def run():
+            with lock:
+                running.append(threads)
+                peak.append(sum(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(threads)
+        return run
+
+    for i, threads in enumerate([2, 2, 1, 3, 5]):
+        scheduler.add_stage(f"stage{i}", stage(min(threads, 3)), threads=threads)
+    scheduler.run()
+    assert max(peak) <= 3
+
+def test_scheduler_raises_stage_errors():
+    scheduler = StageScheduler(threads=2)
+    scheduler.add_stage("ok", lambda: 1)
+    scheduler.add_stage("broken", lambda: 1 / 0)
+    scheduler.add_stage("after", lambda: 2, depends_on=["broken"])
+    with pytest.raises(ZeroDivisionError):
+        scheduler.run()
+    assert "after" not in scheduler.results
+
+    with pytest.raises(ValueError):
+        scheduler.add_stage("ok", lambda: 1)
+    with pytest.raises(ValueError):
+        scheduler.add_stage("orphan", lambda: 1, depends_on=["missing"])
+
+def test_checkpoint_records_completed_stages(tmp_path):
+    input_file = tmp_path / "reads.fastq"
+    output_file = tmp_path / "filtered.fastq"
+    input_file.write_text("@read1\nACGT\n+\nIIII\n")
+    output_file.write_text("@read1\nACGT\n+\nIIII\n")
+
+    checkpoint = StageCheckpoint(str(tmp_path))
+    checkpoint.tool_versions["fastp"] = "fastp 0.23.4"
+    fingerprint = checkpoint.fingerprint([str(input_file)], {"min_len": 100}, tools=["fastp"])
+    assert not checkpoint.is_complete("fastp", fingerprint)
+    checkpoint.record("fastp", fingerprint, {"files": [str(output_file)]}, [str(output_file)])
+
+    # a later run in the same directory picks the stage up again
+    resumed = StageCheckpoint(str(tmp_path))
+    resumed.tool_versions["fastp"] = "fastp 0.23.4"
+    assert resumed.fingerprint([str(input_file)], {"min_len": 100}, tools=["fastp"]) == fingerprint
+    assert resumed.is_complete("fastp", fingerprint)
+    assert resumed.get_result("fastp") == {"files": [str(output_file)]}
+
+    os.remove(output_file)
+    assert not resumed.is_complete("fastp", fingerprint)
+
+def test_checkpoint_fingerprint_changes(tmp_path):
+    input_file = tmp_path / "reads.fastq"
+    input_file.write_text("@read1\nACGT\n+\nIIII\n")
+    checkpoint = StageCheckpoint(str(tmp_path), use_checksum=True)
+    checkpoint.tool_versions["fastp"] = "fastp 0.23.4"
+    fingerprint = checkpoint.fingerprint([str(input_file)], {"min_len": 100}, tools=["fastp"])
+
+    assert checkpoint.fingerprint([str(input_file)], {"min_len": 200}, tools=["fastp"]) != fingerprint
+    assert checkpoint.fingerprint([str(input_file)], {"min_len": 100}) != fingerprint
+    other = StageCheckpoint(str(tmp_path), use_checksum=True)
+    other.tool_versions["fastp"] = "fastp 0.24.0"
+    assert other.fingerprint([str(input_file)], {"min_len": 100}, tools=["fastp"]) != fingerprint
+    input_file.write_text("@read1\nACGA\n+\nIIII\n")
+    assert checkpoint.fingerprint([str(input_file)], {"min_len": 100}, tools=["fastp"]) != fingerprint
+
+def dense_coverage(coverage):
+    return coverage.to_dense() if isinstance(coverage, RunLengthCoverage) else np.asarray(coverage)
+
+def write_sorted_test_bam(path, alignments):
+    unsorted_file = f"{path}.unsorted.bam"
+    write_test_bam(unsorted_file, alignments)
+    pysam.sort("-o", path, unsorted_file)
+    pysam.index(path)
+    os.remove(unsorted_file)
+
+@pytest.mark.parametrize("sparse_coverage", [False, True])
+def test_coverage_cache_roundtrip(tmp_path, sparse_coverage):
+    bam_file = str(tmp_path / "sorted.bam")
+    write_sorted_test_bam(bam_file, random_alignments(60))
+    cache_dir = str(tmp_path / "cache")
+    computed = BamProcessor(bam_file, 1, sparse_coverage=sparse_coverage, cache_dir=cache_dir)
+    assert CoverageCache(cache_dir, bam_file).exists()
+    cached = BamProcessor(bam_file, 1, sparse_coverage=sparse_coverage, cache_dir=cache_dir)
+
+    assert list(cached.ref_stats) == list(computed.ref_stats)
+    for contig_id, stats in computed.ref_stats.items():
+        for key, value in stats.items():
+            if key == 'depth_hist':
+                assert np.array_equal(cached.ref_stats[contig_id][key], value) if value is not None else cached.ref_stats[contig_id][key] is None
+            else:
+                assert cached.ref_stats[contig_id][key] == pytest.approx(value), (contig_id, key)
+        if contig_id != '*':
+            assert np.array_equal(dense_coverage(cached.ref_coverage[contig_id]), dense_coverage(computed.ref_coverage[contig_id]))
+            assert cached.get_covered_bases(contig_id, 2) == computed.get_covered_bases(contig_id, 2)
+    assert cached.read_locations == computed.read_locations
+
+def test_bam_processor_threads_match_serial(tmp_path):
+    bam_file = str(tmp_path / "sorted.bam")
+    write_sorted_test_bam(bam_file, random_alignments(80))
+    serial = BamProcessor(bam_file, 1)
+    parallel = BamProcessor(bam_file, 1, threads=3, shard_size=40)
+    assert len(parallel.plan_regions()) > len(serial.plan_regions())
+
+    assert list(parallel.ref_stats) == list(serial.ref_stats)
+    for contig_id, stats in serial.ref_stats.items():
+        for key, value in stats.items():
+            if key == 'depth_hist':
+                assert np.array_equal(parallel.ref_stats[contig_id][key], value) if value is not None else parallel.ref_stats[contig_id][key] is None
+            else:
+                assert parallel.ref_stats[contig_id][key] == value, (contig_id, key)
+    assert list(parallel.ref_coverage) == list(serial.ref_coverage)
+    for contig_id, coverage in serial.ref_coverage.items():
+        assert np.array_equal(parallel.ref_coverage[contig_id], coverage)
+    assert parallel.read_locations == serial.read_locations
+
+def test_coverage_cache_alignment_key(tmp_path):
+    reads_file = tmp_path / "reads.fastq"
+    reads_file.write_text("@read1\nACGT\n+\nIIII\n")
+    (tmp_path / "run2").mkdir()
+    shutil.copy(reads_file, tmp_path / "run2" / "reads.fastq")
+    params = {"min_len": 100, "preset": "map-ont"}
+    key = CoverageCache.alignment_key([str(reads_file)], params)
+    assert CoverageCache.alignment_key([str(reads_file)], dict(params)) == key
+    assert CoverageCache.alignment_key([str(reads_file)], {"min_len": 200, "preset": "map-ont"}) != key
+    assert CoverageCache.alignment_key([str(tmp_path / "run2" / "reads.fastq")], params) != key
+    os.utime(reads_file, ns=(0, 0))
+    assert CoverageCache.alignment_key([str(reads_file)], params) != key
+
+    # with checksums only the contents count
+    key = CoverageCache.alignment_key([str(reads_file)], params, use_checksum=True)
+    assert CoverageCache.alignment_key([str(tmp_path / "run2" / "reads.fastq")], params, use_checksum=True) == key
+
+    # a rebuilt bam file differs in its header but reuses the entry stored under the alignment key
+    alignments = random_alignments(30)
+    write_sorted_test_bam(str(tmp_path / "run1.bam"), alignments)
+    test_header['PG'] = [{'ID': 'minimap2', 'PN': 'minimap2', 'CL': 'minimap2 -ax map-ont run2'}]
+    try:
+        write_sorted_test_bam(str(tmp_path / "run2.bam"), alignments)
+    finally:
+        del test_header['PG']
+    cache_dir = str(tmp_path / "cache")
+    first = BamProcessor(str(tmp_path / "run1.bam"), 1, cache_dir=cache_dir, cache_key=key)
+    second = BamProcessor(str(tmp_path / "run2.bam"), 1, cache_dir=cache_dir, cache_key=key)
+    assert os.listdir(cache_dir) == [key]
+    assert second.read_locations == first.read_locations
+    BamProcessor(str(tmp_path / "run2.bam"), 1, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 2
+
+def manifest_test_rows():
+    rows = []
+    for i in range(5):
+        row = {field: '' for field in SeqManifest.fields}
+        row.update({'sample_id': 'sample', 'read_id': f"read{i}", 'read_len': 100 + i, 'read_qscore': 12.5,
+                    'fastp_status': i % 2 == 0, 'is_mapped': i < 3, 'is_uniq': True,
+                    'contig_id': 'contig1' if i < 3 else '*'})
+        if i < 4:
+            row['start_time'] = float(i)
+        rows.append(row)
+    return rows
+
+def test_manifest_file_name(tmp_path):
+    assert manifest_file_name(str(tmp_path), "sample_manifest") == str(tmp_path / "sample_manifest.txt")
+    assert manifest_file_name(str(tmp_path), "sample_manifest", "parquet") == str(tmp_path / "sample_manifest.parquet")
+    with pytest.raises(ValueError):
+        manifest_file_name(str(tmp_path), "sample_manifest", "csv")
+
+@pytest.mark.parametrize("manifest_format", ["tsv", "parquet", "feather"])
+def test_manifest_writer_roundtrip(tmp_path, manifest_format):
+    if manifest_format != "tsv":
+        pytest.importorskip("pyarrow")
+    rows = manifest_test_rows()
+    with open_manifest_writer(str(tmp_path), "sample_manifest", SeqManifest.fields, manifest_format, batch_size=2) as fout:
+        out_file = fout.out_file
+        for row in rows[:3]:
+            fout.write_row(row)
+        fout.write_columns({field: [row[field] for row in rows[3:]] for field in SeqManifest.fields})
+
+    df = read_manifest(out_file)
+    assert list(df.columns) == SeqManifest.fields
+    assert df['read_id'].tolist() == [row['read_id'] for row in rows]
+    assert df['read_len'].tolist() == [row['read_len'] for row in rows]
+    assert df['contig_id'].tolist() == ['contig1', 'contig1', 'contig1', '*', '*']
+    assert df['is_mapped'].astype(str).tolist() == ['True', 'True', 'True', 'False', 'False']
+    assert df['start_time'].tolist()[:4] == [0.0, 1.0, 2.0, 3.0]
+    assert df['start_time'].isna().tolist()[4]
+
+def test_seq_manifest_reads_gzip_read_list(tmp_path):
+    alignments = random_alignments(20)
+    write_sorted_test_bam(str(tmp_path / "reads.bam"), alignments)
+    rng = random.Random(11)
+    reads = [(f"read{i}", random_sequence(rng, 50)) for i in range(20)]
+    write_test_fastq(str(tmp_path / "reads.fastq"), reads)
+    with open(tmp_path / "sequencing_summary.txt", "w") as f:
+        f.write("read_id\tchannel\tstart_time\tduration\tsequence_length_template\tmean_qscore_template\tend_reason\n")
+        for i, (read_id, seq) in enumerate(reads):
+            f.write(f"{read_id}\t1\t{i}.0\t1.0\t{len(seq)}\t12.0\tsignal_positive\n")
+
+    manifests = []
+    for compress in [False, True]:
+        extractor = FastqExtractor(Sequence("ONT", [str(tmp_path / "reads.fastq")]), f"read_list_{compress}",
+                                   str(tmp_path), compress=compress)
+        extractor.extract_single_reads()
+        assert extractor.result_files["read_list_file"].endswith(".gz") == compress
+        manifest = SeqManifest("sample", str(tmp_path / "reads.bam"), f"manifest_{compress}", str(tmp_path), 1,
+                               read_list=extractor.result_files["read_list_file"],
+                               in_seq_summary=str(tmp_path / "sequencing_summary.txt"))
+        manifests.append(read_manifest(manifest.manifest_file))
+    assert len(manifests[1]) == len(manifests[0]) > 0
+    assert manifests[1].equals(manifests[0])
+
+manifest_test_data = os.path.join(os.path.dirname(__file__), "test_data", "manifest")
+
+def test_manifest_with_summary_matches_expected(tmp_path):
+    # expected_manifest.txt was written by the row-by-row implementation; the summary has short rows,
+    # empty start_time and duration fields, a read on two contigs and reads missing from the bam file
+    pysam.sort("-o", str(tmp_path / "alignments.bam"), os.path.join(manifest_test_data, "alignments.sam"))
+    pysam.index(str(tmp_path / "alignments.bam"))
+    manifest = SeqManifest("sample", str(tmp_path / "alignments.bam"), "manifest", str(tmp_path), 1,
+                           fastp_fastq=[os.path.join(manifest_test_data, "fastp_reads.fastq")],
+                           in_seq_summary=os.path.join(manifest_test_data, "sequencing_summary.txt"),
+                           read_list=os.path.join(manifest_test_data, "read_list.txt"))
+    with open(os.path.join(manifest_test_data, "expected_manifest.txt")) as f:
+        expected = f.read()
+    with open(manifest.manifest_file) as f:
+        assert f.read() == expected
+
+    manifest.create_manifest_with_sum(chunk_size=3)
+    with open(manifest.manifest_file) as f:
+        assert f.read() == expected
+
+def test_mappy_aligner_paired_mate_fields(tmp_path):
+    pytest.importorskip("mappy")
+    rng = random.Random(13)
+    contigs = {"contig1": random_sequence(rng, 3000), "contig2": random_sequence(rng, 2000)}
+    with open(tmp_path / "ref.fasta", 'w') as fout:
+        for contig_id, seq in contigs.items():
+            fout.write(f">{contig_id}\n{seq}\n")
+    mates = ([], [])
+    for i in range(30):
+        contig_id = "contig1" if i % 2 == 0 else "contig2"
+        start = rng.randrange(0, len(contigs[contig_id]) - 400)
+        fragment = contigs[contig_id][start:start + 400]
+        mate1, mate2 = fragment[:150], reverse_complement(fragment[-150:])
+        # the second mate of every third pair is unmapped, and both mates of the last pair
+        if i % 3 == 0 or i == 29:
+            mate2 = random_sequence(rng, 150)
+        if i == 29:
+            mate1 = random_sequence(rng, 150)
+        mates[0].append((f"pair{i}", mate1))
+        mates[1].append((f"pair{i}", mate2))
+    write_test_fastq(str(tmp_path / "reads_1.fastq"), mates[0])
+    write_test_fastq(str(tmp_path / "reads_2.fastq"), mates[1])
+
+    bam_obj = IncrementalBamProcessor(1)
+    mappy_run = MappyAligner(Sequence("Illumina", [str(tmp_path / "reads_1.fastq"), str(tmp_path / "reads_2.fastq")]),
+                             str(tmp_path / "ref.fasta"), bam_obj, out_dir=str(tmp_path), out_prefix="mapped",
+                             write_bam=True, batch_size=4)
+    mappy_run.align()
+    assert bam_obj.chunks == 0
+    bam_obj.finalize()
+
+    primary = {}
+    with pysam.AlignmentFile(mappy_run.result_files["bam_output"], "rb") as bam:
+        for read in bam.fetch(until_eof=True):
+            if not read.is_secondary and not read.is_supplementary:
+                primary[(read.query_name, read.is_read1)] = read
+    assert len(primary) == 60
+    for (name, is_read1), read in primary.items():
+        mate = primary[(name, not is_read1)]
+        assert read.is_paired
+        assert read.mate_is_unmapped == mate.is_unmapped
+        if mate.is_unmapped and read.is_unmapped:
+            assert read.reference_name is None and read.next_reference_name is None
+            continue
+        if not mate.is_unmapped:
+            assert read.mate_is_reverse == mate.is_reverse
+        assert (read.next_reference_name, read.next_reference_start) == (mate.reference_name, mate.reference_start)
+        if read.is_unmapped:
+            assert (read.reference_name, read.reference_start) == (mate.reference_name, mate.reference_start)
+        if mate.is_unmapped:
+            assert (read.next_reference_name, read.next_reference_start) == (read.reference_name, read.reference_start)
+    assert primary[("pair3", False)].is_unmapped and primary[("pair3", True)].mate_is_unmapped
+
+    # unmapped mates placed on a contig are counted there, as when reading the bam file
+    from_bam = IncrementalBamProcessor(1)
+    from_bam.add_bam(mappy_run.result_files["bam_output"])
+    from_bam.finalize()
+    assert from_bam.chunks == 1
+    for contig_id in ["contig1", "contig2", "*"]:
+        assert bam_obj.ref_stats[contig_id]['reads'] == from_bam.ref_stats[contig_id]['reads']
+        assert bam_obj.ref_stats[contig_id]['num_reads'] == from_bam.ref_stats[contig_id]['num_reads']
+    assert list(bam_obj.ref_stats['*']['reads']) == ["pair29"]
+    sorted_bam = BamProcessor(mappy_run.result_files["bam_output"], 1)
+    for contig_id in contigs:
+        assert np.array_equal(np.asarray(bam_obj.ref_coverage[contig_id]), np.asarray(from_bam.ref_coverage[contig_id]))
+        assert np.array_equal(np.asarray(bam_obj.ref_coverage[contig_id]), np.asarray(sorted_bam.ref_coverage[contig_id]))
+        assert bam_obj.ref_stats[contig_id]['num_reads'] == sorted_bam.ref_stats[contig_id]['num_reads']
+
+def write_fake_tool(bin_dir, name, body):
+    tool = bin_dir / name
+    tool.write_text(f"#!{sys.executable}\nimport sys\n{body}\n")
+    tool.chmod(0o755)
+
+fake_minimap2_output = ('sys.stdout.write("@SQ\\tSN:contig1\\tLN:100\\n'
+                        'read1\\t0\\tcontig1\\t1\\t60\\t4M\\t*\\t0\\t0\\tACGT\\tIIII\\n")')
+
+@pytest.mark.parametrize("failing_tool, status", [("minimap2", 1), ("samtools", 2)])
+def test_minimap2_sorted_bam_checks_both_exit_codes(tmp_path, monkeypatch, failing_tool, status):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    write_fake_tool(bin_dir, "minimap2", fake_minimap2_output + ("\nsys.exit(1)" if failing_tool == "minimap2" else ""))
+    if failing_tool == "samtools":
+        write_fake_tool(bin_dir, "samtools", "sys.stdin.read()\nsys.exit(2)")
+    elif shutil.which("samtools") is None:
+        pytest.skip("samtools is not installed")
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    write_test_fastq(str(tmp_path / "reads.fastq"), [("read1", "ACGT")])
+
+    minimap2_run = Minimap2Runner(Sequence("ONT", [str(tmp_path / "reads.fastq")]), str(tmp_path), "ref.fasta", "mapped")
+    with pytest.raises(ValueError, match=f"{'minimap2' if failing_tool == 'minimap2' else 'samtools sort'} exited with status {status}"):
+        minimap2_run.run_minimap2_sorted_bam()
+    assert minimap2_run.status == False
+    assert not os.path.isfile(tmp_path / "mapped.bam")
+
+def test_minimap2_sorted_bam(tmp_path, monkeypatch):
+    if shutil.which("samtools") is None:
+        pytest.skip("samtools is not installed")
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    write_fake_tool(bin_dir, "minimap2", fake_minimap2_output)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    write_test_fastq(str(tmp_path / "reads.fastq"), [("read1", "ACGT")])
+
+    minimap2_run = Minimap2Runner(Sequence("ONT", [str(tmp_path / "reads.fastq")]), str(tmp_path), "ref.fasta", "mapped")
+    minimap2_run.run_minimap2_sorted_bam()
+    assert minimap2_run.status == True
+    assert os.path.isfile(minimap2_run.result_files["bam_index"])
+    with pysam.AlignmentFile(minimap2_run.result_files["bam_output"], "rb") as bam:
+        assert [read.query_name for read in bam.fetch("contig1")] == ["read1"]
+
+def write_random_quality_fastq(path, n_reads, seed):
+    """Writes reads with header comments and random qualities, gzipped when the path ends in .gz."""
+    rng = random.Random(seed)
+    records = []
+    for i in range(n_reads):
+        seq = random_sequence(rng, rng.randrange(1, 120))
+        qual = ''.join(chr(rng.randrange(35, 75)) for _ in seq)
+        records.append(f"@{os.path.basename(path).split('.')[0]}_read{i} runid=abc ch={i}\n{seq}\n+\n{qual}\n")
+    with (gzip.open(path, 'wt') if path.endswith(".gz") else open(path, 'w')) as f:
+        f.write("".join(records))
+
+def test_fastq_scanner_matches_fastq_parser(tmp_path):
+    fastq_files = [str(tmp_path / "plain.fastq"), str(tmp_path / "packed.fastq.gz")]
+    write_random_quality_fastq(fastq_files[0], 25, 1)
+    write_random_quality_fastq(fastq_files[1], 12, 2)
+    scanner = FastqScanner(Sequence("ONT", fastq_files), "reads_read_list", str(tmp_path), batch_size=7)
+    scanner.scan()
+
+    expected = {}
+    for fastq_file in fastq_files:
+        fastq_obj = fastq_parser(fastq_file)
+        for record in fastq_obj.parse():
+            expected[fastq_obj.read_id_from_record] = (len(record[1]), mean_qscore_phred33(record[3]))
+    with open(scanner.result_files["read_list_file"]) as f:
+        assert f.readline() == "read_id\n"
+        read_ids = [line.strip() for line in f]
+    read_table = FastqScanner.load_read_table(scanner.result_files["read_table_file"])
+    assert read_ids == list(expected)
+    assert len(read_table) == 37
+    for read_id, (read_len, read_qscore) in zip(read_ids, read_table):
+        assert read_len == expected[read_id][0]
+        assert read_qscore == pytest.approx(expected[read_id][1])
+
+    # the manifest built from the read table equals the one parsed from the fastq files
+    write_sorted_test_bam(str(tmp_path / "reads.bam"), [])
+    manifests = []
+    for name, inputs in [("from_fastq", {'in_fastq': fastq_files}),
+                         ("from_table", {'read_table': scanner.result_files["read_table_file"]})]:
+        manifest = SeqManifest("sample", str(tmp_path / "reads.bam"), name, str(tmp_path), 1,
+                               read_list=scanner.result_files["read_list_file"], start_time=0, end_time=1, **inputs)
+        manifests.append(read_manifest(manifest.manifest_file))
+    assert manifests[0]['read_qscore'].to_numpy() == pytest.approx(manifests[1]['read_qscore'].to_numpy())
+    assert manifests[0].drop(columns='read_qscore').equals(manifests[1].drop(columns='read_qscore'))
+
+def test_fastp_read_ids(tmp_path):
+    fastq_files = [str(tmp_path / "fastp_1.fastq"), str(tmp_path / "fastp_2.fastq.gz")]
+    write_random_quality_fastq(fastq_files[0], 15, 3)
+    write_random_quality_fastq(fastq_files[1], 10, 4)
+    expected = []
+    for fastq_file in fastq_files:
+        fastq_obj = fastq_parser(fastq_file)
+        read_ids = [fastq_obj.read_id_from_record for _ in fastq_obj.parse()]
+        assert list(fastq_parser(fastq_file).parse_read_ids()) == read_ids
+        expected.extend(read_ids)
+
+    # reads of the read list missing from the fastp output did not pass
+    read_list = tmp_path / "read_list.txt"
+    read_list.write_text("read_id\n" + "".join(f"{read_id}\n" for read_id in expected[::2] + ["fastp_1_read99"]))
+    write_sorted_test_bam(str(tmp_path / "reads.bam"), [])
+    manifest = SeqManifest("sample", str(tmp_path / "reads.bam"), "manifest", str(tmp_path), 1, fastp_fastq=fastq_files,
+                           read_list=str(read_list), in_fastq=fastq_files, start_time=0, end_time=1)
+    assert manifest.filtered_reads == set(expected)
+    df = read_manifest(manifest.manifest_file)
+    assert df.set_index('read_id')['fastp_status'].astype(str).to_dict() == {
+        **{read_id: 'True' for read_id in expected[::2]}, "fastp_1_read99": 'False'}
+
+def test_minimap2_index_cache(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    builds = tmp_path / "builds.txt"
+    write_fake_tool(bin_dir, "minimap2", "import time\ntime.sleep(0.2)\n"
+                    f"open({str(builds)!r}, 'a').write(' '.join(sys.argv[1:]) + '\\n')\n"
+                    "open(sys.argv[sys.argv.index('-d') + 1], 'w').write('index')")
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    reference = tmp_path / "ref.fasta"
+    reference.write_text(">contig1\nACGT\n")
+    cache_dir = str(tmp_path / "index_cache")
+
+    # concurrent runs wait for a single build
+    index_files = []
+    threads = [threading.Thread(target=lambda: index_files.append(
+        Minimap2IndexCache(cache_dir, str(reference), "map-ont", 15).get_index())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(index_files)) == 1 and len(index_files) == 4
+    assert len(builds.read_text().splitlines()) == 1
+    assert Minimap2IndexCache(cache_dir, str(reference), "map-ont", 15).get_index() == index_files[0]
+    assert len(builds.read_text().splitlines()) == 1
+
+    # the preset, the kmer size and the reference contents each key a separate index
+    keys = {index_files[0]}
+    for preset, kmer_size in [("sr", 15), ("map-ont", 21)]:
+        keys.add(Minimap2IndexCache(cache_dir, str(reference), preset, kmer_size).get_index())
+    reference.write_text(">contig1\nACGTT\n")
+    keys.add(Minimap2IndexCache(cache_dir, str(reference), "map-ont", 15).get_index())
+    assert len(keys) == 4
+    assert len(builds.read_text().splitlines()) == 4
+    assert sorted(name for name in os.listdir(cache_dir) if name.endswith(".mmi")) == sorted(os.path.basename(key) for key in keys)
+
+def test_minimap2_index_cache_failed_build(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    write_fake_tool(bin_dir, "minimap2", "open(sys.argv[sys.argv.index('-d') + 1], 'w')\nsys.exit(1)")
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    (tmp_path / "ref.fasta").write_text(">contig1\nACGT\n")
+    index_cache = Minimap2IndexCache(str(tmp_path / "index_cache"), str(tmp_path / "ref.fasta"), "map-ont", 15)
+    with pytest.raises(ValueError):
+        index_cache.get_index()
+    assert [name for name in os.listdir(tmp_path / "index_cache") if not name.endswith(".lock")] == []
+
+def test_profile_json(tmp_path):
+    profiler = StageProfiler()
+    scheduler = StageScheduler(threads=2, profiler=profiler)
+
+    def busy():
+        total = 0
+        end = time.process_time() + 0.2
+        while time.process_time() < end:
+            total += 1
+        return total
+
+    def child():
+        # an external tool: its CPU time is only seen through the child usage
+        subprocess.run([sys.executable, "-c", "import time\nend = time.process_time() + 0.2\nwhile time.process_time() < end: pass"], check=True)
+
+    def failing():
+        raise ValueError("stage failed")
+
+    scheduler.add_stage("busy", busy)
+    scheduler.add_stage("tool", child, depends_on=["busy"])
+    scheduler.add_stage("failing", failing, depends_on=["tool"])
+    with pytest.raises(ValueError):
+        scheduler.run()
+    profile_file = str(tmp_path / "profile.json")
+    profiler.write(profile_file)
+
+    with open(profile_file) as f:
+        profile = json.load(f)
+    assert list(profile['stages']) == ["busy", "tool", "failing"]
+    for entry in profile['stages'].values():
+        assert set(entry) == {'start', 'end', 'wall_seconds', 'user_cpu_seconds', 'system_cpu_seconds',
+                              'children_user_cpu_seconds', 'children_system_cpu_seconds', 'peak_rss_mb',
+                              'children_peak_rss_mb'}
+        assert entry['end'] >= entry['start']
+        assert entry['peak_rss_mb'] > 0
+    busy_stage, tool_stage = profile['stages']['busy'], profile['stages']['tool']
+    assert busy_stage['user_cpu_seconds'] + busy_stage['system_cpu_seconds'] >= 0.15
+    assert tool_stage['children_user_cpu_seconds'] + tool_stage['children_system_cpu_seconds'] >= 0.15
+    assert tool_stage['children_peak_rss_mb'] > 0
+    assert profile['version'] == __version__
+    assert profile['wall_seconds'] >= busy_stage['wall_seconds'] + tool_stage['wall_seconds']
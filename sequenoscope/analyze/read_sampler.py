@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+import os
+import heapq
+import hashlib
+from contextlib import ExitStack
+from sequenoscope.constant import DefaultValues
+from sequenoscope.utils.__init__ import open_file
+from sequenoscope.utils.parser import FastqPairedEndRenamer
+
+
+class ReadSampler:
+    out_prefix = None
+    out_dir = None
+    read_set = None
+    max_reads = 0
+    max_bases = 0
+    total_reads = 0
+    total_bases = 0
+    sampled_reads = 0
+    sampled_bases = 0
+    status = False
+    error_messages = None
+    result_files = {"fastq_files":[]}
+
+    def __init__(self, read_set, out_prefix, out_dir, max_reads=0, max_bases=0,
+                 buffer_size=DefaultValues.fastq_write_buffer_size):
+        """
+        Initalize the class with read_set, out_prefix, out_dir and the read or base budget of the sample
+
+        Arguments:
+            read_set: sequence object
+                an object that contains the list of sequence files for analysis
+            out_prefix: str
+                a designation of what the output files will be named
+            out_dir: str
+                a string to the path where the output files will be stored
+            max_reads: int
+                maximum number of reads (or read pairs) in the sample, 0 for no limit
+            max_bases: int
+                maximum number of bases in the sample, both mates counted, 0 for no limit
+            buffer_size: int
+                size in bytes of the output file buffers
+        """
+        self.out_prefix = out_prefix
+        self.out_dir = out_dir
+        self.read_set = read_set
+        self.max_reads = max_reads
+        self.max_bases = max_bases
+        self.buffer_size = buffer_size
+        self.result_files = {"fastq_files":[]}
+
+    @staticmethod
+    def read_hash(read_id):
+        """
+        Returns:
+            int:
+                a 64 bit hash of the read id that is the same in every run
+        """
+        return int.from_bytes(hashlib.blake2b(read_id, digest_size=8).digest(), "big")
+
+    def sample(self):
+        """
+        Draws a uniform sample of reads within the budget in one streaming pass. Every read gets a
+        hash of its id and the reads with the smallest hashes that fit the budget are kept, so the
+        sample is reproducible and both mates of a pair are kept together. Only the kept reads are
+        held in memory; they are written in their input order with their full header lines.
+
+        Returns:
+            bool:
+                returns True if the generated output files are found and not empty, False otherwise
+        """
+        max_reads = self.max_reads if self.max_reads > 0 else float("inf")
+        max_bases = self.max_bases if self.max_bases > 0 else float("inf")
+        # Max-heap on the hash of the kept reads: (-hash, input position, records of the mates)
+        kept = []
+        kept_bases = 0
+        self.total_reads = 0
+        self.total_bases = 0
+
+        with ExitStack() as stack:
+            handles = [stack.enter_context(open_file(fastq_file, "rb")) for fastq_file in self.read_set.files]
+            mates = zip(*[FastqPairedEndRenamer.parse_records(f, allow_empty=True, full_header=True) for f in handles])
+            for position, records in enumerate(mates):
+                read_bases = sum(len(seq) for _, seq, _ in records)
+                self.total_reads += 1
+                self.total_bases += read_bases
+                read_hash = self.read_hash(records[0][0][1:].split(b" ", 1)[0])
+                if kept and read_hash > -kept[0][0] and (len(kept) >= max_reads or kept_bases + read_bases > max_bases):
+                    continue
+                heapq.heappush(kept, (-read_hash, position, records))
+                kept_bases += read_bases
+                while kept and (len(kept) > max_reads or kept_bases > max_bases):
+                    _, _, dropped = heapq.heappop(kept)
+                    kept_bases -= sum(len(seq) for _, seq, _ in dropped)
+
+        kept.sort(key=lambda item: item[1])
+        self.sampled_reads = len(kept)
+        self.sampled_bases = kept_bases
+        if len(self.read_set.files) == 1:
+            out_files = [os.path.join(self.out_dir, f"{self.out_prefix}.fastq")]
+        else:
+            out_files = [os.path.join(self.out_dir, f"{self.out_prefix}_{mate + 1}.fastq") for mate in range(len(self.read_set.files))]
+        for mate, out_file in enumerate(out_files):
+            with open(out_file, "wb", buffering=self.buffer_size) as fout:
+                for _, _, records in kept:
+                    name, seq, qual = records[mate]
+                    fout.write(b"".join((name, b"\n", seq, b"\n+\n", qual, b"\n")))
+        self.result_files["fastq_files"] = out_files
+
+        self.status = self.check_files(out_files)
+        if self.status == False:
+            self.error_messages = "one or more files was not created or was empty, the budget may be smaller than a single read"
+            raise ValueError(str(self.error_messages))
+        return self.status
+
+    def sampling_fraction(self):
+        """
+        Returns:
+            float:
+                fraction of the input bases kept in the sample, used to scale totals and coverage
+        """
+        if self.total_bases == 0:
+            return 1.0
+        return self.sampled_bases / self.total_bases
+
+    def check_files(self, files_to_check):
+        """
+        check if the output file exists and is not empty
+
+        Arguments:
+            files_to_check: list
+                list of file paths
+
+        Returns:
+            bool:
+                returns True if the generated output file is found and not empty, False otherwise
+        """
+        if isinstance (files_to_check, str):
+            files_to_check = [files_to_check]
+        for f in files_to_check:
+            if not os.path.isfile(f):
+                return False
+            elif os.path.getsize(f) == 0:
+                return False
+        return True
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from sequenoscope.utils.__init__ import format_time
+
+
+class StageScheduler:
+    threads = 1
+    logger = None
+    stages = {}
+    results = {}
+    timings = {}
+    profiler = None
+
+    def __init__(self, threads=1, logger=None, profiler=None):
+        """
+        Initalize the class with a global thread budget
+
+        Arguments:
+            threads: int
+                total number of threads the running stages may use together, default is 1
+            logger: logging.Logger
+                logger receiving the start and end of each stage
+            profiler: StageProfiler
+                (optional) profiler measuring the runtime, CPU and memory of each stage
+        """
+        self.threads = max(1, threads)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.stages = {}
+        self.results = {}
+        self.timings = {}
+        self.profiler = profiler
+
+    def add_stage(self, name, func, depends_on=(), threads=1):
+        """
+        Registers a pipeline stage
+
+        Arguments:
+            name: str
+                unique name of the stage
+            func: callable
+                function run without arguments; its return value is stored in self.results[name]
+            depends_on: list
+                names of the stages that must finish before this one starts
+            threads: int
+                threads the stage uses; capped at the global budget
+        """
+        if name in self.stages:
+            raise ValueError(f"Stage {name} was added twice.")
+        for dependency in depends_on:
+            if dependency not in self.stages:
+                raise ValueError(f"Stage {name} depends on unknown stage {dependency}.")
+        self.stages[name] = {'func': func, 'depends_on': list(depends_on),
+                             'threads': min(max(1, threads), self.threads)}
+
+    def run(self):
+        """
+        Runs the stages as a dependency graph. A stage starts once its dependencies have finished
+        and its threads fit in the remaining budget; stages are started in the order they were added.
+        If a stage fails, the running stages are allowed to finish and the first error is raised.
+
+        Returns:
+            dict:
+                return value of every stage keyed by stage name
+        """
+        pending = list(self.stages)
+        running = {}
+        available = self.threads
+        error = None
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            while (pending and error is None) or running:
+                if error is None:
+                    for name in list(pending):
+                        stage = self.stages[name]
+                        if not all(d in self.results for d in stage['depends_on']):
+                            continue
+                        if stage['threads'] > available:
+                            continue
+                        pending.remove(name)
+                        available -= stage['threads']
+                        running[executor.submit(self._run_stage, name)] = name
+
+                if not running:
+                    raise RuntimeError(f"Stages {', '.join(pending)} can not be scheduled.")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    available += self.stages[name]['threads']
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        if error is None:
+                            error = e
+
+        if error is not None:
+            raise error
+        return self.results
+
+    def _run_stage(self, name):
+        """
+        Runs a single stage and logs its start and end times
+        """
+        start = time.time()
+        self.logger.info(f"Stage '{name}' started (threads: {self.stages[name]['threads']}).")
+        try:
+            if self.profiler is not None:
+                with self.profiler.profile(name):
+                    result = self.stages[name]['func']()
+            else:
+                result = self.stages[name]['func']()
+        except Exception:
+            self.timings[name] = (start, time.time())
+            self.logger.error(f"Stage '{name}' failed after {format_time(time.time() - start)}.")
+            raise
+        end = time.time()
+        self.timings[name] = (start, end)
+        self.logger.info(f"Stage '{name}' finished in {format_time(end - start)}.")
+        return result
@@ -1,11 +1,21 @@
 #!/usr/bin/env python
 
 import os
-from math import log
+import csv
+import numpy as np
+import pandas as pd
 from sequenoscope.constant import DefaultValues
 from sequenoscope.utils.parser import fastq_parser
+from sequenoscope.utils.qscore import mean_qscore, as_quality_array, batch_mean_qscores
 from sequenoscope.analyze.bam import BamProcessor
-from sequenoscope.utils.__init__ import is_non_zero_file
+from sequenoscope.analyze.fastq_scanner import FastqScanner
+from sequenoscope.analyze.manifest_writer import open_manifest_writer
+from sequenoscope.utils.__init__ import is_non_zero_file, open_file
+
+
+# Sequencing summary columns used by the manifest
+SEQ_SUMMARY_COLUMNS = ('read_id', 'channel', 'start_time', 'duration', 'sequence_length_template',
+                       'mean_qscore_template', 'end_reason')
 
 
 class SeqManifest:
@@ -18,9 +28,12 @@ class SeqManifest:
 
     def __init__(self, sample_id, in_bam, out_prefix, out_dir, min_coverage,
                  in_fastq=None, fastp_fastq=None, in_seq_summary=None, read_list=None,
-                 start_time=None, end_time=None, delim="\t"):
+                 start_time=None, end_time=None, delim="\t", threads=1, sparse_coverage=False, cache_dir=None,
+                 read_table=None, bam_obj=None, manifest_format='tsv'):
         """
         Initialize the SeqManifest object with sample and file information.
+        An already processed BamProcessor of in_bam can be passed as bam_obj.
+        manifest_format selects a tsv, parquet or feather manifest.
         
         Raises:
             ValueError: if required sequencing summary or fastq inputs are missing.
@@ -33,10 +46,16 @@ class SeqManifest:
         self.in_fastq = in_fastq
         self.fastp_fastq = fastp_fastq
         self.read_list = read_list
+        self.read_table = read_table
         self.start_time = start_time
         self.end_time = end_time
         self.min_coverage = min_coverage
-        self.filtered_reads = {}
+        self.threads = threads
+        self.sparse_coverage = sparse_coverage
+        self.cache_dir = cache_dir
+        self.manifest_format = manifest_format
+        self.manifest_file = None
+        self.filtered_reads = set()
         self.raw_reads = {}
         self.status = False
         self.error_messages = None
@@ -44,13 +63,17 @@ class SeqManifest:
         if self.in_seq_summary is None:
             if self.start_time is None or self.end_time is None:
                 raise ValueError('No sequencing summary specified; please specify a start and end datetime.')
-            if self.in_fastq is None:
-                raise ValueError('No sequencing summary specified; please provide the initial fastq file for calculations.')
+            if self.in_fastq is None and self.read_table is None:
+                raise ValueError('No sequencing summary specified; please provide the initial fastq file or a read table for calculations.')
 
-        self.bam_obj = BamProcessor(input_file=in_bam, min_coverage=self.min_coverage)
+        if bam_obj is not None:
+            self.bam_obj = bam_obj
+        else:
+            self.bam_obj = BamProcessor(input_file=in_bam, min_coverage=self.min_coverage, threads=self.threads,
+                                        sparse_coverage=self.sparse_coverage, cache_dir=self.cache_dir)
 
         if self.fastp_fastq:
-            self.process_fastq(self.fastp_fastq, self.filtered_reads)
+            self.load_read_ids(self.fastp_fastq, self.filtered_reads)
         if self.in_fastq:
             self.process_fastq(self.in_fastq, self.raw_reads)
 
@@ -63,123 +86,190 @@ class SeqManifest:
 
         self.status = True
 
-    @staticmethod
-    def error_prob_list_tab(n):
-        """Generate a list of error probabilities for qualities 0..n."""
-        return [10 ** (q / -10) for q in range(n + 1)]
-
-    def calc_mean_qscores(self, qual, tab=None):
-        """Calculate the mean quality score using error probabilities."""
-        if tab is None:
-            tab = SeqManifest.error_prob_list_tab(DefaultValues.nanoget_threshold)
-        if qual:
-            avg_error = sum(tab[q] for q in qual) / len(qual)
-            return -10 * log(avg_error, 10)
-        return 0
+    def calc_mean_qscores(self, qual):
+        """Calculate the mean quality score of a list of Phred scores using error probabilities."""
+        return mean_qscore(qual)
 
     def convert_qscores(self, qual_string):
-        """Convert a Phred quality string into a list of integer scores."""
-        return [ord(c) - DefaultValues.phred_33_encoding_value for c in qual_string]
+        """Convert a Phred quality string into an array of integer scores."""
+        return as_quality_array(qual_string, DefaultValues.phred_33_encoding_value)
 
-    def process_fastq(self, fastq_file_list, read_dict):
+    def process_fastq(self, fastq_file_list, read_dict, batch_size=DefaultValues.qscore_batch_size):
         """Process FASTQ files and store read length and computed quality score in a dictionary."""
         for fastq_file in fastq_file_list:
             fastq_obj = fastq_parser(fastq_file)
+            read_ids = []
+            seq_lens = []
+            quals = []
             for record in fastq_obj.parse():
-                read_id = fastq_obj.read_id_from_record
-                seq = record[1]
-                seq_len = len(seq)
-                qual = self.convert_qscores(record[3])
-                qscore = self.calc_mean_qscores(qual)
-                read_dict[read_id] = [seq_len, qscore]
+                read_ids.append(fastq_obj.read_id_from_record)
+                seq_lens.append(len(record[1]))
+                quals.append(record[3])
+                if len(quals) >= batch_size:
+                    self.store_read_batch(read_dict, read_ids, seq_lens, quals)
+                    read_ids, seq_lens, quals = [], [], []
+            self.store_read_batch(read_dict, read_ids, seq_lens, quals)
+
+    def load_read_ids(self, fastq_file_list, read_set):
+        """Add only the read ids of FASTQ files to a set, for read membership checks."""
+        for fastq_file in fastq_file_list:
+            read_set.update(fastq_parser(fastq_file).parse_read_ids())
+
+    def store_read_batch(self, read_dict, read_ids, seq_lens, quals):
+        """Compute the mean quality scores of a batch of reads and store them with their lengths."""
+        qscores = batch_mean_qscores(quals).tolist()
+        for read_id, seq_len, qscore in zip(read_ids, seq_lens, qscores):
+            read_dict[read_id] = [seq_len, qscore]
 
     def create_row(self):
         """Create an empty row dictionary with keys from fields."""
         return {field: '' for field in self.fields}
 
-    def create_manifest_with_sum(self):
-        """Create the manifest file using a sequencing summary."""
-        manifest_file = os.path.join(self.out_dir, f"{self.out_prefix}.txt")
-        with open(self.read_list, 'r') as file:
-            read_set = {line.strip() for line in file if line.strip() != 'read_id'}
-
-        with open(manifest_file, 'w') as fout, open(self.in_seq_summary, 'r') as fin:
-            header = next(fin).strip().split(self.delim)
-            fout.write("\t".join(self.fields) + "\n")
-            for line in fin:
-                row = line.strip().split(self.delim)
-                if len(row) < len(header):
+    def create_manifest_with_sum(self, chunk_size=DefaultValues.seq_summary_chunk_size):
+        """
+        Create the manifest file using a sequencing summary. The summary is read in chunks of
+        chunk_size rows and only the columns the manifest needs are loaded; every chunk is joined
+        with the read list, the fastp reads and the alignments at once and written as one batch.
+        """
+        with open_file(self.read_list, 'r') as file:
+            read_index = pd.Index(list({line.strip() for line in file if line.strip() != 'read_id'}))
+        filtered_index = pd.Index(list(self.filtered_reads))
+        loc_index, contig_counts, contig_offsets, contigs = self.flatten_read_locations(read_index)
+
+        with open(self.in_seq_summary, 'r') as fin:
+            header = fin.readline().strip().split(self.delim)
+        # The first and last columns are always loaded: rows missing either are incomplete and skipped
+        usecols = [column for column in header if column in SEQ_SUMMARY_COLUMNS or column in (header[0], header[-1])]
+
+        with open_manifest_writer(self.out_dir, self.out_prefix, self.fields, self.manifest_format) as fout:
+            self.manifest_file = fout.out_file
+            chunks = pd.read_csv(self.in_seq_summary, sep=self.delim, usecols=usecols, dtype=str,
+                                 keep_default_na=False, quoting=csv.QUOTE_NONE, chunksize=chunk_size)
+            for chunk in chunks:
+                chunk = chunk[(chunk[header[0]] != '') & (chunk[header[-1]] != '')]
+                if 'read_id' not in chunk:
                     continue
-                row_data = dict(zip(header, row))
-                read_id = row_data.get('read_id')
-                if read_id not in read_set:
+                chunk = chunk[read_index.get_indexer(chunk['read_id']) >= 0]
+                if chunk.empty:
                     continue
+                fout.write_columns(self.join_summary_chunk(chunk, filtered_index, loc_index,
+                                                           contig_counts, contig_offsets, contigs))
 
-                read_len = row_data.get('sequence_length_template', 0)
-                read_qual = row_data.get('mean_qscore_template', 0)
-
-                is_uniq = True
-                is_mapped = False
-                start_time_val = row_data.get('start_time', '')
-                duration = row_data.get('duration', '')
-                if not start_time_val:
-                    start_time_val = self.start_time
-                    end_time_val = self.end_time
-                else:
-                    start_time_val = float(start_time_val)
-                    end_time_val = start_time_val + float(duration) if duration else ''
-
-                out_row = self.create_row()
-                for field in self.fields:
-                    if field in row_data:
-                        out_row[field] = row_data[field]
-
-                mapped_contigs = [cid for cid, stats in self.bam_obj.ref_stats.items()
-                                  if read_id in stats['reads'] and cid != '*']
-                if mapped_contigs:
-                    is_mapped = True
-                    if len(mapped_contigs) > 1:
-                        is_uniq = False
-
-                fastp_status = read_id in self.filtered_reads
+        if not self.check_files([self.manifest_file]):
+            raise ValueError("One or more files were not created or were empty")
 
-                out_row.update({
-                    'fastp_status': fastp_status,
-                    'sample_id': self.sample_id,
-                    'read_id': read_id,
-                    'is_mapped': is_mapped,
-                    'is_uniq': is_uniq,
-                    'read_len': read_len,
-                    'read_qscore': read_qual,
-                    'start_time': start_time_val,
-                    'end_time': end_time_val,
-                    'decision': row_data.get('end_reason', '')
-                })
+    def flatten_read_locations(self, read_ids):
+        """
+        Flatten the mapped contigs of the given reads for vectorized lookups. Only the reads of
+        the read list are walked, as the bam object of the watch command holds every read seen so far.
 
-                if not mapped_contigs:
-                    out_row['contig_id'] = ''
-                    fout.write("\t".join(str(x) for x in out_row.values()) + "\n")
-                else:
-                    for contig_id in mapped_contigs:
-                        out_row['contig_id'] = contig_id
-                        fout.write("\t".join(str(x) for x in out_row.values()) + "\n")
+        Arguments:
+            read_ids: iterable
+                ids of the reads to look up in the alignments
 
-        if not self.check_files([manifest_file]):
-            raise ValueError("One or more files were not created or were empty")
+        Returns:
+            tuple:
+                index of the mapped read ids, number of contigs and offset into the contig array
+                of each read, and the contigs of all reads one after another
+        """
+        read_locations = self.bam_obj.read_locations
+        read_ids = [read_id for read_id in read_ids if read_id in read_locations]
+        counts = np.fromiter((len(read_locations[read_id][0]) for read_id in read_ids),
+                             dtype=np.int64, count=len(read_ids))
+        offsets = np.zeros(len(read_ids), dtype=np.int64)
+        if len(counts) > 1:
+            offsets[1:] = np.cumsum(counts)[:-1]
+        contigs = np.empty(int(counts.sum()), dtype=object)
+        contigs[:] = [contig for read_id in read_ids for contig in read_locations[read_id][0]]
+        return pd.Index(read_ids), counts, offsets, contigs
+
+    def join_summary_chunk(self, chunk, filtered_index, loc_index, contig_counts, contig_offsets, contigs):
+        """
+        Join a chunk of sequencing summary rows with the fastp reads and the alignments.
+
+        Arguments:
+            chunk: pd.DataFrame
+                summary rows of reads in the read list, all columns as strings
+            filtered_index: pd.Index
+                ids of the reads kept by fastp
+            loc_index, contig_counts, contig_offsets, contigs:
+                the flattened alignments from flatten_read_locations
+
+        Returns:
+            dict:
+                manifest columns with one row per read and mapped contig
+        """
+        n_rows = len(chunk)
+        read_ids = chunk['read_id'].to_numpy(dtype=object)
+
+        def column(name, default):
+            if name in chunk:
+                return chunk[name].to_numpy(dtype=object)
+            return np.full(n_rows, default, dtype=object)
+
+        start = column('start_time', '')
+        duration = column('duration', '')
+        has_start = start != ''
+        has_duration = duration != ''
+        start_time = np.full(n_rows, self.start_time, dtype=object)
+        end_time = np.full(n_rows, self.end_time, dtype=object)
+        start_values = start[has_start].astype(np.float64)
+        start_time[has_start] = start_values.tolist()
+        end_time[has_start] = ''
+        with_end = has_start & has_duration
+        end_time[with_end] = (start[with_end].astype(np.float64) + duration[with_end].astype(np.float64)).tolist()
+
+        loc = loc_index.get_indexer(read_ids)
+        is_mapped = loc >= 0
+        n_contigs = np.where(is_mapped, contig_counts[loc], 0)
+        is_mapped &= n_contigs > 0
+        # Unmapped reads keep a single row with an empty contig
+        repeats = np.maximum(n_contigs, 1)
+        row_index = np.repeat(np.arange(n_rows), repeats)
+        within_read = np.arange(len(row_index)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        contig_id = np.full(len(row_index), '', dtype=object)
+        mapped_rows = is_mapped[row_index]
+        contig_id[mapped_rows] = contigs[contig_offsets[loc[row_index[mapped_rows]]] + within_read[mapped_rows]]
+
+        columns = {
+            'sample_id': np.full(n_rows, self.sample_id, dtype=object),
+            'read_id': read_ids,
+            'read_len': column('sequence_length_template', 0),
+            'read_qscore': column('mean_qscore_template', 0),
+            'channel': column('channel', ''),
+            'start_time': start_time,
+            'end_time': end_time,
+            'decision': column('end_reason', ''),
+            'fastp_status': filtered_index.get_indexer(read_ids) >= 0,
+            'is_mapped': is_mapped,
+            'is_uniq': n_contigs <= 1,
+        }
+        columns = {field: values[row_index] for field, values in columns.items()}
+        columns['contig_id'] = contig_id
+        return columns
 
     def create_manifest_no_sum(self):
-        """Create the manifest file when no sequencing summary is provided, using a read list and raw FASTQ data."""
-        manifest_file = os.path.join(self.out_dir, f"{self.out_prefix}.txt")
-        with open(manifest_file, 'w') as fout, open(self.read_list, 'r') as fin:
-            fout.write("\t".join(self.fields) + "\n")
+        """
+        Create the manifest file when no sequencing summary is provided, using a read list and either
+        a FastqScanner read table aligned with the read list or the raw FASTQ data.
+        """
+        read_table = None
+        if self.read_table is not None:
+            read_table = FastqScanner.load_read_table(self.read_table)
+        with open_manifest_writer(self.out_dir, self.out_prefix, self.fields, self.manifest_format) as fout, \
+                open_file(self.read_list, 'r') as fin:
+            self.manifest_file = fout.out_file
             header = next(fin).strip().split(self.delim)
-            for line in fin:
+            for row_num, line in enumerate(fin):
                 row = line.strip().split(self.delim)
                 row_data = dict(zip(header, row))
                 read_id = row_data.get('read_id')
 
                 read_len, read_qual = (0, 0)
-                if read_id in self.raw_reads:
+                if read_table is not None:
+                    read_len = int(read_table['read_len'][row_num])
+                    read_qual = float(read_table['read_qscore'][row_num])
+                elif read_id in self.raw_reads:
                     read_len, read_qual = self.raw_reads[read_id]
 
                 is_uniq = True
@@ -193,11 +283,9 @@ class SeqManifest:
                         out_row[field] = row_data[field]
 
                 mapped_contigs = []
-                for contig_id, stats in self.bam_obj.ref_stats.items():
-                    if read_id in stats['reads']:
-                        read_len, read_qual = stats['reads'][read_id]
-                        if contig_id != '*':
-                            mapped_contigs.append(contig_id)
+                location = self.bam_obj.read_locations.get(read_id)
+                if location is not None:
+                    mapped_contigs, read_len, read_qual = location
                 if mapped_contigs:
                     is_mapped = True
                 if len(mapped_contigs) > 1:
@@ -220,13 +308,13 @@ class SeqManifest:
 
                 if not mapped_contigs:
                     out_row['contig_id'] = ''
-                    fout.write("\t".join(str(x) for x in out_row.values()) + "\n")
+                    fout.write_row(out_row)
                 else:
                     for contig_id in mapped_contigs:
                         out_row['contig_id'] = contig_id
-                        fout.write("\t".join(str(x) for x in out_row.values()) + "\n")
+                        fout.write_row(out_row)
 
-        if not self.check_files([manifest_file]):
+        if not self.check_files([self.manifest_file]):
             raise ValueError("One or more files were not created or were empty")
 
     def check_files(self, files_to_check):
@@ -250,7 +338,12 @@ class SeqManifestSummary:
     ]
 
     def __init__(self, sample_id, bam_obj, out_prefix, out_dir, genome_size, coverage,
-                 fastp_json_file=None, paired=False):
+                 fastp_json_file=None, paired=False, coverage_thresholds=None, sampling_fraction=None):
+        """
+        Initialize the summary. When the reads were subsampled, sampling_fraction is the fraction of the
+        input bases analyzed: it is reported in a sampling_fraction column and the base totals, mapped
+        bases and coverage estimates are scaled up to the full input.
+        """
         self.sample_id = sample_id
         self.fastp_json_file = fastp_json_file
         self.bam_obj = bam_obj
@@ -259,12 +352,20 @@ class SeqManifestSummary:
         self.genome_size = genome_size
         self.coverage = coverage
         self.paired = paired
+        self.sampling_fraction = sampling_fraction
 
-        # Dynamic field: taxon_covered_bases_<min_cov>X
+        # Covered bases are reported for min_cov first, then for any additional thresholds.
         min_cov = self.bam_obj.min_coverage
-        self.taxon_coverage_field = f"taxon_covered_bases_{min_cov}X"
-        # New dynamic field for taxon percentage covered:
-        self.taxon_percentage_field = f"taxon_%_covered_bases_{min_cov}X"
+        self.coverage_thresholds = [min_cov]
+        for threshold in (coverage_thresholds or []):
+            if threshold not in self.coverage_thresholds:
+                self.coverage_thresholds.append(threshold)
+
+        # Dynamic fields: taxon_covered_bases_<N>X and taxon_%_covered_bases_<N>X per threshold
+        self.taxon_coverage_fields = [f"taxon_covered_bases_{t}X" for t in self.coverage_thresholds]
+        self.taxon_percentage_fields = [f"taxon_%_covered_bases_{t}X" for t in self.coverage_thresholds]
+        self.taxon_coverage_field = self.taxon_coverage_fields[0]
+        self.taxon_percentage_field = self.taxon_percentage_fields[0]
         # New dynamic field for total mapped bases:
         self.total_taxon_ref_mapped_field = "total_taxon_ref_mapped_bases"  # remains fixed
 
@@ -272,9 +373,19 @@ class SeqManifestSummary:
         self.fields = [
             'sample_id', 'est_genome_size', 'est_coverage', 'total_bases', 'total_fastp_bases',
             'mean_read_length', 'taxon_id', 'taxon_length', 'taxon_mean_coverage',
-            self.taxon_coverage_field,
-            self.taxon_percentage_field, self.total_taxon_ref_mapped_field, 'taxon_mean_read_length'
+            *self.taxon_coverage_fields,
+            *self.taxon_percentage_fields, self.total_taxon_ref_mapped_field, 'taxon_mean_read_length'
         ]
+        if self.sampling_fraction is not None:
+            self.fields.append('sampling_fraction')
+
+    def scale(self, value):
+        """Scale a sample total up to the full input by the sampling fraction."""
+        if self.sampling_fraction is None or self.sampling_fraction == 0:
+            return value
+        if isinstance(value, int):
+            return round(value / self.sampling_fraction)
+        return float(value) / self.sampling_fraction
 
     def create_row(self):
         """Create an empty row dictionary for the summary manifest."""
@@ -291,23 +402,29 @@ class SeqManifestSummary:
                 out_row = self.create_row()
                 out_row["sample_id"] = self.sample_id
                 out_row["est_genome_size"] = self.genome_size
-                out_row["est_coverage"] = self.coverage
-                out_row["total_bases"] = self.fastp_json_file["summary"]["before_filtering"]["total_bases"]
-                out_row["total_fastp_bases"] = self.fastp_json_file["summary"]["after_filtering"]["total_bases"]
+                out_row["est_coverage"] = self.scale(self.coverage)
+                out_row["total_bases"] = self.scale(self.fastp_json_file["summary"]["before_filtering"]["total_bases"])
+                out_row["total_fastp_bases"] = self.scale(self.fastp_json_file["summary"]["after_filtering"]["total_bases"])
                 out_row["mean_read_length"] = self.fastp_json_file["summary"]["after_filtering"]["read1_mean_length"]
                 out_row["taxon_id"] = contig_id
                 out_row["taxon_length"] = stats['length']
-                out_row[self.taxon_coverage_field] = stats['covered_bases']
+                covered_bases = [self.bam_obj.get_covered_bases(contig_id, t) for t in self.coverage_thresholds]
+                for field, value in zip(self.taxon_coverage_fields, covered_bases):
+                    out_row[field] = value
                 if stats['length'] != 0:
-                    out_row[self.taxon_percentage_field] = (stats['covered_bases'] / stats['length']) * 100
-                    out_row[self.total_taxon_ref_mapped_field] = stats['total_mapped_bases']
+                    for field, value in zip(self.taxon_percentage_fields, covered_bases):
+                        out_row[field] = (value / stats['length']) * 100
+                    out_row[self.total_taxon_ref_mapped_field] = self.scale(stats['total_mapped_bases'])
                     out_row["taxon_mean_read_length"] = stats['mean_len']
-                    out_row["taxon_mean_coverage"] = stats['mean_cov']
+                    out_row["taxon_mean_coverage"] = self.scale(stats['mean_cov'])
                 else:
-                    out_row[self.taxon_percentage_field] = 0
+                    for field in self.taxon_percentage_fields:
+                        out_row[field] = 0
                     out_row[self.total_taxon_ref_mapped_field] = 0
                     out_row["taxon_mean_read_length"] = 0
                     out_row["taxon_mean_coverage"] = 0
+                if self.sampling_fraction is not None:
+                    out_row["sampling_fraction"] = self.sampling_fraction
                 fout.write("\t".join(str(x) for x in out_row.values()) + "\n")
 
         if not self.check_files([summary_manifest_file]):
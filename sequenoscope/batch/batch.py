@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+import os
+import sys
+import csv
+import time
+import logging
+import argparse as ap
+import multiprocessing
+from multiprocessing.connection import wait
+
+from sequenoscope.utils.__init__ import format_time
+from sequenoscope.constant import SequenceTypes, DefaultValues
+from sequenoscope.version import __version__
+from sequenoscope.analyze import analyze
+from sequenoscope.analyze.manifest_writer import MANIFEST_FORMATS
+
+
+def parse_args():
+    parser = ap.ArgumentParser(
+        prog="sequenoscope",
+        usage="sequenoscope batch --sample_sheet <samples.tsv> --input_reference <ref.fasta> -o <out> [options]\nFor help use: sequenoscope batch -h or --help",
+        description="%(prog)s version {}: a flexible tool for processing multiplatform sequencing data: analyze, subset/filter, compare and visualize.".format(__version__),
+        formatter_class=ap.RawTextHelpFormatter
+    )
+
+    # USER OPTIONS: Essential inputs and outputs
+    user_group = parser.add_argument_group("USER OPTIONS", "Direct input files and basic parameters.")
+    user_group.add_argument("--sample_sheet", metavar="", required=True,
+                        help="[REQUIRED] Tab-separated sample sheet with the columns sample_id, fastq_1, fastq_2, sequencing_summary and sequencing_type (SE or PE).\nfastq_2 and sequencing_summary may be left empty.")
+    user_group.add_argument("--input_reference", metavar="", required=True,
+                        help="[REQUIRED] Path to a single reference FASTA file shared by all samples.")
+    user_group.add_argument("-o", "--output", metavar="", required=True,
+                        help="[REQUIRED] Output directory designation; each sample is written to a sub-directory named after its sample_id.")
+    user_group.add_argument("-t", "--threads", default=1, metavar="", type=int,
+                        help="Total number of threads shared by the samples running at the same time.")
+    user_group.add_argument("-w", "--workers", metavar="", type=int,
+                        help="Number of samples analyzed at the same time; default is one per {} threads.".format(DefaultValues.batch_threads_per_sample))
+
+    # FILTER OPTIONS: passed on to analyze for every sample.
+    filter_group = parser.add_argument_group("FILTER OPTIONS", "Parameters to filter/trim FASTQ reads, applied to every sample.")
+    filter_group.add_argument("-min_cov", "--minimum_coverage", default=1, metavar="", type=int,
+                        help="Minimum coverage threshold; default is 1.")
+    filter_group.add_argument("-cov_thresholds", "--coverage_thresholds", metavar="", type=int, nargs="+",
+                        help="Additional coverage thresholds reported as taxon_covered_bases_<N>X columns, e.g. 5 10 20.")
+    filter_group.add_argument("-min_len", "--minimum_read_length", default=15, metavar="", type=int,
+                        help="Minimum read length; default is 15.")
+    filter_group.add_argument("-max_len", "--maximum_read_length", default=0, metavar="", type=int,
+                        help="Maximum read length; default is 0 (no limit).")
+    filter_group.add_argument("-trm_fr", "--trim_front_bp", default=0, metavar="", type=int,
+                        help="Bases to trim from the front; default is 0.")
+    filter_group.add_argument("-trm_tail", "--trim_tail_bp", default=0, metavar="", type=int,
+                        help="Bases to trim from the tail; default is 0.")
+    filter_group.add_argument("-q", "--quality_threshold", default=15, metavar="", type=int,
+                        help="Quality score threshold; default is 15.")
+
+    parser.add_argument('--manifest_format', default='tsv', metavar="", choices=list(MANIFEST_FORMATS),
+                        help="Manifest file format: tsv, parquet or feather; default is tsv. The columnar formats require pyarrow.")
+    parser.add_argument('--sparse_coverage', action='store_true',
+                        help="Store per-contig coverage run-length encoded when smaller; lowers memory for large multi-genome references.")
+    parser.add_argument('--coverage_cache', metavar="",
+                        help="(Optional) Directory for caching per-contig coverage keyed by the input reads, reference and alignment options, reused when the same sample is re-analyzed.")
+    parser.add_argument('--index_cache', metavar="",
+                        help="(Optional) Directory for minimap2 reference indexes; default is <output>/minimap2_index, shared by all samples.")
+    parser.add_argument('--force', action='store_true', help="Force overwrite of existing results directories.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Resume earlier runs in the existing results directories, skipping completed stages.")
+    parser.add_argument('-v', '--version', action='version', version="%(prog)s " + __version__)
+    return parser.parse_args()
+
+
+def read_sample_sheet(sample_sheet):
+    """
+    Reads and validates a tab-separated sample sheet
+
+    Arguments:
+        sample_sheet: str
+            path to the sample sheet
+
+    Returns:
+        list:
+            one dict per sample with the sample_id, the list of fastq files, the sequencing summary and type
+    """
+    samples = []
+    seen = set()
+    with open(sample_sheet, 'r', newline='') as f:
+        reader = csv.DictReader(f, delimiter='\t')
+        missing = [field for field in ('sample_id', 'fastq_1', 'sequencing_type') if field not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Sample sheet {sample_sheet} is missing the column(s): {', '.join(missing)}")
+        for line_number, row in enumerate(reader, start=2):
+            sample_id = (row.get('sample_id') or '').strip()
+            if not sample_id:
+                continue
+            if sample_id in seen:
+                raise ValueError(f"Sample sheet line {line_number}: duplicate sample_id {sample_id}")
+            seen.add(sample_id)
+            seq_type = (row.get('sequencing_type') or '').strip().upper()
+            fastq_files = [row[field].strip() for field in ('fastq_1', 'fastq_2') if (row.get(field) or '').strip()]
+            if seq_type == SequenceTypes.paired_end and len(fastq_files) != 2:
+                raise ValueError(f"Sample sheet line {line_number}: paired-end sample {sample_id} needs fastq_1 and fastq_2")
+            if seq_type == SequenceTypes.single_end and len(fastq_files) != 1:
+                raise ValueError(f"Sample sheet line {line_number}: single-end sample {sample_id} needs only fastq_1")
+            if seq_type not in (SequenceTypes.paired_end, SequenceTypes.single_end):
+                raise ValueError(f"Sample sheet line {line_number}: sequencing_type of {sample_id} must be SE or PE")
+            for fastq_file in fastq_files:
+                if not os.path.isfile(fastq_file):
+                    raise ValueError(f"Sample sheet line {line_number}: {fastq_file} does not exist")
+            samples.append({'sample_id': sample_id, 'fastq': fastq_files,
+                            'sequencing_summary': (row.get('sequencing_summary') or '').strip() or None,
+                            'sequencing_type': seq_type})
+    return samples
+
+
+def build_analyze_args(sample, args, out_directory, threads, index_cache):
+    """
+    Builds the analyze command line of one sample
+
+    Returns:
+        list:
+            arguments for sequenoscope.analyze.analyze.run
+    """
+    argv = ["--input_fastq", *sample['fastq'],
+            "--input_reference", args.input_reference,
+            "-o", out_directory,
+            "-op", sample['sample_id'],
+            "-seq_type", sample['sequencing_type'],
+            "-t", str(threads),
+            "-min_cov", str(args.minimum_coverage),
+            "-min_len", str(args.minimum_read_length),
+            "-max_len", str(args.maximum_read_length),
+            "-trm_fr", str(args.trim_front_bp),
+            "-trm_tail", str(args.trim_tail_bp),
+            "-q", str(args.quality_threshold),
+            "--index_cache", index_cache,
+            "--manifest_format", args.manifest_format]
+    if sample['sequencing_summary']:
+        argv += ["-seq_sum", sample['sequencing_summary']]
+    if args.coverage_thresholds:
+        argv += ["-cov_thresholds", *[str(t) for t in args.coverage_thresholds]]
+    if args.sparse_coverage:
+        argv.append("--sparse_coverage")
+    if args.coverage_cache:
+        argv += ["--coverage_cache", args.coverage_cache]
+    if args.force:
+        argv.append("--force")
+    if args.resume:
+        argv.append("--resume")
+    return argv
+
+
+def run_sample(argv):
+    """
+    Runs analyze for one sample; used as the target of the worker processes.
+    """
+    analyze.run(argv)
+
+
+def combine_summaries(samples, output_dir, out_file):
+    """
+    Concatenates the manifest summaries of the completed samples into a single table
+
+    Arguments:
+        samples: list
+            samples whose summaries are combined
+        output_dir: str
+            batch output directory holding one sub-directory per sample
+        out_file: str
+            path of the combined summary
+
+    Returns:
+        int:
+            number of summaries combined
+    """
+    header = None
+    combined = 0
+    with open(out_file, 'w') as fout:
+        for sample in samples:
+            summary_file = os.path.join(output_dir, sample['sample_id'], f"{sample['sample_id']}_manifest_summary.txt")
+            if not os.path.isfile(summary_file):
+                continue
+            with open(summary_file, 'r') as fin:
+                sample_header = fin.readline()
+                if header is None:
+                    header = sample_header
+                    fout.write(header)
+                elif sample_header != header:
+                    raise ValueError(f"Summary columns of {sample['sample_id']} do not match the other samples")
+                for line in fin:
+                    fout.write(line)
+            combined += 1
+    return combined
+
+
+def run():
+    args = parse_args()
+    output_dir = args.output
+    threads = max(1, args.threads)
+
+    if not os.path.isdir(output_dir):
+        os.mkdir(output_dir, 0o755)
+    elif not args.force and not args.resume:
+        print(f"Error: Directory {output_dir} already exists. Use --force to overwrite or --resume to continue an earlier run.", file=sys.stderr)
+        sys.exit()
+
+    log_filepath = os.path.join(output_dir, "batch.log")
+    logger = logging.getLogger("sequenoscope_batch")
+    logger.setLevel(logging.INFO)
+    fh = logging.FileHandler(log_filepath, mode='a' if args.resume else 'w')
+    fh.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s [%(levelname)s]: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
+
+    logger.info("Starting 'sequenoscope batch' module.")
+    logger.info(f"Version: {__version__}")
+
+    try:
+        samples = read_sample_sheet(args.sample_sheet)
+    except ValueError as e:
+        logger.error(str(e))
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if len(samples) == 0:
+        logger.error("Sample sheet contains no samples.")
+        print("Error: Sample sheet contains no samples.", file=sys.stderr)
+        sys.exit(1)
+
+    # Threads are divided evenly between the samples running at the same time.
+    workers = args.workers if args.workers else threads // DefaultValues.batch_threads_per_sample
+    workers = max(1, min(workers, len(samples), threads))
+    sample_threads = max(1, threads // workers)
+    index_cache = args.index_cache if args.index_cache else os.path.join(output_dir, "minimap2_index")
+
+    logger.info(f"Samples: {len(samples)}")
+    logger.info(f"Concurrent samples: {workers}")
+    logger.info(f"Threads per sample: {sample_threads}")
+    logger.info(f"Minimap2 index cache: {index_cache}")
+
+    print("-" * 40)
+    print(f"sequenoscope batch version {__version__}: Analyzing {len(samples)} samples, {workers} at a time with {sample_threads} threads each...")
+    print("-" * 40)
+
+    pipeline_start_time = time.time()
+
+    # Every sample runs in its own process so that the per-sample logging and tool state stay
+    # separate; the workers are forked so the analyze modules imported here are inherited.
+    mp_context = multiprocessing.get_context("fork")
+    pending = list(samples)
+    running = {}
+    failed = []
+    while pending or running:
+        while pending and len(running) < workers:
+            sample = pending.pop(0)
+            sample_dir = os.path.join(output_dir, sample['sample_id'])
+            argv = build_analyze_args(sample, args, sample_dir, sample_threads, index_cache)
+            process = mp_context.Process(target=run_sample, args=(argv,), name=sample['sample_id'])
+            process.start()
+            running[process.sentinel] = (process, sample, time.time())
+            logger.info(f"Sample {sample['sample_id']} started.")
+
+        for sentinel in wait(list(running)):
+            process, sample, start = running.pop(sentinel)
+            process.join()
+            runtime = format_time(time.time() - start)
+            summary_file = os.path.join(output_dir, sample['sample_id'], f"{sample['sample_id']}_manifest_summary.txt")
+            if process.exitcode == 0 and os.path.isfile(summary_file):
+                logger.info(f"Sample {sample['sample_id']} finished in {runtime}.")
+                print(f"{sample['sample_id']}: done ({runtime})")
+            else:
+                failed.append(sample['sample_id'])
+                logger.error(f"Sample {sample['sample_id']} failed with exit code {process.exitcode} after {runtime}; see its analyze.log.")
+                print(f"{sample['sample_id']}: failed ({runtime})", file=sys.stderr)
+
+    summary_file = os.path.join(output_dir, "batch_manifest_summary.txt")
+    combined = combine_summaries([s for s in samples if s['sample_id'] not in failed], output_dir, summary_file)
+    logger.info(f"Combined {combined} sample summaries into {summary_file}.")
+
+    total_runtime = format_time(time.time() - pipeline_start_time)
+    print("-" * 40)
+    print(f"Completed {len(samples) - len(failed)} of {len(samples)} samples.")
+    if failed:
+        print(f"Failed samples: {', '.join(failed)}", file=sys.stderr)
+    print(f"Total runtime: {total_runtime}")
+    print("-" * 40)
+    logger.info(f"Total runtime: {total_runtime}")
+    if failed:
+        logger.error(f"Failed samples: {', '.join(failed)}")
+        sys.exit(1)
+    logger.info("All operations are complete.")
+
+
+if __name__ == '__main__':
+    run()
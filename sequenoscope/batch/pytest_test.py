@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import argparse as ap
+import pytest
+from sequenoscope.batch.batch import read_sample_sheet, build_analyze_args, combine_summaries
+
+
+def write_sample_sheet(path, rows, header="sample_id\tfastq_1\tfastq_2\tsequencing_summary\tsequencing_type"):
+    with open(path, 'w') as f:
+        f.write(header + "\n")
+        for row in rows:
+            f.write("\t".join(row) + "\n")
+
+@pytest.fixture
+def fastq_files(tmp_path):
+    files = []
+    for name in ["s1.fastq", "s2_1.fastq", "s2_2.fastq"]:
+        (tmp_path / name).write_text("@read1\nACGT\n+\nIIII\n")
+        files.append(str(tmp_path / name))
+    return files
+
+def test_read_sample_sheet(tmp_path, fastq_files):
+    sample_sheet = str(tmp_path / "samples.tsv")
+    write_sample_sheet(sample_sheet, [("s1", fastq_files[0], "", "", "se"),
+                                      ("", "", "", "", ""),
+                                      ("s2", fastq_files[1], fastq_files[2], "summary.txt", "PE")])
+    samples = read_sample_sheet(sample_sheet)
+    assert samples == [{'sample_id': 's1', 'fastq': [fastq_files[0]], 'sequencing_summary': None, 'sequencing_type': 'SE'},
+                       {'sample_id': 's2', 'fastq': fastq_files[1:], 'sequencing_summary': 'summary.txt', 'sequencing_type': 'PE'}]
+
+def test_read_sample_sheet_missing_columns(tmp_path, fastq_files):
+    sample_sheet = str(tmp_path / "samples.tsv")
+    write_sample_sheet(sample_sheet, [("s1", fastq_files[0])], header="sample_id\tfastq_1")
+    with pytest.raises(ValueError, match="sequencing_type"):
+        read_sample_sheet(sample_sheet)
+
+@pytest.mark.parametrize("row, message", [
+    (("s1", "{0}", "", "", "PE"), "needs fastq_1 and fastq_2"),
+    (("s1", "{0}", "{1}", "", "SE"), "needs only fastq_1"),
+    (("s1", "{0}", "", "", "ONT"), "must be SE or PE"),
+    (("s1", "missing.fastq", "", "", "SE"), "does not exist"),
+])
+def test_read_sample_sheet_validates_samples(tmp_path, fastq_files, row, message):
+    sample_sheet = str(tmp_path / "samples.tsv")
+    write_sample_sheet(sample_sheet, [[field.format(*fastq_files) for field in row]])
+    with pytest.raises(ValueError, match=message):
+        read_sample_sheet(sample_sheet)
+
+def test_read_sample_sheet_duplicate_ids(tmp_path, fastq_files):
+    sample_sheet = str(tmp_path / "samples.tsv")
+    write_sample_sheet(sample_sheet, [("s1", fastq_files[0], "", "", "SE"), ("s1", fastq_files[1], "", "", "SE")])
+    with pytest.raises(ValueError, match="line 3: duplicate sample_id s1"):
+        read_sample_sheet(sample_sheet)
+
+def test_build_analyze_args():
+    args = ap.Namespace(input_reference="ref.fasta", minimum_coverage=2, minimum_read_length=15, maximum_read_length=0,
+                        trim_front_bp=0, trim_tail_bp=5, quality_threshold=15, manifest_format="tsv",
+                        coverage_thresholds=[5, 10], sparse_coverage=True, coverage_cache=None, force=False, resume=True)
+    sample = {'sample_id': 's2', 'fastq': ["s2_1.fastq", "s2_2.fastq"], 'sequencing_summary': None, 'sequencing_type': 'PE'}
+    argv = build_analyze_args(sample, args, "out/s2", 4, "out/minimap2_index")
+    assert argv == ["--input_fastq", "s2_1.fastq", "s2_2.fastq", "--input_reference", "ref.fasta", "-o", "out/s2",
+                    "-op", "s2", "-seq_type", "PE", "-t", "4", "-min_cov", "2", "-min_len", "15", "-max_len", "0",
+                    "-trm_fr", "0", "-trm_tail", "5", "-q", "15", "--index_cache", "out/minimap2_index",
+                    "--manifest_format", "tsv", "-cov_thresholds", "5", "10", "--sparse_coverage", "--resume"]
+
+    sample['sequencing_summary'] = "summary.txt"
+    args.coverage_thresholds = None
+    args.sparse_coverage = False
+    args.coverage_cache = "cache"
+    args.resume = False
+    args.force = True
+    argv = build_analyze_args(sample, args, "out/s2", 4, "out/minimap2_index")
+    assert argv[-5:] == ["-seq_sum", "summary.txt", "--coverage_cache", "cache", "--force"]
+
+def write_summary(output_dir, sample_id, text):
+    (output_dir / sample_id).mkdir()
+    (output_dir / sample_id / f"{sample_id}_manifest_summary.txt").write_text(text)
+
+def test_combine_summaries(tmp_path):
+    write_summary(tmp_path, "s1", "sample_id\ttaxon_id\ns1\tcontig1\ns1\tcontig2\n")
+    write_summary(tmp_path, "s3", "sample_id\ttaxon_id\ns3\tcontig1\n")
+    samples = [{'sample_id': sample_id} for sample_id in ["s1", "s2", "s3"]]
+    out_file = tmp_path / "batch_manifest_summary.txt"
+    assert combine_summaries(samples, str(tmp_path), str(out_file)) == 2
+    assert out_file.read_text() == "sample_id\ttaxon_id\ns1\tcontig1\ns1\tcontig2\ns3\tcontig1\n"
+
+def test_combine_summaries_header_mismatch(tmp_path):
+    write_summary(tmp_path, "s1", "sample_id\ttaxon_id\ns1\tcontig1\n")
+    write_summary(tmp_path, "s2", "sample_id\ttaxon_id\ttaxon_length\ns2\tcontig1\t100\n")
+    samples = [{'sample_id': sample_id} for sample_id in ["s1", "s2"]]
+    with pytest.raises(ValueError, match="s2"):
+        combine_summaries(samples, str(tmp_path), str(tmp_path / "batch_manifest_summary.txt"))
@@ -11,9 +11,22 @@ class SequenceTypes:
 class DefaultValues:
     minimap2_kmer_size: int = 15
     kat_hist_kmer_size: int = 27
-    nanoget_threshold: int = 128
-    samtools_idxstats_field_number: int = 4
     fastq_sample_row_number: int = 4
     fastq_line_starter: str = "@"
     phred_33_encoding_value: int = 33
-    max_nanopore_channel: int = 512
\ No newline at end of file
+    max_nanopore_channel: int = 512
+    bam_region_shard_size: int = 5000000
+    qscore_batch_size: int = 10000
+    samtools_sort_memory: str = "768M"
+    samtools_sort_thread_fraction: int = 4
+    batch_threads_per_sample: int = 4
+    manifest_batch_size: int = 100000
+    seq_summary_chunk_size: int = 500000
+    fastq_write_buffer_size: int = 1048576
+    watch_poll_interval: int = 60
+    watch_idle_timeout: int = 3600
+    mappy_batch_size: int = 2000
+    mash_kmer_size: int = 27
+    mash_sketch_size: int = 1000
+    mash_min_copies: int = 3
+    minhash_batch_bases: int = 4000000
\ No newline at end of file
@@ -4,7 +4,7 @@ import sys
 import time
 import logging
 import argparse as ap
-from sequenoscope.utils.__init__ import format_time
+from sequenoscope.utils.__init__ import format_time, open_file
 from sequenoscope.version import __version__
 from sequenoscope.utils.parser import GeneralSeqParser
 from sequenoscope.utils.sequence_class import Sequence
@@ -67,7 +67,7 @@ def count_fastq_reads(fastq_files):
     """Count total number of reads in one or more FASTQ files."""
     total_reads = 0
     for fq in fastq_files:
-        with open(fq, 'r') as f:
+        with open_file(fq, 'r') as f:
             # Each read occupies 4 lines in a standard FASTQ file
             lines = sum(1 for _ in f)
             total_reads += lines // 4
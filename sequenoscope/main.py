@@ -10,11 +10,13 @@ from sequenoscope.utils.__init__ import format_time
 
 modules = {
     'analyze': 'map reads to a target and produce a report with sequencing statistics',
+    'batch': 'run analyze on every sample of a sample sheet with a pool of workers',
+    'watch': 'follow a running ONT experiment and update the manifest and summary as reads arrive',
     'plot': 'generate plots based on seq manifest files',
     'filter_ONT': 'filter reads from a fastq file based on a sequencing summary file'
 }
 
-module_ordered = ['analyze', 'plot', 'filter_ONT']
+module_ordered = ['analyze', 'batch', 'watch', 'plot', 'filter_ONT']
 
 def print_usage_and_exit():
     print('Usage: sequenoscope <command> <required arguments>', file=sys.stderr)
@@ -24,7 +26,7 @@ def print_usage_and_exit():
     for command in module_ordered:
         print('{{0: <{}}}'.format(max_module_length).format(command), modules[command], sep=' ', file=sys.stderr)
     print('\nOther options:\n', file=sys.stderr)
-    print('--check_dependencies  Check if external dependencies (fastp, minimap2, samtools, mash, seqtk) and required Python packages (pysam, plotly) are available', file=sys.stderr)
+    print('--check_dependencies  Check if external dependencies (fastp, minimap2, samtools, seqtk) and required Python packages (pysam, plotly) are available', file=sys.stderr)
     print('-v, --version         Show the version and exit', file=sys.stderr)
     print('-h, --help            Show this help message and exit', file=sys.stderr)
     sys.exit(0)
@@ -34,7 +36,7 @@ def check_dependencies():
     Check if external dependencies and required Python packages are available.
     """
     # External command-line tools
-    required_tools = ["fastp", "minimap2", "samtools", "mash", "seqtk"]
+    required_tools = ["fastp", "minimap2", "samtools", "seqtk"]
 
     # Python packages
     required_packages = ["pysam", "plotly"]
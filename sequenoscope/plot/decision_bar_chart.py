@@ -2,6 +2,7 @@
 import pandas as pd
 import plotly.graph_objects as go
 import os
+from sequenoscope.plot.manifest_reader import read_manifest
 
 class DecisionBarBuilder():
     def __init__(self):
@@ -41,7 +42,7 @@ class IndependentDecisionStackedBarChart(DecisionBarBuilder):
         Load the data, convert start times, build a complete grid of time and decision, 
         and compute the percentage for each decision at each time.
         """
-        data = pd.read_csv(self.data_path, sep='\t')
+        data = read_manifest(self.data_path, columns=['start_time', 'decision'])
         data['start_time'] = pd.to_datetime(data['start_time'])
         self.total_count_2 = data.groupby('start_time').size().reset_index(name='total_count')
         all_decisions = pd.DataFrame({'decision': ['no_decision', 'stop_receiving', 'unblocked']})
@@ -65,7 +66,7 @@ class IndependentDecisionStackedBarChart(DecisionBarBuilder):
         """
         Resample the data to compute read counts in the specified time bins.
         """
-        df = pd.read_csv(self.data_path, sep='\t')
+        df = read_manifest(self.data_path, columns=['start_time', 'read_id'])
         df['start_time'] = pd.to_datetime(df['start_time'], unit='s')
         df.set_index('start_time', inplace=True)
         if self.time_bin_unit == "hours":
@@ -228,7 +229,7 @@ class CumulativeDecisionBarChart(DecisionBarBuilder):
         """
         Process the data to compute cumulative counts and percentages per decision over time.
         """
-        data = pd.read_csv(self.data_path, sep='\t')
+        data = read_manifest(self.data_path, columns=['start_time', 'decision'])
         data['start_time'] = pd.to_datetime(data['start_time'])
         self.total_count_2 = data.groupby('start_time').size().reset_index(name='total_count')
         all_decisions = pd.DataFrame({'decision': ['no_decision', 'stop_receiving', 'unblocked']})
@@ -248,7 +249,7 @@ class CumulativeDecisionBarChart(DecisionBarBuilder):
         self.decision_count = decision_count
 
     def create_trace(self):
-        df = pd.read_csv(self.data_path, sep='\t')
+        df = read_manifest(self.data_path, columns=['start_time', 'read_id'])
         df['start_time'] = pd.to_datetime(df['start_time'], unit='s')
         df.set_index('start_time', inplace=True)
         if self.time_bin_unit == "hours":
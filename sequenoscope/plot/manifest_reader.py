@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+import pandas as pd
+
+# Manifest file name endings in the order they are looked up
+MANIFEST_SUFFIXES = ('manifest.txt', 'manifest.parquet', 'manifest.feather')
+
+
+def is_manifest_file(file_name):
+    """
+    Returns:
+        bool:
+            True if file_name is a sample manifest in any of the supported formats
+    """
+    return file_name.endswith(MANIFEST_SUFFIXES) and 'summary' not in file_name
+
+
+def read_manifest(file_path, columns=None):
+    """
+    Reads a sample manifest written as tsv, parquet or feather. Dictionary-encoded columns of the
+    columnar formats are returned as plain values so the plots treat every format alike.
+
+    Arguments:
+        file_path: str
+            path to the manifest
+        columns: list
+            (optional) columns to read; all columns by default
+
+    Returns:
+        pd.DataFrame:
+            the manifest
+    """
+    if file_path.endswith('.parquet'):
+        df = pd.read_parquet(file_path, columns=columns)
+    elif file_path.endswith('.feather'):
+        df = pd.read_feather(file_path, columns=columns)
+    else:
+        return pd.read_csv(file_path, sep='\t', usecols=columns)
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
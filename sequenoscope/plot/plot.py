@@ -11,6 +11,7 @@ from sequenoscope.utils.__init__ import format_time
 from sequenoscope.plot.seq_manifest_plots import SeqManifestPlotter
 from sequenoscope.plot.summary_table import SummaryTable
 from sequenoscope.plot.violin_plot import ViolinPlotter
+from sequenoscope.plot.manifest_reader import is_manifest_file
 from sequenoscope.plot.decision_bar_chart import IndependentDecisionStackedBarChart, CumulativeDecisionBarChart
 from sequenoscope.version import __version__
 
@@ -110,13 +111,13 @@ def run():
     control_manifest_summary = None
 
     for f in os.listdir(test_dir):
-        if 'manifest.txt' in f and 'summary' not in f:
+        if is_manifest_file(f):
             test_manifest = os.path.join(test_dir, f)
         elif 'manifest_summary.txt' in f:
             test_manifest_summary = os.path.join(test_dir, f)
 
     for f in os.listdir(control_dir):
-        if 'manifest.txt' in f and 'summary' not in f:
+        if is_manifest_file(f):
             control_manifest = os.path.join(control_dir, f)
         elif 'manifest_summary.txt' in f:
             control_manifest_summary = os.path.join(control_dir, f)
@@ -2,6 +2,7 @@
 import pandas as pd
 import os
 import plotly.express as px
+from sequenoscope.plot.manifest_reader import read_manifest
 
 class ViolinBuilder():
     def __init__(self):
@@ -68,7 +69,7 @@ class ViolinPlotter(ViolinBuilder):
             Processed dataframe with the required columns for plotting.
         """
         # Read the file and add source_file column
-        df = pd.read_csv(file_path, delimiter='\t')
+        df = read_manifest(file_path)
         df['source_file'] = source_file
 
         # Check if quality_metric column exists in the dataframe
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 from subprocess import Popen, PIPE
+from contextlib import contextmanager
 import os
+import io
+import gzip
+import shutil
 import hashlib
 
 def run_command(command):
@@ -13,6 +17,41 @@ def run_command(command):
 def is_non_zero_file(fpath):  
     return os.path.isfile(fpath) and os.path.getsize(fpath) > 0
 
+def is_gzipped(fpath):
+    return fpath.endswith(".gz")
+
+@contextmanager
+def open_file(fpath, mode="r"):
+    """
+    Opens a plain or gzip-compressed file for streaming reads, in text ('r') or binary ('rb') mode.
+    Compressed files are never written back to disk; decompression uses isal when installed,
+    then pigz when on the PATH, and falls back to the gzip module.
+    """
+    if not is_gzipped(fpath):
+        with open(fpath, mode) as f:
+            yield f
+        return
+
+    binary = "b" in mode
+    try:
+        from isal import igzip as gzip_reader
+    except ImportError:
+        gzip_reader = None
+
+    if gzip_reader is None and shutil.which("pigz") is not None:
+        p = Popen(["pigz", "-dc", fpath], stdout=PIPE)
+        try:
+            yield p.stdout if binary else io.TextIOWrapper(p.stdout)
+        finally:
+            if p.poll() is None:
+                p.kill()
+            p.stdout.close()
+            p.wait()
+        return
+
+    with (gzip_reader or gzip).open(fpath, "rb" if binary else "rt") as f:
+        yield f
+
 def compute_sha256(file_name):
     hash_sha256 = hashlib.sha256()
     with open(file_name, "rb") as f:
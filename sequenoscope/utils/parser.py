@@ -1,12 +1,12 @@
 #!/usr/bin/env python
 from __future__ import print_function
-from sequenoscope.utils.__init__ import is_non_zero_file
+from sequenoscope.utils.__init__ import is_non_zero_file, open_file
+from sequenoscope.constant import DefaultValues
 import pandas as pd
 import warnings
 import json
 import re
 import os
-import sys
 import warnings
 warnings.simplefilter('always', UserWarning)
 
@@ -116,19 +116,26 @@ class fastq_parser:
         self.filepath = filepath
 
     def parse(self):
-        filepath  = self.filepath
-        if self.REGEX_GZIPPED.match(filepath):
-            # using os.popen with zcat since it is much faster than gzip.open or gzip.open(io.BufferedReader)
-            # http://aripollak.com/pythongzipbenchmarks/
-            # assumes Linux os with zcat installed
-            with os.popen('zcat < {}'.format(filepath)) as f:
-                yield from self.parse_fastq(f)
-        else:
-            with open(filepath, 'r') as f:
-                yield from self.parse_fastq(f)
+        # gzipped files are stream-decompressed by open_file
+        with open_file(self.filepath, 'r') as f:
+            yield from self.parse_fastq(f)
         return
 
 
+    def parse_read_ids(self):
+        """
+        Streams only the read ids of the fastq file; sequence, separator and quality lines are
+        skipped without being decoded.
+        """
+        with open_file(self.filepath, 'rb') as f:
+            for header in f:
+                f.readline()
+                f.readline()
+                f.readline()
+                if header[:1] == b"@":
+                    yield header[1:].split(None, 1)[0].decode()
+        return
+
     def parse_fastq(self,f):
 
         record = []
@@ -147,106 +154,126 @@ class FastqPairedEndRenamer:
     out_dir = None
     read_set = None
     status = False
-    result_files = {"fastq_file_renamed":[]}
+    read_list_prefix = None
+    result_files = {"fastq_file_renamed":[], "read_list_file":"", "read_table_file":""}
 
-    def __init__(self, read_set, read_file, out_dir, out_prefix):
+    def __init__(self, read_set, out_dir, out_prefix, buffer_size=DefaultValues.fastq_write_buffer_size,
+                 read_list_prefix=None, batch_size=DefaultValues.qscore_batch_size):
         """
         Initalize the class with read_set, out_prefix, and out_dir
 
         Arguments:
             read_set: sequence object
                 an object that contains the list of sequence files for analysis
-            read_file: str
-                path with the list of extracted reads from original fastq files
             out_prefix: str
                 a designation of what the output files will be named
             out_dir: str
                 a string to the path where the output files will be stored
+            buffer_size: int
+                size in bytes of the output file buffers
+            read_list_prefix: str
+                (optional) a designation of what the read list and read table will be named,
+                default is <out_prefix>_read_list
+            batch_size: int
+                number of reads whose quality scores are computed together, default is 10000
         """
         self.out_prefix = out_prefix
         self.out_dir = out_dir
         self.read_set = read_set
-        self.read_file = read_file
-        self.read_list = set()
-        self.read_id_list()
+        self.buffer_size = buffer_size
+        self.read_list_prefix = read_list_prefix if read_list_prefix is not None else f"{out_prefix}_read_list"
+        self.batch_size = batch_size
+        self.result_files = {"fastq_file_renamed":[], "read_list_file":"", "read_table_file":""}
 
-    def read_id_list(self):
+    @staticmethod
+    def parse_records(f, allow_empty=False, full_header=False):
         """
-        Extracts all read ids from the read file into a set
+        Streams the records of a binary fastq file as (name, sequence, quality) bytes, where name is
+        the header up to the first space. Sequence and quality may be wrapped over several lines.
+
+        Arguments:
+            f: file
+                fastq file opened in binary mode
+            allow_empty: bool
+                yield zero-length reads instead of rejecting them
+            full_header: bool
+                yield the whole header line, comments included, as the name
+
+        Raises:
+            ValueError: if a record is not in FASTQ format
         """
-        with open(self.read_file, 'r') as f:
-            for read_id in f:
-                self.read_list.add(read_id)
+        for header in f:
+            if not header.strip():
+                continue
+            name = header.rstrip()
+            if not full_header:
+                name = name.split(b" ", 1)[0]
+            seq_lines = []
+            line = f.readline()
+            while line and line[:1] != b"+":
+                seq_lines.append(line.rstrip())
+                line = f.readline()
+            seq = b"".join(seq_lines)
+            qual_lines = []
+            qual_len = 0
+            while qual_len < len(seq):
+                line = f.readline()
+                if not line:
+                    break
+                qual_lines.append(line.rstrip())
+                qual_len += len(qual_lines[-1])
+            qual = b"".join(qual_lines)
+            if len(name) <= 1 or (len(seq) == 0 and not allow_empty) or len(seq) != len(qual):
+                raise ValueError("File is not in FASTQ format")
+            yield name, seq, qual
 
     def rename(self):
         """
-        creates a copy of each fastq files, extracts the name of the read id and sequence information,
-        appends 1 or 2 to the end of the read id name, and checks if the file was created
+        Streams each fastq file into a renamed copy, appending the mate number 1 or 2 to the end of
+        every read id. The same pass writes the read list and read table of the renamed reads in the
+        format of FastqScanner, so paired-end reads need no separate scan. A read id seen twice in the
+        first file gets the mate number 2 the second time.
 
-        Returns:
-            bool:
-                returns True if the generated output file is found and not empty, False otherwise
+        Raises:
+            ValueError: if an output file was not created or is empty
         """
-        for file_num in [0, 1]:
-            line_id = 0
-            name = ''
-            data = ''
-            qual = ''
-            valid = False
-            out_file = open(f"{self.out_dir}/{self.out_prefix}_{file_num+1}.fastq", "w")
-            fastq_out_file = os.path.join(self.out_dir,"{}_{}.fastq".format(self.out_prefix, file_num+1))
-            self.result_files["fastq_file_renamed"].append(fastq_out_file)
-            with open(self.read_set.files[file_num], 'r') as f:
-                for line in f:
-                    if (line_id == 0):
-                        if (valid):
-                            if (len(name) == 0 or len(data) == 0 or len(data) != len(qual)):
-                                print('File is not in FASTQ format')
-                                sys.exit(1)
-                            valid = False
-                            if (name in self.read_list):
-                                out_file.write(name + '2\n')
-                            else:
-                                self.read_list.add(name)
-                                out_file.write(name + f'{file_num+1}\n')
-                            out_file.write(data + '\n')
-                            out_file.write('+' + '\n')
-                            out_file.write(qual + '\n')
-                        name = line.rstrip().split(' ')[0]
-                        data = ''
-                        qual = ''
-                        line_id = 1
-                    elif (line_id == 1):
-                        if (line[0] == '+'):
-                            line_id = 2
-                        else:
-                            data += line.rstrip()
-                    elif (line_id == 2):
-                        qual += line.rstrip()
-                        if (len(qual) >= len(data)):
-                            valid = True
-                            line_id = 0
-
-            if (valid):
-                if (len(name) == 0 or len(data) == 0 or len(data) != len(qual)):
-                    print(len(name), len(data), len(qual))
-                    print('File is not in FASTQ format')
-                    sys.exit(1)
-                if (name in self.read_list):
-                    out_file.write(name + '2\n')
-                else:
-                    self.read_list.add(name)
-                    out_file.write(name + f'{file_num+1}\n')
-                    out_file.write(data + '\n')
-                    out_file.write('+' + '\n')
-                    out_file.write(qual + '\n')
-
-            self.status = self.check_files(fastq_out_file)
-            if self.status == False:
-                self.error_messages = "one or more files was not created or was empty, check error message\n{}".format(self.stderr)
-                raise ValueError(str(self.error_messages))
-
-            out_file.close()
+        # Imported here as the analyze package imports this module
+        from sequenoscope.analyze.fastq_scanner import FastqScanner
+
+        read_list_file = os.path.join(self.out_dir, f"{self.read_list_prefix}.txt")
+        read_table_file = os.path.join(self.out_dir, f"{self.read_list_prefix}_table.bin")
+        self.result_files["read_list_file"] = read_list_file
+        self.result_files["read_table_file"] = read_table_file
+        # Only the first file needs duplicate checks; every read of the second file is mate 2
+        seen_ids = set()
+        with open(read_list_file, "wb", buffering=self.buffer_size) as read_list, \
+                open(read_table_file, "wb") as read_table:
+            read_list.write(b"read_id\n")
+            for file_num in [0, 1]:
+                fastq_out_file = os.path.join(self.out_dir, "{}_{}.fastq".format(self.out_prefix, file_num+1))
+                self.result_files["fastq_file_renamed"].append(fastq_out_file)
+                read_ids, lengths, quals = [], [], []
+                with open_file(self.read_set.files[file_num], "rb") as fin, \
+                        open(fastq_out_file, "wb", buffering=self.buffer_size) as fout:
+                    for name, seq, qual in self.parse_records(fin):
+                        mate = b"2"
+                        if file_num == 0 and name not in seen_ids:
+                            seen_ids.add(name)
+                            mate = b"1"
+                        fout.write(b"".join((name, mate, b"\n", seq, b"\n+\n", qual, b"\n")))
+                        read_ids.append(name[1:] + mate)
+                        lengths.append(len(seq))
+                        quals.append(qual)
+                        if len(quals) >= self.batch_size:
+                            FastqScanner.write_batch(read_ids, lengths, quals, read_list, read_table)
+                            read_ids, lengths, quals = [], [], []
+                FastqScanner.write_batch(read_ids, lengths, quals, read_list, read_table)
+                seen_ids.clear()
+
+        self.status = self.check_files(self.result_files["fastq_file_renamed"] + [read_list_file])
+        if self.status == False:
+            self.error_messages = "one or more files was not created or was empty"
+            raise ValueError(str(self.error_messages))
 
     def check_files(self, files_to_check):
         """
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+import os
+import sys
+import gzip
+import types
+import array
+import random
+from math import log
+import pytest
+import numpy as np
+from sequenoscope.utils.__init__ import open_file
+from sequenoscope.utils.parser import FastqPairedEndRenamer
+from sequenoscope.utils.sequence_class import Sequence
+from sequenoscope.analyze.fastq_scanner import FastqScanner
+from sequenoscope.utils.qscore import as_quality_array, mean_qscore, mean_qscore_phred33, batch_mean_qscores
+
+
+def per_char_mean_qscore(qual_string):
+    """The mean qscore as computed before the lookup table, one character at a time."""
+    qual = [ord(c) - 33 for c in qual_string]
+    if not qual:
+        return 0
+    avg_error = sum(10 ** (q / -10) for q in qual) / len(qual)
+    return -10 * log(avg_error, 10)
+
+def random_quality_strings(seed=3):
+    rng = random.Random(seed)
+    return [''.join(chr(rng.randrange(33, 127)) for _ in range(rng.randrange(0, 200))) for _ in range(100)] + ["", "!", "~" * 10]
+
+def test_mean_qscore_matches_per_char_formula():
+    for qual_string in random_quality_strings():
+        expected = per_char_mean_qscore(qual_string)
+        assert mean_qscore_phred33(qual_string) == pytest.approx(expected)
+        assert mean_qscore(qual_string.encode(), 33) == pytest.approx(expected)
+        # pysam query_qualities hold the Phred scores without offset
+        assert mean_qscore(array.array('B', [ord(c) - 33 for c in qual_string])) == pytest.approx(expected)
+
+def test_batch_mean_qscores_matches_per_char_formula():
+    quals = random_quality_strings()
+    expected = [per_char_mean_qscore(qual_string) for qual_string in quals]
+    assert batch_mean_qscores(quals) == pytest.approx(expected)
+    assert batch_mean_qscores([qual.encode() for qual in quals]) == pytest.approx(expected)
+    assert len(batch_mean_qscores([])) == 0
+
+def test_quality_below_offset():
+    with pytest.raises(ValueError):
+        mean_qscore_phred33("II I")
+    with pytest.raises(ValueError):
+        batch_mean_qscores(["IIII", "II\x1fI"])
+    assert np.array_equal(as_quality_array("+5I", 33), [10, 20, 40])
+
+@pytest.fixture
+def gzip_file(tmp_path):
+    with gzip.open(tmp_path / "reads.fastq.gz", "wt") as f:
+        f.write("@read1\nACGT\n+\nIIII\n")
+    return str(tmp_path / "reads.fastq.gz")
+
+@pytest.fixture
+def decompressors(tmp_path, monkeypatch):
+    """Puts a pigz on the PATH and hides isal; both log their use to calls.txt."""
+    calls = tmp_path / "calls.txt"
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    pigz = bin_dir / "pigz"
+    pigz.write_text(f"#!{sys.executable}\nimport sys, gzip, shutil\n"
+                    f"open({str(calls)!r}, 'a').write('pigz\\n')\n"
+                    "shutil.copyfileobj(gzip.open(sys.argv[-1], 'rb'), sys.stdout.buffer)\n")
+    pigz.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_dir))
+    monkeypatch.setitem(sys.modules, "isal", None)
+
+    def isal_open(path, mode):
+        with open(calls, "a") as f:
+            f.write("isal\n")
+        return gzip.open(path, mode)
+    isal = types.ModuleType("isal")
+    isal.igzip = types.SimpleNamespace(open=isal_open)
+
+    def read_with(fpath, mode):
+        calls.write_text("")
+        with open_file(fpath, mode) as f:
+            content = f.read()
+        return content, calls.read_text().split()
+    return read_with, isal, bin_dir
+
+def test_open_file_prefers_isal(gzip_file, decompressors, monkeypatch):
+    read_with, isal, _ = decompressors
+    monkeypatch.setitem(sys.modules, "isal", isal)
+    assert read_with(gzip_file, "r") == ("@read1\nACGT\n+\nIIII\n", ["isal"])
+    assert read_with(gzip_file, "rb") == (b"@read1\nACGT\n+\nIIII\n", ["isal"])
+
+def test_open_file_falls_back_to_pigz(gzip_file, decompressors):
+    read_with, _, _ = decompressors
+    assert read_with(gzip_file, "r") == ("@read1\nACGT\n+\nIIII\n", ["pigz"])
+    assert read_with(gzip_file, "rb") == (b"@read1\nACGT\n+\nIIII\n", ["pigz"])
+
+def test_open_file_falls_back_to_gzip(gzip_file, decompressors):
+    read_with, _, bin_dir = decompressors
+    os.remove(bin_dir / "pigz")
+    assert read_with(gzip_file, "r") == ("@read1\nACGT\n+\nIIII\n", [])
+    assert read_with(gzip_file, "rb") == (b"@read1\nACGT\n+\nIIII\n", [])
+    # plain files are opened as they are
+    plain_file = gzip_file[:-len(".gz")]
+    with open(plain_file, "w") as f:
+        f.write("@read1\n")
+    assert read_with(plain_file, "r") == ("@read1\n", [])
+
+def line_by_line_rename(fastq_file, file_num, seen):
+    """The renaming done before the streaming renamer, one text line at a time."""
+    out = []
+    name, data, qual, line_id = '', '', '', 0
+    with open(fastq_file) as f:
+        lines = f.readlines() + ['@']
+    for line in lines:
+        if line_id == 0:
+            if name:
+                out.append(name + ('2' if name in seen else str(file_num + 1)) + '\n' + data + '\n+\n' + qual + '\n')
+                seen.add(name)
+            name = line.rstrip().split(' ')[0]
+            data, qual, line_id = '', '', 1
+        elif line_id == 1:
+            if line[0] == '+':
+                line_id = 2
+            else:
+                data += line.rstrip()
+        elif line_id == 2:
+            qual += line.rstrip()
+            if len(qual) >= len(data):
+                line_id = 0
+    return ''.join(out)
+
+def write_paired_fastq(tmp_path, seed=5):
+    rng = random.Random(seed)
+    mates = ([], [])
+    for i in range(40):
+        for mate in mates:
+            seq = ''.join(rng.choice("ACGT") for _ in range(rng.randrange(20, 90)))
+            qual = ''.join(chr(rng.randrange(35, 75)) for _ in seq)
+            # long reads are wrapped over several lines
+            if len(seq) > 70:
+                seq, qual = seq[:60] + "\n" + seq[60:], qual[:60] + "\n" + qual[60:]
+            read_id = "read3" if i == 7 and mate is mates[0] else f"read{i}"
+            mate.append(f"@{read_id} runid=abc ch={i}\n{seq}\n+\n{qual}\n")
+    paths = []
+    for mate_num, mate in enumerate(mates):
+        paths.append(str(tmp_path / f"reads_{mate_num + 1}.fastq"))
+        with open(paths[-1], 'w') as f:
+            f.write("".join(mate))
+    return paths
+
+def test_paired_end_renamer_matches_line_by_line_rename(tmp_path):
+    fastq_files = write_paired_fastq(tmp_path)
+    seen = set()
+    expected = [line_by_line_rename(fastq_file, file_num, seen) for file_num, fastq_file in enumerate(fastq_files)]
+    # a read id seen twice in the first file gets the mate number 2 the second time
+    assert "@read32\n" in expected[0] and "@read31\n" in expected[0]
+
+    with open(fastq_files[1], 'rb') as fin, gzip.open(fastq_files[1] + ".gz", 'wb') as fout:
+        fout.write(fin.read())
+    for inputs in [fastq_files, [fastq_files[0], fastq_files[1] + ".gz"]]:
+        out_dir = tmp_path / os.path.basename(inputs[1]).replace(".", "_")
+        out_dir.mkdir()
+        renamer = FastqPairedEndRenamer(Sequence("Illumina", inputs), str(out_dir), "renamed", batch_size=16)
+        renamer.rename()
+        for renamed_file, expected_text in zip(renamer.result_files["fastq_file_renamed"], expected):
+            with open(renamed_file) as f:
+                assert f.read() == expected_text
+
+        # the read list and table written in the same pass match a scan of the renamed files
+        scanner = FastqScanner(Sequence("Illumina", renamer.result_files["fastq_file_renamed"]), "scanned", str(out_dir))
+        scanner.scan()
+        with open(renamer.result_files["read_list_file"]) as f, open(scanner.result_files["read_list_file"]) as g:
+            assert f.read() == g.read()
+        assert np.array_equal(FastqScanner.load_read_table(renamer.result_files["read_table_file"]),
+                              FastqScanner.load_read_table(scanner.result_files["read_table_file"]))
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+import array
+import numpy as np
+from sequenoscope.constant import DefaultValues
+
+# Error probability of every possible Phred score, indexed by the raw quality byte.
+# Follows the nanoget approach: github.com/wdecoster/nanoget/blob/master/nanoget/utils.py
+ERROR_PROB_TABLE = np.power(10.0, np.arange(256) / -10)
+
+
+def as_quality_array(qual, offset=0):
+    """
+    Returns a uint8 view of quality values without copying where possible.
+
+    Arguments:
+        qual: bytes, str, array.array, numpy.ndarray or list
+            Phred scores (offset=0, e.g. pysam query_qualities or a list of ints) or an encoded quality line
+        offset: int
+            encoding offset to remove, e.g. 33 for FASTQ quality lines
+
+    Returns:
+        numpy.ndarray:
+            uint8 array of Phred scores
+    """
+    if isinstance(qual, str):
+        qual = qual.encode("ascii")
+    if isinstance(qual, np.ndarray):
+        values = qual.astype(np.uint8, copy=False)
+    elif isinstance(qual, (bytes, bytearray, memoryview)) or (isinstance(qual, array.array) and qual.typecode == "B"):
+        values = np.frombuffer(qual, dtype=np.uint8)
+    else:
+        values = np.asarray(qual, dtype=np.uint8)
+    if offset:
+        if len(values) > 0 and values.min() < offset:
+            raise ValueError(f"quality values below the encoding offset of {offset}")
+        values = values - np.uint8(offset)
+    return values
+
+
+def mean_qscore(qual, offset=0):
+    """
+    Calculates the mean quality score of a read. Phred scores are converted to error
+    probabilities through a lookup table, averaged, and converted back to the Phred scale.
+
+    Arguments:
+        qual: bytes, str, array.array or numpy.ndarray
+            quality values of the read
+        offset: int
+            encoding offset of the quality values, 0 for Phred scores and 33 for FASTQ lines
+
+    Returns:
+        float:
+            mean qscore, 0 for reads without qualities
+    """
+    if qual is None or len(qual) == 0:
+        return 0
+    values = as_quality_array(qual, offset)
+    return float(-10 * np.log10(ERROR_PROB_TABLE[values].mean()))
+
+
+def mean_qscore_phred33(qual):
+    """Mean quality score of a Phred+33 encoded FASTQ quality line."""
+    return mean_qscore(qual, DefaultValues.phred_33_encoding_value)
+
+
+def batch_mean_qscores(quals, offset=DefaultValues.phred_33_encoding_value):
+    """
+    Calculates the mean quality score of many reads at once by concatenating their
+    qualities and reducing the error probabilities per read.
+
+    Arguments:
+        quals: list
+            quality values of each read as bytes or str
+        offset: int
+            encoding offset of the quality values, default is Phred+33
+
+    Returns:
+        numpy.ndarray:
+            float64 array of mean qscores, 0 for reads without qualities
+    """
+    if len(quals) == 0:
+        return np.zeros(0, dtype=np.float64)
+    quals = [qual.encode("ascii") if isinstance(qual, str) else bytes(qual) for qual in quals]
+    lengths = np.fromiter((len(qual) for qual in quals), dtype=np.int64, count=len(quals))
+    result = np.zeros(len(quals), dtype=np.float64)
+    non_empty = lengths > 0
+    if not non_empty.any():
+        return result
+    values = as_quality_array(b"".join(quals), offset)
+    boundaries = np.concatenate(([0], np.cumsum(lengths[non_empty])[:-1]))
+    error_sums = np.add.reduceat(ERROR_PROB_TABLE[values], boundaries)
+    result[non_empty] = -10 * np.log10(error_sums / lengths[non_empty])
+    return result
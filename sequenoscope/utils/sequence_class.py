@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+from sequenoscope.utils.__init__ import open_file
 
 class Sequence:
     technology = None
@@ -21,7 +22,7 @@ class Sequence:
             self.is_paired = True
 
     def is_fastq(self, input):
-        with open(input, "r") as f:
+        with open_file(input, "r") as f:
             first_line = f.readline().strip()
             if not first_line.startswith("@"):
                 return False
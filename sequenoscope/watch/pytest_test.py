@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+import logging
+import argparse as ap
+import pytest
+from sequenoscope.watch.summary_tail import SequencingSummaryTail
+from sequenoscope.watch.watch import LiveAnalysis, find_fastq_chunks, run_finished
+
+
+def write_summary(path, text, mode='a'):
+    with open(path, mode) as f:
+        f.write(text)
+
+def test_summary_tail_leaves_partial_line(tmp_path):
+    summary_file = str(tmp_path / "sequencing_summary.txt")
+    write_summary(summary_file, "filename\tread_id\tstart_time\nf0\tread1\t1.0\nf0\tre", mode='w')
+    tail = SequencingSummaryTail(summary_file)
+    assert tail.update() == 1
+    assert tail.header == "filename\tread_id\tstart_time"
+    assert list(tail.rows) == ["read1"]
+
+    write_summary(summary_file, "ad2\t2.0\n")
+    assert tail.update() == 1
+    assert tail.rows["read2"] == "f0\tread2\t2.0"
+    assert tail.update() == 0
+
+def test_summary_tail_waits_for_header(tmp_path):
+    summary_file = str(tmp_path / "sequencing_summary.txt")
+    tail = SequencingSummaryTail(summary_file)
+    assert tail.update() == 0
+    write_summary(summary_file, "filename\tread_id", mode='w')
+    assert tail.update() == 0
+    assert tail.header is None
+    write_summary(summary_file, "\n")
+    tail.update()
+    assert tail.header == "filename\tread_id"
+
+def test_summary_tail_requires_read_id(tmp_path):
+    summary_file = str(tmp_path / "sequencing_summary.txt")
+    write_summary(summary_file, "filename\tstart_time\nf0\t1.0\n", mode='w')
+    with pytest.raises(ValueError):
+        SequencingSummaryTail(summary_file).update()
+
+def test_summary_tail_write_rows(tmp_path):
+    summary_file = str(tmp_path / "sequencing_summary.txt")
+    write_summary(summary_file, "read_id\tstart_time\nread1\t1.0\nread2\t2.0\nread3\t3.0\n", mode='w')
+    tail = SequencingSummaryTail(summary_file)
+    tail.update()
+    assert tail.missing_reads(["read1", "read3", "read4"]) == 1
+
+    chunk_summary = str(tmp_path / "chunk_summary.txt")
+    tail.write_rows(["read3", "read1", "read4"], chunk_summary)
+    with open(chunk_summary) as f:
+        assert f.read() == "read_id\tstart_time\nread3\t3.0\nread1\t1.0\n"
+    assert list(tail.rows) == ["read2"]
+
+def test_summary_tail_prune(tmp_path):
+    summary_file = str(tmp_path / "sequencing_summary.txt")
+    write_summary(summary_file, "read_id\nfail1\npass1\n", mode='w')
+    tail = SequencingSummaryTail(summary_file)
+    tail.update()
+    write_summary(summary_file, "fail2\npass2\n")
+    tail.update()
+    assert tail.generation == 2
+
+    tail.write_rows(["pass1"], str(tmp_path / "chunk_summary.txt"))
+    assert tail.prune(2) == 1
+    assert sorted(tail.rows) == ["fail2", "pass2"]
+    assert tail.prune(2) == 0
+
+def test_find_fastq_chunks(tmp_path):
+    fastq_pass = tmp_path / "run" / "fastq_pass"
+    (fastq_pass / "barcode01").mkdir(parents=True)
+    (fastq_pass / "barcode01" / "c0.fastq").write_text("@r1\nACGT\n+\nIIII\n")
+    (fastq_pass / "barcode01" / "c1.fastq.gz").write_bytes(b"")
+    (fastq_pass / "c0.txt").write_text("not a fastq file")
+    chunks = find_fastq_chunks(str(fastq_pass))
+    assert chunks == {str(fastq_pass / "barcode01" / "c0.fastq"): 16, str(fastq_pass / "barcode01" / "c1.fastq.gz"): 0}
+
+    assert not run_finished(str(fastq_pass))
+    (tmp_path / "run" / "final_summary_FAW13613.txt").write_text("")
+    assert run_finished(str(fastq_pass))
+
+def test_prune_summary_keeps_pending_chunks(tmp_path):
+    summary_file = str(tmp_path / "sequencing_summary.txt")
+    write_summary(summary_file, "read_id\nfail1\n", mode='w')
+    args = ap.Namespace(output=str(tmp_path), output_prefix="sample", index_cache=None,
+                        sequencing_summary=summary_file, minimum_coverage=1)
+    live = LiveAnalysis(args, logging.getLogger(__name__))
+    live.summary_tail.update()
+
+    # chunk1 shows up while its reads are still being written
+    live.prune_summary(["chunk1"], set())
+    write_summary(summary_file, "pass1\nfail2\n")
+    live.summary_tail.update()
+    write_summary(summary_file, "pass2\n")
+    live.summary_tail.update()
+    live.prune_summary(["chunk1"], set())
+    assert sorted(live.summary_tail.rows) == ["fail1", "fail2", "pass1", "pass2"]
+
+    # once chunk1 is analyzed only the rows of the last generations are kept for files to come
+    live.summary_tail.write_rows(["pass1"], str(tmp_path / "chunk1_summary.txt"))
+    live.prune_summary(["chunk1"], {"chunk1"})
+    assert sorted(live.summary_tail.rows) == ["fail2", "pass2"]
+
+def test_append_manifest_drops_partial_chunks(tmp_path, monkeypatch):
+    args = ap.Namespace(output=str(tmp_path), output_prefix="sample", index_cache=None,
+                        sequencing_summary=None, minimum_coverage=1)
+    live = LiveAnalysis(args, logging.getLogger(__name__))
+    with open(live.manifest_file) as f:
+        header = f.read()
+    chunk1 = tmp_path / "chunk1_manifest.txt"
+    chunk1.write_text(header + "sample\tread1\n")
+    live.append_manifest(str(chunk1))
+
+    def interrupted_copy(fin, fout):
+        fout.write(fin.read()[:5])
+        raise KeyboardInterrupt
+    chunk2 = tmp_path / "chunk2_manifest.txt"
+    chunk2.write_text(header + "sample\tread2\n")
+    monkeypatch.setattr("sequenoscope.watch.watch.shutil.copyfileobj", interrupted_copy)
+    with pytest.raises(KeyboardInterrupt):
+        live.append_manifest(str(chunk2))
+    monkeypatch.undo()
+    with open(live.manifest_file) as f:
+        assert f.read() == header + "sample\tread1\n"
+
+    live.append_manifest(str(chunk2))
+    with open(live.manifest_file) as f:
+        assert f.read() == header + "sample\tread1\nsample\tread2\n"
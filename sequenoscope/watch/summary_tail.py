@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+import os
+from collections import deque
+
+
+class SequencingSummaryTail:
+    summary_file = None
+    delim = "\t"
+    header = None
+    offset = 0
+    generation = 0
+    rows = {}
+
+    def __init__(self, summary_file, delim="\t"):
+        """
+        Initalize the class with a sequencing summary that is still being written
+
+        Arguments:
+            summary_file: str
+                path to the growing sequencing summary
+            delim: str
+                column delimiter of the sequencing summary
+        """
+        self.summary_file = summary_file
+        self.delim = delim
+        self.header = None
+        self.read_id_column = None
+        self.offset = 0
+        self.generation = 0
+        self.rows = {}
+        self.generations = deque()
+
+    def update(self):
+        """
+        Reads the complete lines appended since the last update; a trailing partial line is left
+        for the next update. Rows are kept by read id until they are written with write_rows or
+        dropped with prune; every update that reads lines starts a new generation.
+
+        Returns:
+            int:
+                number of new rows
+        """
+        if not os.path.isfile(self.summary_file):
+            return 0
+        with open(self.summary_file, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n")
+        if end < 0:
+            return 0
+        self.offset += end + 1
+        self.generation += 1
+        lines = data[:end].decode().split("\n")
+        if self.header is None:
+            self.header = lines.pop(0).rstrip("\r")
+            columns = self.header.split(self.delim)
+            if 'read_id' not in columns:
+                raise ValueError(f"Sequencing summary {self.summary_file} has no read_id column")
+            self.read_id_column = columns.index('read_id')
+        read_ids = []
+        for line in lines:
+            fields = line.split(self.delim)
+            if len(fields) > self.read_id_column:
+                self.rows[fields[self.read_id_column]] = line.rstrip("\r")
+                read_ids.append(fields[self.read_id_column])
+        self.generations.append((self.generation, read_ids))
+        return len(lines)
+
+    def prune(self, generation):
+        """
+        Drops the rows read before the given generation that were not written yet, e.g. rows of
+        reads that went to fastq_fail and are never part of a chunk
+
+        Arguments:
+            generation: int
+                the oldest generation to keep
+
+        Returns:
+            int:
+                number of dropped rows
+        """
+        dropped = 0
+        while self.generations and self.generations[0][0] < generation:
+            for read_id in self.generations.popleft()[1]:
+                if self.rows.pop(read_id, None) is not None:
+                    dropped += 1
+        return dropped
+
+    def missing_reads(self, read_ids):
+        """
+        Returns:
+            int:
+                number of the given reads without a row yet
+        """
+        return sum(1 for read_id in read_ids if read_id not in self.rows)
+
+    def write_rows(self, read_ids, out_file):
+        """
+        Writes the header and the rows of the given reads to a sequencing summary of their own,
+        and releases those rows
+
+        Arguments:
+            read_ids: list
+                ids of the reads to write
+            out_file: str
+                path of the new sequencing summary
+        """
+        with open(out_file, 'w') as fout:
+            fout.write(self.header + "\n")
+            for read_id in read_ids:
+                row = self.rows.pop(read_id, None)
+                if row is not None:
+                    fout.write(row + "\n")
@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+import os
+import sys
+import glob
+import time
+import shutil
+import logging
+import argparse as ap
+
+from sequenoscope.utils.__init__ import format_time
+from sequenoscope.constant import DefaultValues
+from sequenoscope.version import __version__
+from sequenoscope.utils.parser import GeneralSeqParser
+from sequenoscope.utils.sequence_class import Sequence
+from sequenoscope.analyze.fastP import FastPRunner
+from sequenoscope.analyze.minimap2 import Minimap2Runner
+from sequenoscope.analyze.fastq_scanner import FastqScanner
+from sequenoscope.analyze.minhash import MinHashSketcher
+from sequenoscope.analyze.seq_manifest import SeqManifest, SeqManifestSummary
+from sequenoscope.analyze.live_bam import IncrementalBamProcessor
+from sequenoscope.watch.summary_tail import SequencingSummaryTail
+
+# File name endings of the read chunks written by MinKNOW
+FASTQ_SUFFIXES = ('.fastq', '.fq', '.fastq.gz', '.fq.gz')
+
+
+def parse_args(argv=None):
+    parser = ap.ArgumentParser(
+        prog="sequenoscope",
+        usage="sequenoscope watch --fastq_pass <fastq_pass_dir> --input_reference <ref.fasta> -o <out> [options]\nFor help use: sequenoscope watch -h or --help",
+        description="%(prog)s version {}: a flexible tool for processing multiplatform sequencing data: analyze, subset/filter, compare and visualize.".format(__version__),
+        formatter_class=ap.RawTextHelpFormatter
+    )
+
+    # USER OPTIONS: Essential inputs and outputs
+    user_group = parser.add_argument_group("USER OPTIONS", "Direct input files and basic parameters.")
+    user_group.add_argument("--fastq_pass", metavar="", required=True,
+                        help="[REQUIRED] MinKNOW fastq_pass directory of the running experiment; new FASTQ files in it and its sub-directories are analyzed as they appear.")
+    user_group.add_argument("--input_reference", metavar="", required=True,
+                        help="[REQUIRED] Path to a single reference FASTA file.")
+    user_group.add_argument("-seq_sum", "--sequencing_summary", metavar="",
+                        help="(Optional) Path to the sequencing summary being written by MinKNOW, for manifest creation.")
+    user_group.add_argument("-o", "--output", metavar="", required=True,
+                        help="[REQUIRED] Output directory designation.")
+    user_group.add_argument("-op", "--output_prefix", metavar="", default="sample",
+                        help="Output file prefix designation. Default is 'sample'.")
+
+    # FILTER OPTIONS: Parameters to filter/trim FASTQ reads.
+    filter_group = parser.add_argument_group("FILTER OPTIONS", "Parameters to filter/trim FASTQ reads.")
+    filter_group.add_argument("-min_cov", "--minimum_coverage", default=1, metavar="", type=int,
+                        help="Minimum coverage threshold; default is 1.")
+    filter_group.add_argument("-cov_thresholds", "--coverage_thresholds", metavar="", type=int, nargs="+",
+                        help="Additional coverage thresholds reported as taxon_covered_bases_<N>X columns, e.g. 5 10 20.")
+    filter_group.add_argument("-t", "--threads", default=1, metavar="", type=int,
+                        help="Number of threads to use.")
+    filter_group.add_argument("-min_len", "--minimum_read_length", default=15, metavar="", type=int,
+                        help="Minimum read length; default is 15.")
+    filter_group.add_argument("-max_len", "--maximum_read_length", default=0, metavar="", type=int,
+                        help="Maximum read length; default is 0 (no limit).")
+    filter_group.add_argument("-trm_fr", "--trim_front_bp", default=0, metavar="", type=int,
+                        help="Bases to trim from the front; default is 0.")
+    filter_group.add_argument("-trm_tail", "--trim_tail_bp", default=0, metavar="", type=int,
+                        help="Bases to trim from the tail; default is 0.")
+    filter_group.add_argument("-q", "--quality_threshold", default=15, metavar="", type=int,
+                        help="Quality score threshold; default is 15.")
+
+    # WATCH OPTIONS: How the run directory is followed.
+    watch_group = parser.add_argument_group("WATCH OPTIONS", "How the running experiment is followed.")
+    watch_group.add_argument("--poll_interval", default=DefaultValues.watch_poll_interval, metavar="", type=int,
+                        help="Seconds between checks for new FASTQ files; default is {}.".format(DefaultValues.watch_poll_interval))
+    watch_group.add_argument("--idle_timeout", default=DefaultValues.watch_idle_timeout, metavar="", type=int,
+                        help="Stop after this many seconds without new FASTQ files; default is {}.\nThe watch also stops when MinKNOW writes the final_summary file of the run.".format(DefaultValues.watch_idle_timeout))
+
+    parser.add_argument('--index_cache', metavar="",
+                        help="(Optional) Directory for minimap2 reference indexes; default is <output>/intermediates/minimap2_index.")
+    parser.add_argument('--force', action='store_true', help="Force overwrite of existing results directory.")
+    parser.add_argument('-v', '--version', action='version', version="%(prog)s " + __version__)
+    return parser.parse_args(argv)
+
+
+def find_fastq_chunks(fastq_dir):
+    """
+    Lists the FASTQ files below a directory
+
+    Returns:
+        dict:
+            size in bytes of every FASTQ file keyed by its path
+    """
+    chunks = {}
+    for root, _, files in os.walk(fastq_dir):
+        for file_name in files:
+            if file_name.endswith(FASTQ_SUFFIXES):
+                path = os.path.join(root, file_name)
+                try:
+                    chunks[path] = os.path.getsize(path)
+                except OSError:
+                    continue
+    return chunks
+
+
+def run_finished(fastq_dir):
+    """
+    Returns:
+        bool:
+            True once MinKNOW has written the final summary of the run holding fastq_dir
+    """
+    run_dir = os.path.dirname(os.path.abspath(fastq_dir))
+    return len(glob.glob(os.path.join(run_dir, "final_summary*.txt"))) > 0
+
+
+class LiveAnalysis:
+    out_dir = None
+    out_prefix = None
+    chunks = 0
+
+    def __init__(self, args, logger):
+        """
+        Initalize the class with the watch options and an empty incremental state
+
+        Arguments:
+            args: argparse.Namespace
+                parsed watch options
+            logger: logging.Logger
+                logger of the watch run
+        """
+        self.args = args
+        self.logger = logger
+        self.out_dir = args.output
+        self.out_prefix = args.output_prefix
+        self.intermediate_dir = os.path.join(self.out_dir, "intermediates")
+        self.chunk_dir = os.path.join(self.intermediate_dir, "chunks")
+        self.index_cache = args.index_cache if args.index_cache else os.path.join(self.intermediate_dir, "minimap2_index")
+        self.bam_obj = IncrementalBamProcessor(args.minimum_coverage)
+        self.summary_tail = None
+        self.chunk_generations = {}
+        if args.sequencing_summary:
+            self.summary_tail = SequencingSummaryTail(args.sequencing_summary)
+        self.chunks = 0
+        self.fastp_totals = {'before_bases': 0, 'after_bases': 0, 'after_reads': 0}
+        self.sketcher = MinHashSketcher(self.intermediate_dir, self.out_prefix)
+        self.manifest_file = os.path.join(self.out_dir, f"{self.out_prefix}_manifest.txt")
+        with open(self.manifest_file, 'w') as fout:
+            fout.write("\t".join(SeqManifest.fields) + "\n")
+        # End of the last complete chunk in the manifest
+        self.manifest_size = os.path.getsize(self.manifest_file)
+
+    def scan_chunk(self, chunk_file, chunk_prefix):
+        """
+        Writes the read list and read table of a chunk
+
+        Returns:
+            dict:
+                paths of the read list and read table
+        """
+        scanner_run = FastqScanner(Sequence("Test", [chunk_file]), out_prefix=f"{chunk_prefix}_read_list", out_dir=self.chunk_dir)
+        scanner_run.scan()
+        return dict(scanner_run.result_files)
+
+    def summary_ready(self, read_list_file):
+        """
+        Returns:
+            bool:
+                True when the sequencing summary holds a row for every read of the chunk
+        """
+        if self.summary_tail is None:
+            return True
+        self.summary_tail.update()
+        return self.summary_tail.missing_reads(self.load_read_list(read_list_file)) == 0
+
+    def prune_summary(self, chunk_files, processed):
+        """
+        Releases the sequencing summary rows that no chunk will use. A chunk is tagged with the
+        summary generation current when its file first shows up; rows older than one generation
+        before the oldest chunk still to be analyzed belong to analyzed chunks or to no chunk at all.
+
+        Arguments:
+            chunk_files: iterable
+                paths of the FASTQ files found so far, complete or still growing
+            processed: set
+                paths of the analyzed FASTQ files
+        """
+        if self.summary_tail is None:
+            return
+        for chunk_file in chunk_files:
+            self.chunk_generations.setdefault(chunk_file, self.summary_tail.generation)
+        pending = [self.chunk_generations[path] for path in chunk_files if path not in processed]
+        dropped = self.summary_tail.prune(min(pending, default=self.summary_tail.generation) - 1)
+        if dropped:
+            self.logger.info(f"Released {dropped} sequencing summary rows of reads outside fastq_pass.")
+
+    @staticmethod
+    def load_read_list(read_list_file):
+        """
+        Returns:
+            list:
+                read ids of a read list written by FastqScanner
+        """
+        with open(read_list_file, 'r') as f:
+            return [line.strip() for line in f if line.strip() != 'read_id']
+
+    def process_chunk(self, chunk_file, chunk_prefix, scanner_files):
+        """
+        Filters and maps the reads of a new chunk, folds the alignments into the incremental
+        statistics and appends the manifest rows of the chunk
+
+        Arguments:
+            chunk_file: str
+                path to the new FASTQ file
+            chunk_prefix: str
+                prefix of the intermediate files of the chunk
+            scanner_files: dict
+                read list and read table of the chunk
+        """
+        args = self.args
+        self.logger.info(f"Filtering and mapping the reads of {chunk_file}.")
+        fastp_run_process = FastPRunner(
+            Sequence("Test", [chunk_file]),
+            self.chunk_dir,
+            f"{chunk_prefix}_fastp_output",
+            qualified_quality_phred=args.quality_threshold,
+            min_read_len=args.minimum_read_length,
+            max_read_len=args.maximum_read_length,
+            trim_front_bp=args.trim_front_bp,
+            trim_tail_bp=args.trim_tail_bp,
+            report_only=False,
+            dedup=False,
+            threads=args.threads
+        )
+        fastp_run_process.run_fastp()
+        fastp_files = list(fastp_run_process.result_files["output_files_fastp"])
+        fastp_json = GeneralSeqParser(fastp_run_process.result_files["json"], "json").parsed_file
+        self.fastp_totals['before_bases'] += fastp_json["summary"]["before_filtering"]["total_bases"]
+        self.fastp_totals['after_bases'] += fastp_json["summary"]["after_filtering"]["total_bases"]
+        self.fastp_totals['after_reads'] += fastp_json["summary"]["after_filtering"]["total_reads"]
+
+        minimap_run_process = Minimap2Runner(
+            Sequence("Test", fastp_files),
+            self.chunk_dir,
+            args.input_reference,
+            f"{chunk_prefix}_mapped_bam",
+            threads=args.threads,
+            index_cache=self.index_cache
+        )
+        minimap_run_process.run_minimap2_sorted_bam()
+        chunk_bam = minimap_run_process.result_files["bam_output"]
+        self.bam_obj.add_bam(chunk_bam)
+
+        # The sketch keeps growing with every chunk, so the estimates always cover all filtered reads
+        self.sketcher.add_files(fastp_files)
+
+        if self.summary_tail is not None:
+            self.summary_tail.update()
+        if self.summary_tail is not None and self.summary_tail.header is not None:
+            chunk_summary = os.path.join(self.chunk_dir, f"{chunk_prefix}_sequencing_summary.txt")
+            self.summary_tail.write_rows(self.load_read_list(scanner_files["read_list_file"]), chunk_summary)
+            manifest_run = SeqManifest(
+                self.out_prefix,
+                chunk_bam,
+                f"{chunk_prefix}_manifest",
+                out_dir=self.chunk_dir,
+                min_coverage=args.minimum_coverage,
+                fastp_fastq=fastp_files,
+                read_list=scanner_files["read_list_file"],
+                in_seq_summary=chunk_summary,
+                bam_obj=self.bam_obj
+            )
+        else:
+            manifest_run = SeqManifest(
+                self.out_prefix,
+                chunk_bam,
+                f"{chunk_prefix}_manifest",
+                out_dir=self.chunk_dir,
+                min_coverage=args.minimum_coverage,
+                fastp_fastq=fastp_files,
+                read_list=scanner_files["read_list_file"],
+                read_table=scanner_files["read_table_file"],
+                start_time=0,
+                end_time=100,
+                bam_obj=self.bam_obj
+            )
+        self.append_manifest(manifest_run.manifest_file)
+        self.chunks += 1
+
+    def append_manifest(self, chunk_manifest):
+        """
+        Appends the rows of a chunk manifest to the run manifest. An append that fails or is
+        interrupted is cut back to the end of the previous chunk, so the manifest never holds a
+        partial chunk and each append costs the rows of the new chunk only.
+
+        Arguments:
+            chunk_manifest: str
+                path of the manifest of the chunk, with a header row
+        """
+        with open(chunk_manifest, 'rb') as fin, open(self.manifest_file, 'r+b') as fout:
+            fin.readline()
+            fout.seek(self.manifest_size)
+            fout.truncate()
+            try:
+                shutil.copyfileobj(fin, fout)
+                fout.flush()
+                os.fsync(fout.fileno())
+            except BaseException:
+                fout.truncate(self.manifest_size)
+                raise
+            self.manifest_size = fout.tell()
+
+    def fastp_summary(self):
+        """
+        Returns:
+            dict:
+                the fastp report fields used by the manifest summary, totalled over all chunks
+        """
+        after_reads = self.fastp_totals['after_reads']
+        mean_length = int(self.fastp_totals['after_bases'] / after_reads) if after_reads else 0
+        return {"summary": {"before_filtering": {"total_bases": self.fastp_totals['before_bases']},
+                            "after_filtering": {"total_bases": self.fastp_totals['after_bases'],
+                                                "read1_mean_length": mean_length}}}
+
+    def write_summary(self, genome_size, coverage):
+        """
+        Rewrites the manifest summary from the incremental statistics. The summary is written
+        next to the intermediates and moved into place, so readers never see a partial file.
+        """
+        out_prefix = f"{self.out_prefix}_manifest_summary"
+        seq_summary_run = SeqManifestSummary(
+            self.out_prefix,
+            self.bam_obj,
+            out_prefix,
+            out_dir=self.intermediate_dir,
+            genome_size=genome_size,
+            coverage=coverage,
+            fastp_json_file=self.fastp_summary(),
+            paired=False,
+            coverage_thresholds=self.args.coverage_thresholds
+        )
+        seq_summary_run.generate_summary()
+        os.replace(os.path.join(self.intermediate_dir, f"{out_prefix}.txt"), os.path.join(self.out_dir, f"{out_prefix}.txt"))
+
+    def update_summary(self):
+        """
+        Refreshes the manifest summary after a chunk with the estimates of the sketch so far
+        """
+        sketch_results = self.sketcher.get_results()
+        self.write_summary(sketch_results["Genome Size"], sketch_results["Coverage"])
+
+    def finish(self):
+        """
+        Completes the order statistics and writes the final manifest summary
+        """
+        if self.chunks == 0:
+            return
+        self.bam_obj.finalize()
+        sketch_results = self.sketcher.get_results()
+        self.write_summary(sketch_results["Genome Size"], sketch_results["Coverage"])
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    out_directory = args.output
+    fastq_dir = args.fastq_pass
+
+    if not os.path.isdir(fastq_dir):
+        print(f"Error: {fastq_dir} is not a directory.", file=sys.stderr)
+        sys.exit(1)
+    if not os.path.isdir(out_directory):
+        os.mkdir(out_directory, 0o755)
+    elif not args.force:
+        print(f"Error: Directory {out_directory} already exists. Use --force to overwrite.", file=sys.stderr)
+        sys.exit()
+    intermediate_dir = os.path.join(out_directory, "intermediates")
+    chunk_dir = os.path.join(intermediate_dir, "chunks")
+    os.makedirs(chunk_dir, 0o755, exist_ok=True)
+
+    log_filepath = os.path.join(out_directory, "watch.log")
+    logger = logging.getLogger("sequenoscope_watch")
+    logger.setLevel(logging.INFO)
+    fh = logging.FileHandler(log_filepath, mode='w')
+    fh.setLevel(logging.INFO)
+    formatter = logging.Formatter('%(asctime)s [%(levelname)s]: %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    fh.setFormatter(formatter)
+    logger.addHandler(fh)
+
+    logger.info("Starting 'sequenoscope watch' module.")
+    logger.info(f"Version: {__version__}")
+    logger.info(f"FASTQ directory: {fastq_dir}")
+    logger.info(f"Reference FASTA: {args.input_reference}")
+    if args.sequencing_summary:
+        logger.info(f"Sequencing Summary: {args.sequencing_summary}")
+    logger.info(f"Output directory: {out_directory}")
+    logger.info(f"Poll interval: {args.poll_interval}s, idle timeout: {args.idle_timeout}s")
+
+    print("-" * 40)
+    print(f"sequenoscope watch version {__version__}: Following {fastq_dir}...")
+    print("-" * 40)
+
+    pipeline_start_time = time.time()
+    live = LiveAnalysis(args, logger)
+    processed = set()
+    scanned = {}
+    last_sizes = {}
+    last_new_chunk = time.time()
+
+    # A chunk is analyzed once its size is unchanged between two polls, and, with a sequencing
+    # summary, once the summary has a row for each of its reads. After the run has finished
+    # every remaining chunk is analyzed.
+    try:
+        while True:
+            finished = run_finished(fastq_dir)
+            sizes = find_fastq_chunks(fastq_dir)
+            live.prune_summary(sizes, processed)
+            ready = [path for path, size in sorted(sizes.items())
+                     if path not in processed and size > 0 and (finished or last_sizes.get(path) == size)]
+            last_sizes = sizes
+            for chunk_file in ready:
+                if chunk_file not in scanned:
+                    chunk_prefix = f"{live.out_prefix}_chunk{len(scanned) + 1}"
+                    scanned[chunk_file] = (chunk_prefix, live.scan_chunk(chunk_file, chunk_prefix))
+                chunk_prefix, scanner_files = scanned[chunk_file]
+                if not finished and not live.summary_ready(scanner_files["read_list_file"]):
+                    logger.info(f"Waiting for the sequencing summary rows of {chunk_file}.")
+                    continue
+                chunk_start = time.time()
+                live.process_chunk(chunk_file, chunk_prefix, scanner_files)
+                live.update_summary()
+                processed.add(chunk_file)
+                last_new_chunk = time.time()
+                logger.info(f"Chunk {chunk_file} added in {format_time(time.time() - chunk_start)} ({live.chunks} chunks so far).")
+                print(f"{chunk_file}: added ({live.chunks} chunks so far)")
+            if finished and all(path in processed for path in find_fastq_chunks(fastq_dir)):
+                logger.info("The run has finished.")
+                break
+            if time.time() - last_new_chunk > args.idle_timeout:
+                logger.info(f"No new FASTQ files for {args.idle_timeout}s; stopping.")
+                break
+            time.sleep(args.poll_interval)
+    except KeyboardInterrupt:
+        logger.info("Interrupted; writing the final summary.")
+
+    live.finish()
+
+    total_runtime = format_time(time.time() - pipeline_start_time)
+    print("-" * 40)
+    print(f"Analyzed {live.chunks} chunks.")
+    print(f"Total runtime: {total_runtime}")
+    print("-" * 40)
+    logger.info(f"Analyzed {live.chunks} chunks.")
+    logger.info(f"Total runtime: {total_runtime}")
+    logger.info("All operations are complete.")
+
+
+if __name__ == '__main__':
+    run()
@@ -62,6 +62,11 @@ setup(
         'six'
     ],
 
+    extras_require={
+        'columnar': ['pyarrow'],
+        'mappy': ['mappy'],
+    },
+
     entry_points={
         'console_scripts': [
             'sequenoscope=sequenoscope.main:main',